@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 7:30 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+"""Per-sample cost of the coarse prediction lookup of :class:`ssc_scoring.mymodules.mytrans.CoresPosd` and
+:meth:`ssc_scoring.mymodules.mytrans.CropCorseRegiond.corse_pred` for different cohort sizes.
+
+Fake `valid_data.csv` and `valid_pred_world.csv` files are written for each cohort size, then the predictions of
+random patients are looked up `--nb_lookup` times. The cost per sample should not depend on the cohort size.
+
+Usage:
+
+    python -m ssc_scoring.benchmarks.corse_lookup --nb_lookup 10000
+
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+import medutils.medutils as futil
+import numpy as np
+
+from ssc_scoring.mymodules.mytrans import CoresPosd, CropCorseRegiond
+
+
+def make_fake_csv(root: str, nb_pats: int):
+    data_fpath = os.path.join(root, str(nb_pats) + '_valid_data.csv')
+    pred_world_fpath = os.path.join(root, str(nb_pats) + '_valid_pred_world.csv')
+    img_fpaths = [os.path.join(root, 'Pat_' + str(i).zfill(3) + '_CTimage.mha') for i in range(nb_pats)]
+    with open(data_fpath, 'w') as f:
+        writer = csv.writer(f)
+        for img_fpath in img_fpaths:
+            writer.writerow([img_fpath, [100, 200, 300, 400, 500]])
+    futil.appendrows_to(pred_world_fpath, np.random.rand(nb_pats, 5) * 500, head=['L1', 'L2', 'L3', 'L4', 'L5'])
+    return data_fpath, pred_world_fpath, img_fpaths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the coarse prediction lookup.")
+    parser.add_argument('--nb_lookup', help='number of lookups per cohort size', type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        for nb_pats in [10, 100, 1000]:  # patient ids have 3 digits
+            data_fpath, pred_world_fpath, img_fpaths = make_fake_csv(tempdir, nb_pats)
+            cores_posd = CoresPosd(corse_fpath=pred_world_fpath, data_fpath=data_fpath)
+            crop = CropCorseRegiond(level_node=0, train_on_level=1, height=10, rand_start=False, start=0,
+                                    data_fpath=data_fpath, pred_world_fpath=pred_world_fpath)
+            samples = [random.choice(img_fpaths) for _ in range(args.nb_lookup)]
+
+            t0 = time.time()
+            for fpath in samples:
+                cores_posd({'fpath_key': fpath})
+            t1 = time.time()
+            for fpath in samples:
+                crop.corse_pred(fpath)
+            t2 = time.time()
+            print(f"{nb_pats} patients: CoresPosd {(t1 - t0) / args.nb_lookup * 1e6:.1f} us/sample, "
+                  f"CropCorseRegiond.corse_pred {(t2 - t1) / args.nb_lookup * 1e6:.1f} us/sample")
+
+
+if __name__ == "__main__":
+    main()
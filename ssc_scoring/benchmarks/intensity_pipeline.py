@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 11:42 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+"""Time and peak memory of the intensity pipeline (clip -> cast -> standardize) of
+:class:`ssc_scoring.mymodules.mytrans.LoadDatad` and :class:`ssc_scoring.mymodules.mytrans.NormImgPosd`.
+
+The old pipeline (boolean-mask clipping, `astype`, separate mean and std, two full-size temporaries) is compared with
+the kernels of :mod:`ssc_scoring.mymodules.intensity` on a random int16 volume of `--shape`. Peak memory is the peak
+of numpy allocations traced by `tracemalloc` above the input volume.
+
+Usage:
+
+    python -m ssc_scoring.benchmarks.intensity_pipeline --shape 1000 512 512
+
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from ssc_scoring.mymodules.intensity import clip_cast, standardize
+
+
+def old_pipeline(x: np.ndarray) -> np.ndarray:
+    x = x.copy()  # LoadDatad modified the loaded image in place
+    x[x < -1500] = -1500
+    x[x > 1500] = 1500
+    x = x.astype(np.float32)
+    mean, std = np.mean(x), np.std(x)
+    x = x - mean
+    x = x / std
+    return x
+
+
+def new_pipeline(x: np.ndarray) -> np.ndarray:
+    x = clip_cast(x, -1500, 1500, np.float32)
+    return standardize(x, inplace=True)
+
+
+def measure(func, x: np.ndarray):
+    tracemalloc.start()
+    t0 = time.time()
+    out = func(x)
+    t = time.time() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, t, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the intensity pipeline of 3D CT scans.")
+    parser.add_argument('--shape', help='shape of the volume, z y x', type=int, nargs=3, default=[1000, 512, 512])
+    args = parser.parse_args()
+
+    x = np.random.default_rng(0).integers(-3000, 3000, args.shape, dtype=np.int16)
+    print(f"volume {args.shape}, int16: {x.nbytes / 1024 ** 3:.2f} GB, float32: {x.nbytes * 2 / 1024 ** 3:.2f} GB")
+    results = {}
+    for name, func in [('old', old_pipeline), ('new', new_pipeline)]:
+        out, t, peak = measure(func, x)
+        results[name] = out
+        print(f"{name}: {t:.2f} s, peak memory {peak / 1024 ** 3:.2f} GB")
+        del out
+    print(f"max abs difference: {np.max(np.abs(results['old'] - results['new'])):.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/19/26 2:35 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+"""Time of one occlusion sensitivity map of a 512x512 slice, per position (one `cv2.blur` and one forward pass per
+position, as `occlusion_sensitivity.py` did before) and batched (:func:`ssc_scoring.mymodules.occlusion.occlusion_maps`).
+
+The network `--net` is built with random weights. The loop is timed on its first `--nb_loop` positions and
+extrapolated to all positions in the lung, which is a random ellipse covering about half of the slice.
+
+Usage:
+
+    python -m ssc_scoring.benchmarks.occlusion_throughput --net cnn3fc1 --patch_size 64 --stride 8
+
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from ssc_scoring.mymodules.networks.cnn_fc2d import get_net
+from ssc_scoring.mymodules.occlusion import occlusion_maps, occlusion_positions
+from ssc_scoring.mymodules.set_args import get_args
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of occlusion sensitivity maps.")
+    parser.add_argument('--net', help='network name of cnn_fc2d.get_net', type=str, default='cnn3fc1')
+    parser.add_argument('--patch_size', help='side length of the occluded patch', type=int, default=64)
+    parser.add_argument('--stride', help='stride between 2 positions', type=int, default=8)
+    parser.add_argument('--batch_size', help='occluded slices per forward pass, 0 means by free memory', type=int,
+                        default=0)
+    parser.add_argument('--nb_loop', help='number of positions timed for the loop', type=int, default=20)
+    args = parser.parse_args()
+
+    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+    net = get_net(args.net, 3, get_args([])).to(device).eval()
+    x = np.random.rand(512, 512)
+    occ_patch = np.random.rand(512, 512)
+    yy, xx = np.mgrid[:512, :512]
+    lung_mask = (((yy - 256) / 200) ** 2 + ((xx - 256) / 160) ** 2 < 1).astype(float)
+    positions = occlusion_positions(torch.tensor(lung_mask), args.patch_size, args.stride).numpy()
+
+    with torch.no_grad():
+        t0 = time.time()
+        for i, j in positions[:args.nb_loop]:
+            mask_ori = np.zeros((512, 512))
+            mask_ori[i: i + args.patch_size, j: j + args.patch_size] = 1
+            mask = cv2.blur(mask_ori * lung_mask, (5, 5))
+            tmp = x * (1 - mask) + occ_patch * mask
+            net(torch.tensor(tmp).float()[None, None].to(device)).cpu()
+        t_loop = (time.time() - t0) / min(args.nb_loop, len(positions)) * len(positions)
+
+    t0 = time.time()
+    occlusion_maps(net, x, occ_patch, lung_mask, args.patch_size, args.stride, args.batch_size, device)
+    t_batch = time.time() - t0
+    print(f"{len(positions)} positions on {device}: loop {t_loop:.1f} s (extrapolated), batched {t_batch:.1f} s, "
+          f"speedup {t_loop / t_batch:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 11:20 AM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+"""Memory benchmark of :class:`ssc_scoring.mymodules.datasets.SynDataset` with different numbers of DataLoader workers.
+
+After one full epoch, the unique set size (USS, memory which is private to a process) of the main process and all
+workers is summed. With the packed, memory-mapped slice store the sum should stay flat when workers are added.
+
+Usage:
+
+    python -m ssc_scoring.benchmarks.packed_store_memory --nb_pats 20 --workers 0 2 4 6
+
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+import os
+import tempfile
+
+import psutil
+from torch.utils.data import DataLoader
+
+from ssc_scoring.benchmarks.slice_cache_startup import make_fake_pats
+from ssc_scoring.mymodules.datasets import SynDataset
+
+
+def uss_mb(process: psutil.Process) -> float:
+    procs = [process, *process.children(recursive=True)]
+    return sum(p.memory_full_info().uss for p in procs) / 2. ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory benchmark of the packed slice store.")
+    parser.add_argument('--nb_pats', help='number of synthetic patients', type=int, default=20)
+    parser.add_argument('--workers', help='numbers of workers to compare', type=int, nargs='+', default=[0, 2, 4, 6])
+    args = parser.parse_args()
+
+    main_process = psutil.Process(os.getpid())
+    with tempfile.TemporaryDirectory() as tempdir:
+        x, y = make_fake_pats(os.path.join(tempdir, 'data'), args.nb_pats)
+        for cache_dir in [None, os.path.join(tempdir, 'slice_cache')]:
+            dataset = SynDataset(x, y, synthesis=False, require_lung_mask=True, cache_dir=cache_dir)
+            for workers in args.workers:
+                loader = DataLoader(dataset, batch_size=10, shuffle=True, num_workers=workers,
+                                    persistent_workers=workers > 0)
+                for _ in loader:
+                    pass
+                print(f"memmap: {cache_dir is not None}, workers: {workers}, "
+                      f"USS of all processes: {uss_mb(main_process):.0f} MB")
+                del loader
+            del dataset
+
+
+if __name__ == "__main__":
+    main()
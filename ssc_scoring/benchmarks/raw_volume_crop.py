@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 10:58 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+"""Time and bytes read per sample of the position prediction transforms, from the `.mha` scan
+(:class:`ssc_scoring.mymodules.mytrans.LoadDatad`) and from its uncompressed copy
+(:class:`ssc_scoring.mymodules.mytrans.RawLoadDatad`).
+
+A fake scan of `--shape` is written to a temporary directory. For a random crop of the whole field of view and for a
+level-specific crop (`--train_on_level`), the transforms of :func:`ssc_scoring.mymodules.composed_trans.xformd_pos`
+are called `--nb_sample` times. The bytes read from the uncompressed copy are the bytes of the cropped patch, the
+`.mha` scan is always read completely. The timings include the page cache, so the first epoch from disk differs more.
+
+Usage:
+
+    python -m ssc_scoring.benchmarks.raw_volume_crop --shape 600 512 512 --nb_sample 20
+
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from medutils.medutils import save_itk
+
+from ssc_scoring.mymodules.composed_trans import xformd_pos
+from ssc_scoring.mymodules.raw_volume import convert_to_raw, raw_fpath
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of reading cropped patches from uncompressed scans.")
+    parser.add_argument('--shape', help='shape of the fake scan, z y x', type=int, nargs=3, default=[600, 512, 512])
+    parser.add_argument('--nb_sample', help='number of samples per setting', type=int, default=20)
+    parser.add_argument('--z_size', help='length of patch along z axil ', type=int, default=192)
+    parser.add_argument('--y_size', help='length of patch along y axil ', type=int, default=256)
+    parser.add_argument('--x_size', help='length of patch along x axil ', type=int, default=256)
+    parser.add_argument('--train_on_level', help='level of the level-specific crop', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        fpath = os.path.join(tempdir, 'Pat_001_CTimage.mha')
+        img = np.random.randint(-1500, 1500, args.shape).astype(np.int16)
+        save_itk(fpath, img, (0., 0., 0.), (1., 0.7, 0.7))
+        convert_to_raw(fpath)
+        print(f"scan: {os.path.getsize(fpath) / 1024 ** 2:.1f} MB (mha), "
+              f"{os.path.getsize(raw_fpath(fpath)) / 1024 ** 2:.1f} MB (raw)")
+        world_pos = np.linspace(args.shape[0] * 0.2, args.shape[0] * 0.8, 5)
+        data = {'fpath_key': fpath, 'world_key': world_pos}
+
+        settings = {'whole field of view': dict(z_size=args.z_size, y_size=args.y_size, x_size=args.x_size),
+                    f'level {args.train_on_level}': dict(train_on_level=args.train_on_level, z_size=args.z_size)}
+        for name, kwargs in settings.items():
+            for raw_volume in [False, True]:
+                trans = xformd_pos('train', raw_volume=raw_volume, **kwargs)
+                t0 = time.time()
+                for _ in range(args.nb_sample):
+                    patch = trans(dict(data))['image_key']
+                t = (time.time() - t0) / args.nb_sample
+                read_mb = (patch[0].size * img.itemsize if raw_volume else os.path.getsize(fpath)) / 1024 ** 2
+                print(f"{name}, {'raw' if raw_volume else 'mha'}: {t * 1000:.1f} ms/sample, {read_mb:.1f} MB read")
+
+
+if __name__ == "__main__":
+    main()
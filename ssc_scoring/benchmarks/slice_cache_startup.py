@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 10:05 AM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+"""Cold/warm start-up benchmark of :class:`ssc_scoring.mymodules.datasets.SynDataset` with the on-disk slice cache.
+
+Synthetic patients (5 levels x 3 slices of 512x512, lung masks and a weight map per patient) are written to a
+temporary directory. `SynDataset` is then built three times: without cache, with an empty cache (cold) and with a
+filled cache (warm).
+
+Usage:
+
+    python -m ssc_scoring.benchmarks.slice_cache_startup --nb_pats 20
+
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from medutils.medutils import save_itk
+
+from ssc_scoring.mymodules.datasets import SynDataset
+
+
+def make_fake_pats(root: str, nb_pats: int, size: int = 512):
+    x, y = [], []
+    rng = np.random.default_rng(0)
+    for pat in range(nb_pats):
+        pat_dir = os.path.join(root, 'Pat_' + str(pat).zfill(3))
+        os.makedirs(pat_dir)
+        np.save(os.path.join(pat_dir, 'weight_map.npy'), rng.random((size, size)))
+        for level in [1, 2, 3, 4, 5]:
+            for pos in ['up', 'middle', 'down']:
+                fpath = os.path.join(pat_dir, 'Level' + str(level) + '_' + pos + '.mha')
+                img = rng.integers(-2000, 2000, (size, size)).astype(np.int16)
+                save_itk(fpath, img, (-100., 100., 100.), (1., 0.7, 0.7))
+                save_itk(fpath.split('.mha')[0] + '_lung_mask.mha', (img > 0).astype(np.uint8),
+                         (-100., 100., 100.), (1., 0.7, 0.7))
+                x.append(fpath)
+                y.append(np.array([0, 0, 0]))
+    return x, y
+
+
+def timeit(x, y, cache_dir):
+    t0 = time.time()
+    SynDataset(x, y, synthesis=False, require_lung_mask=True, cache_dir=cache_dir)
+    return time.time() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start-up benchmark of the 2D slice cache.")
+    parser.add_argument('--nb_pats', help='number of synthetic patients', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        x, y = make_fake_pats(os.path.join(tempdir, 'data'), args.nb_pats)
+        cache_dir = os.path.join(tempdir, 'slice_cache')
+        t_no_cache = timeit(x, y, None)
+        t_cold = timeit(x, y, cache_dir)
+        t_warm = timeit(x, y, cache_dir)
+
+    print(f"{len(x)} slices")
+    print(f"no cache: {t_no_cache:.2f} s")
+    print(f"cold cache: {t_cold:.2f} s")
+    print(f"warm cache: {t_warm:.2f} s, {t_no_cache / t_warm:.1f}x faster than no cache")
+
+
+if __name__ == "__main__":
+    main()
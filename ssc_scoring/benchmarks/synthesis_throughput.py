@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 5:20 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+"""Throughput (synthetic images per second in one worker) of
+:class:`ssc_scoring.mymodules.data_synthesis.SysthesisNewSampled`.
+
+Fake retp/gg eggs, a 512x512 slice, its lung mask and weight map are generated in a temporary directory, then
+the transform is called `--nb_img` times with and without the _balanced sampler. Each call synthesizes one image and
+accounts its label, as in a DataLoader worker.
+
+The script only uses the constructor and `__call__`, so it also runs against older versions of `data_synthesis.py`
+(e.g. checkout the old file) to get the numbers before an optimization.
+
+Usage:
+
+    python -m ssc_scoring.benchmarks.synthesis_throughput --nb_img 200
+
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import torch
+from medutils.medutils import save_itk
+
+from ssc_scoring.mymodules.data_synthesis import SysthesisNewSampled
+
+
+def make_fake_inputs(root: str, size: int = 512):
+    rng = np.random.default_rng(0)
+    for pattern in ['retp', 'gg']:
+        egg = rng.integers(-1000, 200, (64, 64)).astype(np.int16)
+        save_itk(os.path.join(root, pattern, pattern + '.mha'), egg, (0., 0.), (1., 1.))
+
+    img = torch.from_numpy(rng.random((size, size)).astype(np.float32))
+    lung_mask = np.zeros((size, size), dtype=np.float32)
+    cv2.ellipse(lung_mask, (size // 3, size // 2), (size // 8, size // 4), 0, 0, 360, 1, -1)
+    cv2.ellipse(lung_mask, (size * 2 // 3, size // 2), (size // 8, size // 4), 0, 0, 360, 1, -1)
+    weight_map = cv2.blur(lung_mask, (51, 51)).astype(np.float64)
+    return img, lung_mask, weight_map
+
+
+def timeit(root: str, img, lung_mask, weight_map, nb_img: int, sampler: int, weighted_syn_region: int) -> float:
+    synthesis = SysthesisNewSampled(key='image_key',
+                                    retp_fpath=os.path.join(root, 'retp', 'retp.mha'),
+                                    gg_fpath=os.path.join(root, 'gg', 'gg.mha'),
+                                    mode='train', sys_pro_in_0=1.0, retp_blur=20, gg_blur=20, sampler=sampler,
+                                    gen_gg_as_retp=1, gg_increase=0.1, tr_x=[],
+                                    weighted_syn_region=weighted_syn_region)
+    data = {'image_key': img, 'label_key': torch.zeros(3), 'lung_mask_key': lung_mask, 'weight_map_key': weight_map}
+    synthesis(data)  # warm up
+    t0 = time.time()
+    for _ in range(nb_img):
+        synthesis(data)
+    return nb_img / (time.time() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmark of synthetic image generation.")
+    parser.add_argument('--nb_img', help='number of synthetic images', type=int, default=200)
+    parser.add_argument('--weighted_syn_region', choices=(1, 0), help='sample ellipse centers by weight map',
+                        type=int, default=0)
+    args = parser.parse_args()
+
+    if args.weighted_syn_region:
+        os.makedirs('results', exist_ok=True)  # ellipse positions are saved to results/ellipse_position2.csv
+    cv2.setNumThreads(1)  # one DataLoader worker
+    torch.set_num_threads(1)
+    with tempfile.TemporaryDirectory() as tempdir:
+        img, lung_mask, weight_map = make_fake_inputs(tempdir)
+        for sampler in [0, 1]:
+            speed = timeit(tempdir, img, lung_mask, weight_map, args.nb_img, sampler, args.weighted_syn_region)
+            print(f"sampler={sampler}: {speed:.1f} images/s per worker")
+
+
+if __name__ == "__main__":
+    main()
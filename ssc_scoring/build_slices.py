@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/20/26 2:10 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+"""Build all files derived from the 3D scans and lung masks of the patients, with one pass over each patient.
+
+For each `Pat_*` directory with `CTimage.mha` and `CTimage_lung.mha` (see `extract_lung.py`) in the dataset directory,
+the products are:
+
+- 'slices': `Level{1-5}_{up,middle,down}.mha`, the slices at the level positions `L*_pos` of the label excel file.
+- 'masked': `Level{1-5}_{up,middle,down}_MaskedByLung.mha`, the same slices with -2048 outside of the lung.
+- 'lung_mask': `Level{1-5}_{up,middle,down}_lung_mask.mha`, the lung masks of the same slices.
+- 'weight_map': `weight_map.npy`, the weight map of the synthesis, see `create_weight_maps_for_ssc_synthesis.py`.
+- 'corse': `Level{1-5}_{up,middle,down}.mha` in `{id_dir}/predicted_slices/Pat_*` of a position experiment
+  `--corse_ex_id`, the slices at the positions predicted by this experiment, see `save_corse_slices.py`.
+
+Like make, a product of a patient is only built again if one of its files is missing or one of its inputs (the
+modification time of the scan or the lung mask, the level positions) differs from the last build, which is recorded
+in `build_index.json` in the output directory. The scan and the lung mask of a patient are loaded at most once, only
+if a product which needs them is stale, and patients are built by a pool of processes. The index is updated after each
+finished patient, so an interrupted run is continued by starting it again.
+
+Usage:
+
+    python build_slices.py --workers 8
+    python build_slices.py --products corse --corse_ex_id 193 --corse_mode test
+
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from filelock import FileLock
+from tqdm import tqdm
+
+from ssc_scoring.mymodules.tool import ordered_map
+
+INDEX_FNAME = 'build_index.json'
+INDEX_VERSION = 1
+PRODUCTS = ('slices', 'masked', 'lung_mask', 'weight_map', 'corse')
+DEPS = {'slices': ('ct', 'positions'),
+        'masked': ('ct', 'lung', 'positions'),
+        'lung_mask': ('lung', 'positions'),
+        'weight_map': ('lung',),
+        'corse': ('ct', 'corse_positions')}
+SUFFIX = {'slices': '', 'masked': '_MaskedByLung', 'lung_mask': '_lung_mask', 'corse': ''}
+LEVELS = [1, 2, 3, 4, 5]
+POSITIONS = ('up', 'middle', 'down')
+
+
+def load_index(index_dir: str) -> Dict:
+    """The build index in `index_dir`, an empty index if it does not exist or can not be read."""
+    try:
+        with open(os.path.join(index_dir, INDEX_FNAME)) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {'version': INDEX_VERSION, 'pats': {}}
+    if index.get('version') != INDEX_VERSION:
+        return {'version': INDEX_VERSION, 'pats': {}}
+    return index
+
+
+def save_index(index_dir: str, index: Dict) -> None:
+    fpath = os.path.join(index_dir, INDEX_FNAME)
+    tmp_fpath = fpath + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_fpath, 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp_fpath, fpath)
+
+
+def product_fpaths(product: str, out_dir: str) -> List[str]:
+    """Files of `product` of one patient in `out_dir`."""
+    if product == 'weight_map':
+        return [os.path.join(out_dir, 'weight_map.npy')]
+    return [os.path.join(out_dir, f"Level{level}_{pos}{SUFFIX[product]}.mha") for level in LEVELS
+            for pos in POSITIONS]
+
+
+def slice_indices(positions: Sequence[float], ori_z: float, sp_z: float, up: int = -1) -> Dict[str, List[int]]:
+    """Slice numbers of the 3 neighboring slices of each level, from the world positions of the 5 levels.
+
+    Args:
+        positions: World positions along z of the 5 levels.
+        ori_z: Origin along z.
+        sp_z: Spacing along z.
+        up: Offset of the 'up' slice from the 'middle' slice. The 'down' slice has the opposite offset. The slices of
+            the label positions use -1 (`generate_ct_masked_by_lung.py`), the slices of the predicted positions use 1
+            (:class:`ssc_scoring.mymodules.mytrans.SliceFromCorsePosd`).
+
+    """
+    middle = [int((position - ori_z) / sp_z) for position in positions]
+    return {'up': [i + up for i in middle], 'middle': middle, 'down': [i - up for i in middle]}
+
+
+def save_atomic(fpath: str, arr: np.ndarray, ori: Sequence[float] = (), sp: Sequence[float] = ()) -> None:
+    """Save `arr` to a hidden temporary file and rename it, so a half-written file is never read."""
+    from medutils.medutils import save_itk
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    tmp_fpath = os.path.join(os.path.dirname(fpath), '.' + str(os.getpid()) + '_' + os.path.basename(fpath))
+    if fpath.endswith('.npy'):
+        with open(tmp_fpath, 'wb') as f:
+            np.save(f, arr)
+    else:
+        save_itk(tmp_fpath, arr, ori, sp)
+    os.replace(tmp_fpath, fpath)
+
+
+def build_patient(job: Dict) -> Dict[str, Dict]:
+    """Build the stale products of one patient.
+
+    Args:
+        job: A dict with the keys 'ct' and 'lung' (file paths), 'positions' and 'corse_positions' (world positions of
+            the 5 levels or None), 'out_dirs' ({product: output directory}), 'products' (the stale products) and
+            'stamps' ({product: inputs of the product}).
+
+    Returns:
+        {product: stamp} of the built products.
+
+    """
+    from medutils.medutils import load_itk
+    needs = {dep for product in job['products'] for dep in DEPS[product]}
+    if 'ct' in needs:
+        ct, ori, sp = load_itk(job['ct'], require_ori_sp=True)
+    if 'lung' in needs:
+        lu, ori, sp = load_itk(job['lung'], require_ori_sp=True)
+        lu = lu.astype(np.int16, copy=False)  # uint8 masks would overflow in `(1 - lu) * 2048`
+
+    built = {}
+    for product in job['products']:
+        fpaths = iter(product_fpaths(product, job['out_dirs'][product]))
+        if product == 'weight_map':
+            from ssc_scoring.create_weight_maps_for_ssc_synthesis import weight_map
+            save_atomic(next(fpaths), weight_map(lu))
+        elif product == 'corse':
+            from ssc_scoring.mymodules.intensity import clip_cast
+            indices = slice_indices(job['corse_positions'], ori[0], sp[0], up=1)
+            for level_idx in range(len(LEVELS)):
+                for pos in POSITIONS:
+                    i = indices[pos][level_idx]
+                    # slice does not have origin and space along z
+                    save_atomic(next(fpaths), clip_cast(ct[i], -1500, 1500, np.float32), ori[1:], sp[1:])
+        else:
+            indices = slice_indices(job['positions'], ori[0], sp[0])
+            for level_idx in range(len(LEVELS)):
+                for pos in POSITIONS:
+                    i = indices[pos][level_idx]
+                    if product == 'slices':
+                        out = ct[i]
+                    elif product == 'masked':
+                        out = lu[i] * ct[i] - (1 - lu[i]) * 2048
+                    else:
+                        out = lu[i]
+                    save_atomic(next(fpaths), out, ori, sp)
+        built[product] = job['stamps'][product]
+    return built
+
+
+def stamp_of(product: str, inputs: Dict) -> Dict:
+    """The inputs of `product`, which are compared with the last build."""
+    return {dep: inputs[dep] for dep in DEPS[product]}
+
+
+def is_up_to_date(entry: Optional[Dict], stamp: Dict, fpaths: Sequence[str]) -> bool:
+    return entry == stamp and all(os.path.isfile(fpath) for fpath in fpaths)
+
+
+def build(data_dir: str, products: Sequence[str] = ('slices', 'masked', 'lung_mask', 'weight_map'),
+          label_file: Optional[str] = None, corse: Optional[Tuple[str, str, str]] = None, workers: int = 0) -> int:
+    """Build the stale `products` of all patients in `data_dir`.
+
+    Args:
+        data_dir: Directory with the `Pat_*` directories of the 3D scans and the lung masks.
+        products: Products to build, see :data:`PRODUCTS`.
+        label_file: Label excel file with the level positions `L*_pos`, needed by 'slices', 'masked' and 'lung_mask'.
+        corse: (data file, predicted world positions file, output directory) of a position experiment, e.g.
+            `test_data.csv`, `test_pred_world.csv` and `{id_dir}/predicted_slices`, needed by 'corse'.
+        workers: Number of processes, 0 means all patients in this process.
+
+    Returns:
+        Number of patients with rebuilt products.
+
+    Examples:
+        `generate_ct_masked_by_lung.py`, `create_weight_maps_for_ssc_synthesis.py` and `save_corse_slices.py`
+
+    """
+    for product in products:
+        if product not in PRODUCTS:
+            raise Exception(f"product should be in {PRODUCTS}, but is {product}")
+    pat_names = sorted(name for name in os.listdir(data_dir) if name.startswith('Pat_') and
+                       os.path.isdir(os.path.join(data_dir, name)))
+
+    positions: Dict[str, List[float]] = {}
+    if any('positions' in DEPS[product] for product in products):
+        from ssc_scoring.mymodules.label_store import GohLabelStore
+        label_store = GohLabelStore(label_file)
+        label_store.pos_array  # raise a KeyError if the label file has no L*_pos columns
+        for name in pat_names:
+            pat_id = int(name.split('Pat_')[-1][:3])
+            if pat_id in label_store.row_of_pat and not np.isnan(label_store.positions([pat_id])[0]).any():
+                positions[name] = label_store.positions([pat_id])[0].tolist()
+    corse_positions: Dict[str, List[float]] = {}
+    if 'corse' in products:
+        from ssc_scoring.mymodules.mytrans import CorsePosTable, pat_id_of
+        corse_table = CorsePosTable(corse[0], corse[1])
+        corse_positions = {'Pat_' + pat_id_of(fpath): corse_table.pred(fpath).astype(np.int32).tolist()
+                           for fpath in corse_table.img_fpaths}
+
+    index_dirs = {product: corse[2] if product == 'corse' else data_dir for product in products}
+    for index_dir in set(index_dirs.values()):
+        os.makedirs(index_dir, exist_ok=True)
+    with FileLock(os.path.join(data_dir, INDEX_FNAME + '.lock')):
+        indices = {index_dir: load_index(index_dir) for index_dir in set(index_dirs.values())}
+        jobs = []
+        skipped: Dict[str, List[str]] = {product: [] for product in products}
+        for name in pat_names:
+            ct_fpath = os.path.join(data_dir, name, 'CTimage.mha')
+            lung_fpath = os.path.join(data_dir, name, 'CTimage_lung.mha')
+            inputs = {'ct': os.stat(ct_fpath).st_mtime_ns if os.path.isfile(ct_fpath) else None,
+                      'lung': os.stat(lung_fpath).st_mtime_ns if os.path.isfile(lung_fpath) else None,
+                      'positions': positions.get(name), 'corse_positions': corse_positions.get(name)}
+            job = {'name': name, 'ct': ct_fpath, 'lung': lung_fpath, 'positions': inputs['positions'],
+                   'corse_positions': inputs['corse_positions'], 'products': [], 'stamps': {}, 'out_dirs': {}}
+            for product in products:
+                stamp = stamp_of(product, inputs)
+                missing = [dep for dep, value in stamp.items() if value is None]
+                if missing:  # e.g. no lung mask, no positions in the label file or not predicted
+                    skipped[product].append(f"{name} (no {', '.join(missing)})")
+                    continue
+                out_dir = os.path.join(index_dirs[product], name)
+                entry = indices[index_dirs[product]]['pats'].get(name, {}).get(product)
+                if not is_up_to_date(entry, stamp, product_fpaths(product, out_dir)):
+                    job['products'].append(product)
+                    job['stamps'][product] = stamp
+                    job['out_dirs'][product] = out_dir
+            if job['products']:
+                jobs.append(job)
+
+        for product, names in skipped.items():
+            if names:
+                print(f"skip {product} of {len(names)} patients: {', '.join(names)}")
+        print(f"build {', '.join(products)} of {len(jobs)} of {len(pat_names)} patients in {data_dir}")
+        for job, built in zip(jobs, tqdm(ordered_map(build_patient, jobs, workers, mode='process'), total=len(jobs))):
+            for product, stamp in built.items():
+                indices[index_dirs[product]]['pats'].setdefault(job['name'], {})[product] = stamp
+            for index_dir in {index_dirs[product] for product in built}:
+                save_index(index_dir, indices[index_dir])  # finished patients are kept if the run is interrupted
+    return len(jobs)
+
+
+def main():
+    from ssc_scoring.mymodules.path import PathPos, PathScore
+    from ssc_scoring.run_folds import available_cores
+
+    parser = argparse.ArgumentParser(description="Build the slices and weight maps of all patients.")
+    parser.add_argument('--products', choices=PRODUCTS, help='products to build', type=str, nargs='+',
+                        default=['slices', 'masked', 'lung_mask', 'weight_map'])
+    parser.add_argument('--corse_ex_id', help='experiment ID of the position network for corse slices', type=int,
+                        default=0)
+    parser.add_argument('--corse_mode', choices=('train', 'validaug', 'valid', 'test'),
+                        help='dataset of the predicted positions for corse slices', type=str, default='test')
+    parser.add_argument('--workers', help='number of processes, 0 means all available cores', type=int, default=0)
+    args = parser.parse_args()
+
+    mypath = PathScore()
+    corse = None
+    if 'corse' in args.products:
+        pos_path = PathPos(args.corse_ex_id)
+        corse = (pos_path.data(args.corse_mode), pos_path.pred_world(args.corse_mode),
+                 os.path.join(pos_path.id_dir, 'predicted_slices'))
+    workers = args.workers if args.workers > 0 else available_cores()
+    nb = build(mypath.ori_data_dir, args.products, mypath.label_excel_fpath, corse, workers)
+    print(f"{nb} patients built")
+
+
+if __name__ == "__main__":
+    main()
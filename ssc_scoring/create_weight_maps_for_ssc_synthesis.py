@@ -6,14 +6,11 @@
 # 4. generate a gradient
 
 import numpy as np
-import glob
 from ssc_scoring.mymodules.path import PathScore
-from medutils.medutils import load_itk
 import SimpleITK as sitk
 import cv2
 import os
 import matplotlib.pyplot as plt
-import math
 
 
 def bbox2(img):
@@ -74,60 +71,53 @@ def savefig(save_flag: bool, img: np.ndarray, image_name: str, dir: str = "image
 #     return mask
 
 
-def main():
-    squared = False
-    weight_dir = 'results/weight_maps_test'
-
-    folder = PathScore().ori_data_dir
-    file_ls = glob.glob(folder+"/Pat_*/CTimage_lung.mha")
-    for file in file_ls:
-        mask = load_itk(file)  # shape: [1000, 512, 512]
-        rmin, rmax, cmin, cmax, mask_axial = bbox2(mask)
-        width = rmax - rmin
-        length = cmax - cmin
-        edge = max(width, length)
-        square = np.zeros([edge, edge])  # a square
-        square[edge//2, edge//2] = 1
+def weight_map(mask: np.ndarray, squared: bool = False) -> np.ndarray:
+    """Weight map (2D, axial view) of the synthesis of one patient, from its 3D lung mask.
 
-        square = sitk.GetImageFromArray(square.astype(np.int16))
-        distance_map = sitk.SignedMaurerDistanceMap(square)
-        distance_map = np.abs(sitk.GetArrayViewFromImage(distance_map))
-        print(f"max: {np.max(distance_map)}")
-        distance_map = distance_map/np.max(distance_map)
-        if squared:  #
-            distance_map = distance_map **2
-        dim = (length, width)
-        resized = cv2.resize(distance_map, dim, interpolation = cv2.INTER_LINEAR)
-
-        # fig, ax = plt.subplots()
-        # ax.imshow(resized, cmap='gray')
-        # plt.show()
+    Args:
+        mask: Lung mask with shape like [1000, 512, 512].
+        squared: Square the distance map and the gradient.
 
-        # add the focus to the lower lung
-        grad1d = np.linspace(0, 1, width)
-        grad2d = np.tile(grad1d, (length, 1)).T
-        if squared:
-            grad2d = grad2d **2
+    Examples:
+        :func:`ssc_scoring.build_slices.build_patient`
 
-        # fig, ax = plt.subplots()
-        # ax.imshow(grad2d, cmap='gray')
-        # plt.show()
+    """
+    rmin, rmax, cmin, cmax, mask_axial = bbox2(mask)
+    width = rmax - rmin
+    length = cmax - cmin
+    edge = max(width, length)
+    square = np.zeros([edge, edge])  # a square
+    square[edge//2, edge//2] = 1
 
-        new_w = resized * 0.5 + grad2d * 0.5
+    square = sitk.GetImageFromArray(square.astype(np.int16))
+    distance_map = sitk.SignedMaurerDistanceMap(square)
+    distance_map = np.abs(sitk.GetArrayViewFromImage(distance_map))
+    distance_map = distance_map/np.max(distance_map)
+    if squared:  #
+        distance_map = distance_map **2
+    dim = (length, width)
+    resized = cv2.resize(distance_map, dim, interpolation = cv2.INTER_LINEAR)
 
-        tmp_w = np.zeros(mask_axial.shape)
-        tmp_w[rmin:rmax, cmin:cmax] = new_w
+    # add the focus to the lower lung
+    grad1d = np.linspace(0, 1, width)
+    grad2d = np.tile(grad1d, (length, 1)).T
+    if squared:
+        grad2d = grad2d **2
 
-        new_w = tmp_w * mask_axial
-        weight_dir = os.path.dirname(file)
-        file_id = file.split('Pat_')[-1][:3]
-        np.save(f'{weight_dir}/weight_map.npy', new_w)
-        savefig(True, new_w, f'weight_map.png', weight_dir)
+    new_w = resized * 0.5 + grad2d * 0.5
 
+    tmp_w = np.zeros(mask_axial.shape)
+    tmp_w[rmin:rmax, cmin:cmax] = new_w
 
+    return tmp_w * mask_axial
 
 
+def main():
+    """Build `weight_map.npy` of all patients by `build_slices.py`."""
+    from ssc_scoring.build_slices import build
+    from ssc_scoring.run_folds import available_cores
+    build(PathScore().ori_data_dir, ['weight_map'], workers=available_cores())
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -4,6 +4,23 @@ import json
 import matplotlib.pyplot as plt
 import csv
 import seaborn as sns
+import os
+
+from ssc_scoring.mymodules.occlusion_store import OcclusionStore
+
+# store of occlusion_cohort.py with the labels and predictions of the evaluated slices, used instead of the csv files
+# of the model if it exists
+STORE_DIR = "/home/jjia/data/ssc_scoring/ssc_scoring/results/models/1903/occlusion_store/valid_healthy_p64_s16"
+
+
+def goh_from_store(store_dir, pat_lv_ls):
+    """Labels and predictions of the slices in `pat_lv_ls` (e.g. '023_1' for Pat_023, Level1), in the same order."""
+    store = OcclusionStore(store_dir)
+    metas = [store.index['slices'][f"Pat_{pat_lv.split('_')[0]}/Level{pat_lv.split('_')[1]}"] for pat_lv in pat_lv_ls]
+    goh_label = np.array([meta['label'] for meta in metas]).astype(np.float16)
+    goh_pred = np.array([meta['pred'] for meta in metas]).astype(np.float16)
+    return goh_label, goh_pred
+
 
 def main():
     OBSERVER = 'Lucia'  # 'anne'
@@ -86,21 +103,24 @@ def main():
         goh_pred_fpath = folder + "/valid_pred.csv"
         goh_data_fpath = folder + "/valid_data.csv"
 
-        goh_label_ls, goh_pred_ls, goh_data_ls = [], [], []
-        for fpath, ls in zip([goh_label_fpath, goh_pred_fpath, goh_data_fpath],
-                     [goh_label_ls, goh_pred_ls, goh_data_ls]):
-            with open(fpath) as f:
-                reader = csv.reader(f, delimiter=',')
-                for row in reader:
-                    ls.append(row)
-
-        print(len(goh_label_ls))
-        goh_label = np.array(goh_label_ls[1:]).astype(np.float16)  # remove the title text
-        goh_pred = np.array(goh_pred_ls[1:]).astype(np.float16)
-        goh_data = np.array(goh_data_ls[1:])
-        goh_label = goh_label[1::3]
-        goh_pred = goh_pred[1::3]
-        goh_data = goh_data[1::3]  # check if the order of pattern_ls is the same as label or pred csv files.
+        if os.path.isfile(os.path.join(STORE_DIR, 'index.json')):
+            goh_label, goh_pred = goh_from_store(STORE_DIR, pat_lv_ls)
+        else:
+            goh_label_ls, goh_pred_ls, goh_data_ls = [], [], []
+            for fpath, ls in zip([goh_label_fpath, goh_pred_fpath, goh_data_fpath],
+                         [goh_label_ls, goh_pred_ls, goh_data_ls]):
+                with open(fpath) as f:
+                    reader = csv.reader(f, delimiter=',')
+                    for row in reader:
+                        ls.append(row)
+
+            print(len(goh_label_ls))
+            goh_label = np.array(goh_label_ls[1:]).astype(np.float16)  # remove the title text
+            goh_pred = np.array(goh_pred_ls[1:]).astype(np.float16)
+            goh_data = np.array(goh_data_ls[1:])
+            goh_label = goh_label[1::3]
+            goh_pred = goh_pred[1::3]
+            goh_data = goh_data[1::3]  # check if the order of pattern_ls is the same as label or pred csv files.
 
         error_all = np.abs(goh_label - goh_pred)
 
@@ -153,25 +173,28 @@ def main():
         goh_pred_fpath = folder + "/valid_pred.csv"
         goh_data_fpath = folder + "/valid_data.csv"
 
-        goh_label_ls, goh_pred_ls, goh_data_ls = [], [], []
-        for fpath, ls in zip([goh_label_fpath, goh_pred_fpath, goh_data_fpath],
-                             [goh_label_ls, goh_pred_ls, goh_data_ls]):
-            with open(fpath) as f:
-                reader = csv.reader(f, delimiter=',')
-                for row in reader:
-                    ls.append(row)
-
-        print(len(goh_label_ls))
-        goh_label = np.array(goh_label_ls[1:]).astype(np.float16)  # remove the title text
-        goh_pred = np.array(goh_pred_ls[1:]).astype(np.float16)
-        goh_data = np.array(goh_data_ls[:len(goh_label)])  # sometimes a lot of goh_data will be writen to the file.
-        goh_label = goh_label[1::3]
-        goh_pred = goh_pred[1::3]
-        goh_data = goh_data[1::3]
-
-        pat_lv_ls_ = [str[0].split('Pat_')[-1][:3] + '_' + str[0].split('Level')[-1][:1] for str in goh_data]
-        for i, j in zip(pat_lv_ls_, pat_lv_ls):
-            assert i == j
+        if os.path.isfile(os.path.join(STORE_DIR, 'index.json')):
+            goh_label, goh_pred = goh_from_store(STORE_DIR, pat_lv_ls)
+        else:
+            goh_label_ls, goh_pred_ls, goh_data_ls = [], [], []
+            for fpath, ls in zip([goh_label_fpath, goh_pred_fpath, goh_data_fpath],
+                                 [goh_label_ls, goh_pred_ls, goh_data_ls]):
+                with open(fpath) as f:
+                    reader = csv.reader(f, delimiter=',')
+                    for row in reader:
+                        ls.append(row)
+
+            print(len(goh_label_ls))
+            goh_label = np.array(goh_label_ls[1:]).astype(np.float16)  # remove the title text
+            goh_pred = np.array(goh_pred_ls[1:]).astype(np.float16)
+            goh_data = np.array(goh_data_ls[:len(goh_label)])  # sometimes a lot of goh_data will be writen to the file.
+            goh_label = goh_label[1::3]
+            goh_pred = goh_pred[1::3]
+            goh_data = goh_data[1::3]
+
+            pat_lv_ls_ = [str[0].split('Pat_')[-1][:3] + '_' + str[0].split('Level')[-1][:1] for str in goh_data]
+            for i, j in zip(pat_lv_ls_, pat_lv_ls):
+                assert i == j
 
         error_all = np.abs(goh_label - goh_pred)
 
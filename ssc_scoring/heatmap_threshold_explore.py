@@ -6,13 +6,37 @@ import time
 import copy
 import matplotlib.pyplot as plt
 import glob
+import os
+
+from ssc_scoring.mymodules.occlusion_store import OcclusionStore
 
 # This file is used to search/explore the best threshold to let the heat map respresent the Goh Score.
 
 parent_folder = "/home/jjia/data/ssc_scoring/ssc_scoring/results/models/1903/test_data_occlusion_maps_occ_by_healthy"
+# maps written by occlusion_cohort.py, used instead of the files in parent_folder if it exists
+store_dir = "/home/jjia/data/ssc_scoring/ssc_scoring/results/models/1903/occlusion_store/test_healthy_p64_s16"
+store = OcclusionStore(store_dir) if os.path.isfile(os.path.join(store_dir, 'index.json')) else None
 lung_fpath_ls = sorted(glob.glob(f"{parent_folder}/Pat_*/Level*/lung_mask.npy"))
 
 
+def maps_of(fig_idx, pattern):
+    """(map, lung mask, predicted score) of all slices for one pattern, from the store or from the npy files."""
+    if store is not None:
+        for key in store.keys():
+            maps, _, lung_mask, meta = store.get(key)
+            yield maps[fig_idx], lung_mask, meta['pred'][fig_idx]
+        return
+    map_fpath_ls = sorted(glob.glob(f"{parent_folder}/Pat_*/Level*/{pattern}_ori_label_*_pred_*_mae_diff.npy"))
+    print(len(map_fpath_ls),len(lung_fpath_ls) )
+    assert len(map_fpath_ls) == len(lung_fpath_ls)
+    for map_fpath, lung_fpath in zip(map_fpath_ls, lung_fpath_ls):
+        pat_level_1 = map_fpath.split('occlusion_maps_occ_by_healthy')[-1][:16]
+        pat_level_2 = lung_fpath.split('occlusion_maps_occ_by_healthy')[-1][:16]
+        assert  pat_level_1 == pat_level_2
+        pred_score = float(map_fpath.split('pred_')[-1].split('_mae_diff.npy')[0])
+        yield np.load(map_fpath), np.load(lung_fpath), pred_score
+
+
 fig = plt.figure(figsize=(12, 4))
 fig_abs = plt.figure(figsize=(12, 4))
 fig_abs_all = plt.figure(figsize=(4, 4))
@@ -30,25 +54,15 @@ for fig_idx, pattern in enumerate(['disext', 'gg', 'rept']):
     ax_abs_all = fig_abs_all.add_subplot(1, 1, 1)
     ax_merge = fig_merge.add_subplot(1, 1, 1)
 
-    map_fpath_ls = sorted(glob.glob(f"{parent_folder}/Pat_*/Level*/{pattern}_ori_label_*_pred_*_mae_diff.npy"))
-    print(len(map_fpath_ls),len(lung_fpath_ls) )
-    assert len(map_fpath_ls) == len(lung_fpath_ls)
     diff_ls = [[], [], [], [], [], [], [], [], [], [],
                [], [], [], [], [], [], [], [], [], [],
                [], [], [], [], [], [], [], [], [], []]  # 10 points
-    for map_fpath, lung_fpath in zip(map_fpath_ls, lung_fpath_ls):
-        pat_level_1 = map_fpath.split('occlusion_maps_occ_by_healthy')[-1][:16]
-        pat_level_2 = lung_fpath.split('occlusion_maps_occ_by_healthy')[-1][:16]
-        assert  pat_level_1 == pat_level_2
-        pred_score = float(map_fpath.split('pred_')[-1].split('_mae_diff.npy')[0])
+    for map, lung_mask, pred_score in maps_of(fig_idx, pattern):
         if pred_score <0:
             pred_score = 0
         if pred_score > 100:
             pred_score = 100
 
-        lung_mask = np.load(lung_fpath)
-        map = np.load(map_fpath)
-
         for idx, THRESHOLD in enumerate(thresholds):
             map_ = copy.deepcopy(map)
             map_ = np.where(map_ >= THRESHOLD, 0, 1)
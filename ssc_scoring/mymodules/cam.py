@@ -3,24 +3,68 @@
 # @Author  : Jingnan
 # @Email   : jiajingnan2222@gmail.com
 import torch
+import torch.nn.functional as F
 import numpy as np
-from medutils.medutils import load_itk, save_itk
+from medutils.medutils import save_itk
 import os
+from typing import List, Optional, Sequence, Tuple
 from ssc_scoring.mymodules.path import PathPos
 from ssc_scoring.mymodules.networks import get_net_pos
 import cv2
-from monai.transforms import Resize
+
+
+def grad_cams(output: torch.Tensor, fmap: torch.Tensor, size: Optional[Sequence[int]] = None,
+              batched: bool = True) -> torch.Tensor:
+    """Grad-CAMs of all outputs of a batch of scans, from one backward pass.
+
+    The gradients of all `nb_out` outputs w.r.t. the feature map are computed at once by
+    :func:`torch.autograd.grad` with `is_grads_batched=True`, i.e. the backward pass is vectorized over one one-hot
+    `grad_outputs` per output. Because the scans of a batch are independent in eval mode, the gradient of the sum of
+    one output over the batch gives the gradient of each scan. The CAM of one output is the channel mean of the
+    gradients multiplied by the channel mean of the feature map, resized to `size` on the device of `fmap` and scaled
+    to [0, 256] per scan and output, as `GradCAM.run` did with one `backward` per output.
+
+    Args:
+        output: Prediction of the network with shape (batch, nb_out). It must still have its graph.
+        fmap: Feature map of the hooked layer with shape (batch, chn, d0, d1, d2), part of the graph of `output`.
+        size: Spatial size of the returned CAMs. None means the size of `fmap`.
+        batched: Whether to vectorize the backward pass. False means one `torch.autograd.grad` per output, e.g. for
+            layers without batching rules.
+
+    Returns:
+        CAMs with shape (batch, nb_out, *size).
+
+    Examples:
+        :meth:`GradCAM.run_batch`
+
+    """
+    nb_out = output.shape[1]
+    one_hot = torch.eye(nb_out, dtype=output.dtype, device=output.device)[:, None].expand(nb_out, *output.shape)
+    if batched:
+        grads = torch.autograd.grad(output, fmap, grad_outputs=one_hot, retain_graph=True, is_grads_batched=True)[0]
+    else:
+        grads = torch.stack([torch.autograd.grad(output, fmap, grad_outputs=g, retain_graph=True)[0]
+                             for g in one_hot])
+    with torch.no_grad():
+        cam = grads.mean(2) * fmap.mean(1)[None]  # (nb_out, batch, d0, d1, d2)
+        cam = cam.transpose(0, 1)  # (batch, nb_out, d0, d1, d2)
+        if size is not None:
+            cam = F.interpolate(cam, size=tuple(size), mode='trilinear', align_corners=False)
+        cam_min = cam.flatten(2).min(2)[0][..., None, None, None]
+        cam_max = cam.flatten(2).max(2)[0][..., None, None, None]
+        cam = (cam - cam_min) / (cam_max - cam_min).clamp(min=1e-7) * 256
+    return cam
 
 
 class GradCAM():
     def __init__(self, eval_id, args_dt, layer='features'):
-        self.mypath = PFTPath(eval_id, check_id_dir=False, space=args_dt['ct_sp'])
-        self.device = torch.device("cuda")
-        self.target = [i.lstrip() for i in args_dt['target'].split('-')]
-        self.net = get_net_pos() # output FVC and FEV1
+        self.mypath = PathPos(eval_id, check_id_dir=False)
+        self.device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+        self.target = [i.lstrip() for i in args_dt.get('target', 'L1-L2-L3-L4-L5').split('-')]
+        self.net = get_net_pos(args_dt['net'], len(self.target), args_dt['fc1_nodes'], args_dt['fc2_nodes'],
+                               args_dt['level_node'], pretrained=False, base=args_dt['base'])
         print('net:', self.net)
 
-        self.grad_block = []
         self.fmap_block = []
 
         ckpt = torch.load(self.mypath.model_fpath, map_location=self.device)
@@ -34,71 +78,65 @@ class GradCAM():
         self.net.to(self.device)
         if layer == 'avgpool':
             self.net.avgpool.register_forward_hook(self.farward_hook)
-            self.net.avgpool.register_backward_hook(self.backward_hook)
         elif layer == 'last_conv':
             self.net.features[-4].register_forward_hook(self.farward_hook)
-            self.net.features[-4].register_backward_hook(self.backward_hook)
         elif layer == 'last_maxpool':
             self.net.features[-1].register_forward_hook(self.farward_hook)
-            self.net.features[-1].register_backward_hook(self.backward_hook)
         self.net.eval()
-        self.opt = torch.optim.Adam(self.net.parameters(), lr=0.0001)
         self.layer = layer
 
-    # 定义获取梯度的函数
-    def backward_hook(self, module, grad_in, grad_out):
-        self.grad_block.append(grad_out[0].detach())
-
     # 定义获取特征图的函数
     def farward_hook(self, module, input, output):
         self.fmap_block.append(output)
 
     def run(self, pat_id, image: torch.Tensor, ori: np.ndarray, sp: np.ndarray, label: torch.Tensor):
-
-        chn, w, h, d = image.shape
-        img = image[None].to(self.device)
-
-        # img_id = int(self.img_fpath.split('/')[-2].split('_')[-1])
-        # label_all = label
-        # loss = nn.MSELoss()
+        """CAMs of one scan `image` with shape (chn, w, h, d). See :meth:`run_batch`."""
+        return self.run_batch([pat_id[0]], image[None], [ori], [sp], label)
+
+    def run_batch(self, pat_ids: Sequence, images: torch.Tensor, oris: Sequence[np.ndarray],
+                  sps: Sequence[np.ndarray], label: Optional[torch.Tensor] = None,
+                  save_target_cams: bool = True) -> Tuple[List[str], np.ndarray]:
+        """CAMs of all targets of a batch of scans, with one forward and one batched backward pass.
+
+        The scans and the CAMs of each target are saved to `{id_dir}/cam/{layer}/{pat_id}.mha` and
+        `{id_dir}/cam/{layer}/{pat_id}_{target}.mha`.
+
+        Args:
+            pat_ids: Patient ID of each scan.
+            images: Scans with shape (batch, chn, w, h, d) with the same size.
+            oris: Origin of each scan.
+            sps: Spacing of each scan.
+            label: Labels of the scans, only printed.
+            save_target_cams: Whether to save the CAMs of each target to `.mha` files.
+
+        Returns:
+            File paths of the saved CAMs and the predictions with shape (batch, nb_targets).
+
+        """
+        img = images.to(self.device)
         self.fmap_block = []  # empty the feature map list before forwarding.
-        output = self.net(img)
-        img_np = (img.cpu().detach().numpy()[0][0] + 1 )/2 * 3000 - 1500  # Rescale to original hausfield values
+        with torch.enable_grad():
+            output = self.net(img)
+            cams = grad_cams(output, self.fmap_block[0], size=img.shape[2:])
+        img_np = (img.cpu().detach().numpy()[:, 0] + 1) / 2 * 3000 - 1500  # Rescale to original hausfield values
+        output = output.detach().cpu().numpy()
+        if label is not None:
+            print(f"predict: {output}, label: {label.detach().cpu().numpy()}")
 
         cam_dir = f"{self.mypath.id_dir}/cam/{self.layer}"
         if not os.path.isdir(cam_dir):
             os.makedirs(cam_dir)
 
-        img_np_fpath = f"{cam_dir}/{str(pat_id[0])}.mha"
-        save_itk(img_np_fpath, img_np, ori.tolist(), sp.tolist())
-
-        pred_dt = {k: v for k, v in zip(self.target, output.flatten())}
-        print(f"predict: {output.detach().cpu().numpy()}, label: {label.detach().cpu().numpy()}")
-
-        for target in self.target:
-
-            print(f"For target: {target}")
-            self.grad_block = []
-
-            self.opt.zero_grad()  # clear the gradients
-            pred_dt[target].backward(retain_graph=True)
-            grad = torch.stack(self.grad_block, 0)
-            grads_mean = torch.mean(grad, [1, 2])
-
-            cam = torch.zeros(list(self.fmap_block[0].shape)).to(self.device)
-            for weight, map in zip(grads_mean, self.fmap_block):
-                cam += weight * map
-            cam = cam / len(grads_mean)
-            cam = cam.cpu().detach().numpy()
-            cam = np.mean(cam, 1)
-
-            up_sp = Resize(spatial_size=(w, h, d), mode='trilinear')
-            cam = up_sp(cam)[0]  # exclude the channel dim
-            cam = (cam - cam.min()) / (cam.max() - cam.min()) * 256
-
-            fpath = f"{cam_dir}/{str(pat_id[0])}_{target}.mha"
-            save_itk(fpath, cam, ori.tolist(), sp.tolist())
-            print(fpath)
+        fpaths = []
+        cams = cams.cpu().numpy()
+        for pat_id, img_one, cam, ori, sp in zip(pat_ids, img_np, cams, oris, sps):
+            save_itk(f"{cam_dir}/{str(pat_id)}.mha", img_one, ori.tolist(), sp.tolist())
+            if save_target_cams:
+                for target, cam_target in zip(self.target, cam):
+                    fpath = f"{cam_dir}/{str(pat_id)}_{target}.mha"
+                    save_itk(fpath, cam_target, ori.tolist(), sp.tolist())
+                    fpaths.append(fpath)
+        return fpaths, output
 
 
 def scale_cam_image(cam, target_size=None):
@@ -7,14 +7,20 @@
 import monai
 from torchvision import transforms
 from argparse import Namespace
+from typing import Optional
 from ssc_scoring.mymodules.data_synthesis import SysthesisNewSampled
 from ssc_scoring.mymodules.mytrans import RandomAffined, RandomHorizontalFlipd, RandomVerticalFlipd, \
-    RandGaussianNoised, LoadDatad, NormImgPosd, AddChanneld, RandomCropPosd, \
-    CenterCropPosd, RandCropLevelRegiond, CoresPosd, SliceFromCorsePosd
+    RandGaussianNoised, LoadDatad, CachedLoadDatad, RawLoadDatad, NormImgPosd, AddChanneld, RandomCropPosd, \
+    CenterCropPosd, RandCropLevelRegiond, CoresPosd, SliceFromCorsePosd, BatchRandomAffine, BatchRandGaussianNoise
 from ssc_scoring.mymodules.path import PathScore, PathPos
 import ssc_scoring
 from monai.transforms import ScaleIntensityRanged
 
+# affine augmentation of 2D slices for Goh score prediction
+ROTATION_SCORE = 30
+SHIFT_SCORE = 10 / 512
+SCALE_SCORE = 0.05
+
 
 def xformd_score(mode: str = 'train', synthesis: bool = False, args: Namespace = None, tr_x=None) -> monai.transforms.Compose:
     """Return composed transforms for Goh score  prediction.
@@ -38,11 +44,11 @@ def xformd_score(mode: str = 'train', synthesis: bool = False, args: Namespace =
 
     """
     key = "image_key"
-    rotation = 30
+    rotation = ROTATION_SCORE
     vertflip = 0.5
     horiflip = 0.5
-    shift = 10 / 512
-    scale = 0.05
+    shift = SHIFT_SCORE
+    scale = SCALE_SCORE
 
     xforms = []
     if mode in ['train', 'validaug']:
@@ -57,15 +63,21 @@ def xformd_score(mode: str = 'train', synthesis: bool = False, args: Namespace =
                                               gen_gg_as_retp=args.gen_gg_as_retp,
                                               gg_increase=args.gg_increase,
                                               tr_x=tr_x,
-                                              weighted_syn_region=args.weighted_syn_region))
-        xforms.extend([
-            AddChanneld(),
-            RandomAffined(key=key, degrees=rotation, translate=(shift, shift), scale=(1 - scale, 1 + scale)),
-            # CenterCropd(image_size),
-            # RandomHorizontalFlipd(key, p=horiflip),
-            # RandomVerticalFlipd(key, p=vertflip),
-            RandGaussianNoised()
-        ])
+                                              weighted_syn_region=args.weighted_syn_region,
+                                              texture_bank_size=args.texture_bank_size,
+                                              texture_refresh=args.texture_refresh,
+                                              nb_workers=args.workers))
+        if args is not None and args.batch_aug:  # affine and noise are applied to batches by `batch_xformd_score`
+            xforms.append(AddChanneld())
+        else:
+            xforms.extend([
+                AddChanneld(),
+                RandomAffined(key=key, degrees=rotation, translate=(shift, shift), scale=(1 - scale, 1 + scale)),
+                # CenterCropd(image_size),
+                # RandomHorizontalFlipd(key, p=horiflip),
+                # RandomVerticalFlipd(key, p=vertflip),
+                RandGaussianNoised()
+            ])
     else:
         xforms.extend([AddChanneld()])
 
@@ -78,6 +90,35 @@ def xformd_score(mode: str = 'train', synthesis: bool = False, args: Namespace =
     return transform
 
 
+def batch_xformd_score(mode: str = 'train', args: Namespace = None) -> Optional[transforms.Compose]:
+    """Return composed batch-level transforms for Goh score prediction, or None if there is nothing to apply.
+
+    If `args.batch_aug`, the random affine transform and Gaussian noise of :func:`xformd_score` are not applied per
+    sample in the workers of DataLoader, but to the collated batch of shape (B, 1, H, W), usually after it is moved to
+    GPU.
+
+    Args:
+        mode: Selected from 'train', 'valid', 'validaug', and 'test'
+        args: argument
+
+    Examples:
+
+        >>> batch_xform = batch_xformd_score(mode='train', args=args)
+        >>> batch_x = batch_xform(batch_x.to(device))
+
+        and
+
+        :func:`ssc_scoring.run.start_run`
+
+    """
+    if args is None or not args.batch_aug or mode not in ['train', 'validaug']:
+        return None
+    xforms = [BatchRandomAffine(degrees=ROTATION_SCORE, translate=(SHIFT_SCORE, SHIFT_SCORE),
+                                scale=(1 - SCALE_SCORE, 1 + SCALE_SCORE)),
+              BatchRandGaussianNoise()]
+    return transforms.Compose(xforms)
+
+
 def xformd_pos2score(mode: str, mypath: PathPos) -> monai.transforms.Compose:
     """Composed transforms to obtain 2D slices given 3D image and slice number.
 
@@ -135,7 +176,8 @@ def recon_transformd(mode: str = 'train'):
 
 
 def xformd_pos(mode: str = 'train', level_node: int = 0, train_on_level: int = 0,
-               z_size: int = 192, y_size: int = 256, x_size: int = 256) -> monai.transforms.Compose():
+               z_size: int = 192, y_size: int = 256, x_size: int = 256,
+               volume_cache=None, raw_volume: bool = False) -> monai.transforms.Compose():
     """Return composed transforms for position prediction.
 
     Detailed steps:
@@ -173,6 +215,10 @@ def xformd_pos(mode: str = 'train', level_node: int = 0, train_on_level: int = 0
         z_size: patch size along z axial
         y_size: patch size along y axial
         x_size: patch size along x axial
+        volume_cache: :class:`ssc_scoring.mymodules.volume_cache.VolumeCache`. If given, images are views of the
+            cached scans instead of being loaded from disk.
+        raw_volume: If images are memory-mapped from their uncompressed copies, so that only the cropped patch is
+            read from disk. Ignored if `volume_cache` is given.
 
     Examples:
 
@@ -183,7 +229,12 @@ def xformd_pos(mode: str = 'train', level_node: int = 0, train_on_level: int = 0
         :meth:`ssc_scoring.mymodules.mydata.LoadPos.xformd`.
 
     """
-    xforms = [LoadDatad()]
+    if volume_cache is not None:
+        xforms = [CachedLoadDatad(volume_cache)]
+    elif raw_volume:
+        xforms = [RawLoadDatad()]
+    else:
+        xforms = [LoadDatad()]
     if level_node or train_on_level:
         xforms.append(RandCropLevelRegiond(level_node, train_on_level, height=z_size, rand_start=True))
     else:
@@ -12,6 +12,7 @@ import scipy
 from sklearn.metrics import cohen_kappa_score
 
 import ssc_scoring.mymodules.my_bland as sm
+from ssc_scoring.mymodules.pred_writer import read_npz_preds
 
 # Force matplotlib to not use any Xwindows backend.
 matplotlib.use('Agg')
@@ -74,6 +75,9 @@ def mae(df):
 def read_check(file_fpath=None) -> pd.DataFrame:
     """Check the head of the loaded csv file. If no head, add proper head.
 
+    The up-to-date `.npz` copy written by :class:`ssc_scoring.mymodules.pred_writer.PredWriter` is read instead of the
+    csv file if it exists.
+
     Args:
         file_fpath: csv file full path
 
@@ -84,6 +88,10 @@ def read_check(file_fpath=None) -> pd.DataFrame:
         :func:`ssc_scoring.mymodules.confusion_test.confusion`
 
     """
+    df = read_npz_preds(file_fpath)
+    if df is not None:
+        return df
+
     df = pd.read_csv(file_fpath)
     if df.columns[0] == "ID":
         del df["ID"]
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/19/26 11:05 AM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+import copy
+import numbers
+import os
+from typing import Dict, List, Union
+
+import torch
+import torch.nn as nn
+
+from ssc_scoring.mymodules.confusion_test import confusion
+
+# Torch threads for CPU inference of the small networks. More threads than this only add synchronization overhead to
+# their thin convolutions. Networks which are not listed use all cores.
+INFER_THREADS = {'cnn2fc1': 4,
+                 'cnn3fc1': 4,
+                 'cnn3fc2': 4,
+                 'cnn4fc2': 8,
+                 'cnn5fc2': 8,
+                 'cnn6fc2': 8}
+
+
+def infer_threads(net_name: str, threads: int = 0) -> int:
+    """Torch threads for CPU inference of `net_name`. `threads` > 0 overrides the default of the network."""
+    if threads > 0:
+        return threads
+    return INFER_THREADS.get(net_name, os.cpu_count() or 1)
+
+
+def is_3d(net: nn.Module) -> bool:
+    return any(isinstance(m, nn.Conv3d) for m in net.modules())
+
+
+class CpuInfer:
+    """Forward passes of a network on CPU: `torch.inference_mode`, `channels_last` (2D networks from
+    :func:`ssc_scoring.mymodules.networks.cnn_fc2d.get_net`) or `channels_last_3d` (3D networks from
+    :func:`ssc_scoring.mymodules.networks.get_net.get_net_pos`) memory format, and optionally bfloat16 autocast.
+
+    Args:
+        net: Network. A copy of it in eval mode and in the memory format is used, so `net` (e.g. the network being
+            trained) is not changed.
+        bf16: Run the forward pass with bfloat16 autocast. Outputs are always float32.
+        channels_last: Use the channels-last memory format for weights and inputs.
+        threads: Torch threads during each forward pass, see :func:`infer_threads`. The threads of the process are
+            restored after each forward pass.
+        net_name: Name of the network, used to choose the default threads.
+
+    Examples:
+        :class:`ssc_scoring.mymodules.inference.Evaluater_score` and
+        :class:`ssc_scoring.mymodules.inference.Evaluater_pos`
+
+    """
+
+    def __init__(self, net: nn.Module, bf16: bool = True, channels_last: bool = True, threads: int = 0,
+                 net_name: str = ''):
+        self.bf16 = bf16
+        self.memory_format = None
+        if channels_last:
+            self.memory_format = torch.channels_last_3d if is_3d(net) else torch.channels_last
+        self.net = copy.deepcopy(net).eval()
+        if self.memory_format is not None:
+            self.net = self.net.to(memory_format=self.memory_format)
+        self.threads = infer_threads(net_name, threads)
+
+    def _format(self, x: torch.Tensor) -> torch.Tensor:
+        if self.memory_format is not None and x.dim() in (4, 5):
+            return x.contiguous(memory_format=self.memory_format)
+        return x
+
+    def __call__(self, batch_x: Union[torch.Tensor, List[torch.Tensor]]) -> torch.Tensor:
+        if isinstance(batch_x, (list, tuple)):  # [image, level] for networks with a level node
+            batch_x = [self._format(x) for x in batch_x]
+        else:
+            batch_x = self._format(batch_x)
+        process_threads = torch.get_num_threads()
+        torch.set_num_threads(self.threads)
+        try:
+            with torch.inference_mode():
+                with torch.autocast(device_type='cpu', dtype=torch.bfloat16, enabled=self.bf16):
+                    pred = self.net(batch_x)
+        finally:
+            torch.set_num_threads(process_threads)
+        return pred.float()
+
+
+def fp32_path(mypath):
+    """Copy of `mypath` whose prediction and label files are in the sub-directory `fp32` of its `id_dir`."""
+    mypath_fp32 = copy.copy(mypath)
+    mypath_fp32.id_dir = os.path.join(mypath.id_dir, 'fp32')
+    os.makedirs(mypath_fp32.id_dir, exist_ok=True)
+    return mypath_fp32
+
+
+def compare_to_fp32(mypath, mypath_fp32, mode: str) -> Dict[str, float]:
+    """Metrics of :func:`ssc_scoring.mymodules.confusion_test.confusion` of the predictions of `mode` in `mypath`
+    minus the same metrics of the fp32 predictions in `mypath_fp32`.
+
+    The same files as in :func:`ssc_scoring.mymodules.tool.compute_metrics` are compared: rounded scores for score
+    prediction and world positions for position prediction.
+
+    Returns:
+        A dict like {'cpu_infer_diff_valid_ave_MAE_disext': 0.02, ...}
+
+    """
+    out_dt = {}
+    for path, key in zip([mypath, mypath_fp32], ['fast', 'fp32']):
+        if path.project_name == 'score':
+            out_dt[key] = confusion(path.label(mode), path.pred_end5(mode))
+        else:
+            out_dt[key] = confusion(path.world(mode), path.pred_world(mode))
+    diff = {}
+    for metric, value in out_dt['fast'].items():
+        if isinstance(value, numbers.Number) and metric in out_dt['fp32']:
+            diff['cpu_infer_diff_' + metric.replace('valid_', mode + '_', 1)] = value - out_dt['fp32'][metric]
+    return diff
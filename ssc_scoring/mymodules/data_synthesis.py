@@ -2,12 +2,11 @@
 # @Time    : 7/11/21 3:53 PM
 # @Author  : Jingnan
 # @Email   : jiajingnan2222@gmail.com
-import copy
 import glob
 import random
-from multiprocessing import Manager, Lock
-from typing import (Union)
+from typing import (Union, Optional, Dict, Sequence, Tuple)
 import csv
+import threading
 import cv2
 from medutils.medutils import load_itk
 import numpy as np
@@ -15,23 +14,10 @@ import torch
 from torchvision.transforms import CenterCrop, RandomAffine
 import os
 import matplotlib.pyplot as plt
-from statistics import mean
 from monai.transforms import Transform, ScaleIntensityRange
 from monai.transforms import RandomizableTransform
 
-manager = Manager()
-# Store the numbers of each label during multi-process training/validaug as a monitor of _balanced label distribution.
-train_label_numbers = manager.dict(
-    {label: key for label, key in zip(np.arange(0, 21) * 5, np.zeros((21,)).astype(np.int))})
-train_lock = Lock()
-
-validaug_label_numbers = manager.dict(
-    {label: key for label, key in zip(np.arange(0, 21) * 5, np.zeros((21,)).astype(np.int))})
-validaug_lock = Lock()
-
-# Create two values to store the numbers of original images and synthetic images during multi-process training.
-ori_nb = manager.Value('ori_nb', 0)
-sys_nb = manager.Value('sys_nb', 0)
+NB_CATEGORIES = 21  # disext categories: 0, 5, ..., 100
 
 
 def savefig(save_flag: bool, img: np.ndarray, image_name: str, dir: str = "image_samples") -> None:
@@ -168,6 +154,129 @@ def gen_pts(nb_points: int, limit: int, radius: int) -> np.ndarray:
     return pts
 
 
+def egg_temp(egg_fpath: str, image_size: int = 512) -> np.ndarray:
+    """Normalize a pattern egg to [0, 1] and mirror-tile it to a big array which can be affined and cropped.
+
+    Args:
+        egg_fpath: Full path of the egg, a small image of retp or gg pattern.
+        image_size: Size of the synthetic images.
+
+    Returns:
+        The tiled array, around 2 times bigger than `image_size` along each axis.
+
+    """
+    egg = load_itk(egg_fpath)
+    # normalize the egg using the original image information
+    normalize0to1 = ScaleIntensityRange(a_min=-1500.0, a_max=1500.0, b_min=0.0, b_max=1.0, clip=True)
+    egg = normalize0to1(egg)
+
+    minnorv = np.vstack((np.flip(egg), np.flip(egg, 0)))
+    minnorh = np.hstack((minnorv, np.flip(minnorv, 1)))
+
+    cell_size = minnorh.shape
+    nb_row, nb_col = image_size // cell_size[0] * 2, image_size // cell_size[1] * 2  # big mask for crop
+    temp = np.hstack(([minnorh] * nb_col))
+    temp = np.vstack(([temp] * nb_row))
+    return temp
+
+
+def rand_affine_crop(temp: np.ndarray, random_affine: RandomAffine, center_crop: CenterCrop) -> np.ndarray:
+    """Random affine transform of the tiled egg, then crop it to a float32 pattern candidate."""
+    temp_tensor = torch.from_numpy(np.ascontiguousarray(temp[None]))
+    candidate = center_crop(random_affine(temp_tensor))
+    return torch.squeeze(candidate).numpy().astype(np.float32)
+
+
+class TextureBank:
+    """Pattern candidates (tiled and affined eggs of retp and gg) computed once, stored in shared memory.
+
+    :class:`SysthesisNewSampled` samples its candidates from the bank instead of reading, tiling and affining an egg
+    every few images in every DataLoader worker. The candidates are torch tensors in shared memory, so all workers
+    read the same memory. An optional background thread in the main process replaces one random candidate every
+    `refresh_interval` seconds. A worker may read a candidate while it is replaced, which only mixes two textures of
+    the same pattern.
+
+    Args:
+        eggs_fpath: Dict of pattern name to egg paths, e.g. {'retp': [...], 'gg': [...]}.
+        nb: Number of candidates of each pattern.
+        image_size: Size of the synthetic images.
+        refresh_interval: Seconds between 2 refreshed candidates. 0 means no refresh.
+
+    Examples:
+        :func:`get_texture_bank`
+
+    """
+
+    def __init__(self, eggs_fpath: Dict[str, Sequence[str]], nb: int, image_size: int = 512,
+                 refresh_interval: float = 0.0):
+        self.eggs_fpath = eggs_fpath
+        self.nb = nb
+        self.image_size = image_size
+        self.random_affine = RandomAffine(degrees=180, translate=(0.1, 0.1), scale=(1 - 0.5, 1 + 0.1))
+        self.center_crop = CenterCrop(image_size)
+        self._temps = {}  # tiled eggs, only needed by the process which builds/refreshes candidates
+        self._refresher = None
+        self._stop = threading.Event()
+
+        self.candidates = {}
+        for pattern, fpaths in eggs_fpath.items():
+            print(f'build {nb} {pattern} candidates from {fpaths}')
+            candidates = torch.empty((nb, image_size, image_size), dtype=torch.float32)
+            for i in range(nb):
+                candidates[i] = torch.from_numpy(self._new_candidate(pattern))
+            self.candidates[pattern] = candidates.share_memory_()
+
+        if refresh_interval > 0:
+            self.start_refresher(refresh_interval)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update({'_temps': {}, '_refresher': None, '_stop': None})  # workers only read candidates
+        return state
+
+    def _new_candidate(self, pattern: str) -> np.ndarray:
+        egg_fpath = random.choice(self.eggs_fpath[pattern])
+        if egg_fpath not in self._temps:
+            self._temps[egg_fpath] = egg_temp(egg_fpath, self.image_size)
+        return rand_affine_crop(self._temps[egg_fpath], self.random_affine, self.center_crop)
+
+    def sample(self, pattern: str) -> np.ndarray:
+        """One random candidate of `pattern`, a float32 view of the shared memory. Do not modify it."""
+        return self.candidates[pattern][random.randrange(self.nb)].numpy()
+
+    def refresh(self, pattern: str, idx: int) -> None:
+        self.candidates[pattern][idx] = torch.from_numpy(self._new_candidate(pattern))
+
+    def _refresh_forever(self, refresh_interval: float) -> None:
+        while not self._stop.wait(refresh_interval):
+            self.refresh(random.choice(list(self.candidates.keys())), random.randrange(self.nb))
+
+    def start_refresher(self, refresh_interval: float) -> None:
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_forever, args=(refresh_interval,), daemon=True)
+            self._refresher.start()
+
+    def stop_refresher(self) -> None:
+        if self._refresher is not None:
+            self._stop.set()
+            self._refresher.join()
+            self._refresher = None
+            self._stop = threading.Event()
+
+
+_texture_banks: Dict[Tuple, TextureBank] = {}
+
+
+def get_texture_bank(ret_eggs_fpath: Sequence[str], gg_eggs_fpath: Sequence[str], nb: int, image_size: int = 512,
+                     refresh_interval: float = 0.0) -> TextureBank:
+    """Texture bank of the eggs, built at the first call and shared by the train and validaug transforms."""
+    key = (tuple(ret_eggs_fpath), tuple(gg_eggs_fpath), nb, image_size)
+    if key not in _texture_banks:
+        _texture_banks[key] = TextureBank({'retp': ret_eggs_fpath, 'gg': gg_eggs_fpath}, nb, image_size,
+                                          refresh_interval)
+    return _texture_banks[key]
+
+
 class SysthesisNewSampled(RandomizableTransform, Transform):
     def __init__(self,
                  key,
@@ -181,7 +290,11 @@ class SysthesisNewSampled(RandomizableTransform, Transform):
                  gen_gg_as_retp,
                  gg_increase,
                  tr_x,
-                 weighted_syn_region
+                 weighted_syn_region,
+                 texture_bank_size=0,
+                 texture_refresh=0.0,
+                 nb_workers=0,
+                 merge_every=64
                  ):
         """Synthesis new image samples.
 
@@ -196,6 +309,11 @@ class SysthesisNewSampled(RandomizableTransform, Transform):
             sampler: If using _balanced sampler which leads to _balanced label distribution
             gen_gg_as_retp: If generage gg pattern using the same method as it used by retp
             gg_increase: Voxel value increase for gg pattern, because gg part is always brighter
+            texture_bank_size: Number of precomputed candidates of each pattern in :class:`TextureBank`. 0 means the
+                candidates are generated from the eggs on the fly.
+            texture_refresh: Seconds between 2 refreshed candidates of the texture bank. 0 means no refresh.
+            nb_workers: Number of DataLoader workers, each of them accounts labels in its own row of shared memory.
+            merge_every: Number of images between 2 merges of the label numbers of all workers.
 
         """
         # self.sys_ratio = sys_ratio
@@ -220,22 +338,33 @@ class SysthesisNewSampled(RandomizableTransform, Transform):
         self.ret_eggs_fpath = self._filter_egg_fpaths_for_train('ret')
         self.gg_eggs_fpath = self._filter_egg_fpaths_for_train('gg')
 
-        self.retp_temp = self._generate_candidate(self.ret_eggs_fpath)
-        self.gg_temp = self._generate_candidate(self.gg_eggs_fpath)
-
-        self.retp_candidate = self._rand_affine_crop(self.retp_temp)
-        self.gg_candidate = self._rand_affine_crop(self.gg_temp)
+        if texture_bank_size:
+            self.texture_bank = get_texture_bank(self.ret_eggs_fpath, self.gg_eggs_fpath, texture_bank_size,
+                                                 self.image_size, texture_refresh)
+        else:
+            self.texture_bank = None
+        self._update_candidates()
 
         self.counter = 0  # Count the number of training (or validaug) images
         self.synth_y = []  # Labels of synthetic images
-        if self.mode == "train":
-            self.label_numbers = train_label_numbers
-        elif self.mode == 'validaug':
-            self.label_numbers = validaug_label_numbers
-        else:
+        if self.mode not in ("train", 'validaug'):
             raise Exception("mode is wrong for synthetic data", self.mode)
+        # Store the numbers of each label and the numbers of original/synthetic images as a monitor of _balanced label
+        # distribution. Row 0 is for the main process, row i+1 is only written by DataLoader worker i, so no lock
+        # is needed. They are merged every `merge_every` images.
+        self.label_numbers = torch.zeros((nb_workers + 1, NB_CATEGORIES), dtype=torch.int64).share_memory_()
+        self.image_numbers = torch.zeros((nb_workers + 1, 2), dtype=torch.int64).share_memory_()  # ori_nb, sys_nb
+        self.merge_every = merge_every
+        self.merged_label_numbers = np.zeros((NB_CATEGORIES,), dtype=np.int64)
+        self._nb_since_merge = merge_every  # merge at the first image of each worker
         self.weighted_syn_region = weighted_syn_region
 
+        self.save_img: bool = False  # If save the synthetic images and the intermediate images
+        self.fit_attempts = 3  # new ellipses to fit the disext category of the _balanced sampler
+        self.fit_iterations = 20  # bisection steps of the scale of ellipses for one fitting
+        self._buffers = {}  # float32/uint8 images reused by each synthesis
+        self._kernels = {}
+
     # def generage_ssc_w(self):
     #     # generate the ssc weight map. the first 3 steps focus the borde, the 4th step will focus the lower lung
     #     # 0. generate a rectangular just covering the whole lung.
@@ -273,306 +402,263 @@ class SysthesisNewSampled(RandomizableTransform, Transform):
 
 
     def _generate_candidate(self, eggs_fpath):
-        # ori_image_fpath = fpath.split('.mha')[0] + '_ori.mha'
         egg_fpath = random.choice(eggs_fpath)
         print(f'randomly select this egg: {egg_fpath}')
-        egg = load_itk(egg_fpath)
-        # ori = load_itk(ori_image_fpath)
-        # normalize the egg using the original image information
-        normalize0to1 = ScaleIntensityRange(a_min=-1500.0, a_max=1500.0, b_min=0.0, b_max=1.0, clip=True)
-        egg = normalize0to1(egg)
-        # egg = (egg - np.min(ori)) / (np.max(ori) - np.min(ori))
-
-        minnorv = np.vstack((np.flip(egg), np.flip(egg, 0)))
-        minnorh = np.hstack((minnorv, np.flip(minnorv, 1)))
-
-        cell_size = minnorh.shape
-        nb_row, nb_col = self.image_size // cell_size[0] * 2, self.image_size // cell_size[1] * 2  # big mask for crop
-        temp = np.hstack(([minnorh] * nb_col))
-        temp = np.vstack(([temp] * nb_row))
-        return temp
+        return egg_temp(egg_fpath, self.image_size)
 
     def _rand_affine_crop(self, retp_temp: np.ndarray):
-        retp_temp_tensor = torch.from_numpy(retp_temp[None])
-        retp_affina = self.random_affine(retp_temp_tensor)
-        retp_candidate = self.center_crop(retp_affina)
-        retp_candidate = torch.squeeze(retp_candidate).numpy()
-        return retp_candidate
+        return rand_affine_crop(retp_temp, self.random_affine, self.center_crop)
 
-    def _balanced(self, label):
-        category = label // 5 * 5
-        average = mean(list(self.label_numbers.values()))
-        min_account = min(list(self.label_numbers.values()))
-        max_account = max(list(self.label_numbers.values()))
+    def _update_candidates(self):
+        if self.texture_bank is not None:
+            self.retp_candidate = self.texture_bank.sample('retp')
+            self.gg_candidate = self.texture_bank.sample('gg')
+        else:
+            self.retp_temp = self._generate_candidate(self.ret_eggs_fpath)
+            self.gg_temp = self._generate_candidate(self.gg_eggs_fpath)
+
+            self.retp_candidate = self._rand_affine_crop(self.retp_temp)
+            self.gg_candidate = self._rand_affine_crop(self.gg_temp)
 
-        print("min account", min_account, "max account", max_account)
-        print("generated label", category, 'all:', list(self.label_numbers.values()))
+    def _row(self) -> int:
+        """Row of this process in `label_numbers` and `image_numbers`."""
+        worker_info = torch.utils.data.get_worker_info()
+        if worker_info is None:  # main process
+            return 0
+        return worker_info.id % (len(self.label_numbers) - 1) + 1 if len(self.label_numbers) > 1 else 0
+
+    def merge(self) -> None:
+        """Merge the label numbers of all workers to `merged_label_numbers`, the view used by `_balanced`."""
+        self.merged_label_numbers = self.label_numbers.sum(0).numpy()
+        self._nb_since_merge = 0
+        ori_nb, sys_nb = self.image_numbers.sum(0).tolist()
+        print(f"{self.mode} label numbers: {self.merged_label_numbers.tolist()}, ori_nb: {ori_nb}, sys_nb: {sys_nb}")
+
+    def _balanced_categories(self) -> list:
+        """Categories (disext // 5 * 5) which do not have much more images than the rarest category."""
+        min_account = self.merged_label_numbers.min()
+        return [i * 5 for i, number in enumerate(self.merged_label_numbers) if number <= min_account * 1.5]
 
-        if self.label_numbers[category] > min_account * 1.5:
-            return False
-        else:
-            return True
+    def _balanced(self, label):
+        category = label // 5 * 5
+        return category in self._balanced_categories()
 
     def _account_label(self, label):
         category = label // 5 * 5
-        # with self.lock:
-        if self.mode == "train":
-            with train_lock:
-                train_label_numbers[category] = train_label_numbers[category] + 1
-                print(f'current train label numbers: {sum(train_label_numbers.values())}')
-        else:
-            with validaug_lock:
-                validaug_label_numbers[category] += 1
-                print(f'current validaug label numbers: {sum(validaug_label_numbers.values())}')
+        self.label_numbers[self._row(), int(category // 5)] += 1
+        self._nb_since_merge += 1
+        if self._nb_since_merge >= self.merge_every:
+            self.merge()
 
     def __call__(self, data):
         d = dict(data)
-        print("ori label is: " + str(d['label_key']))
-
-        if d['label_key'][0].item() == 0:  # Possible for synthesis
-            tmp = random.random()
-            if tmp < self.sys_pro_in_0:  # Do synthesis
-                with train_lock:
-                    sys_nb.value += 1
-                    print("sys_nb: " + str(sys_nb.value))
-                d[self.key], d['label_key'] = self._systhesis(d[self.key], d['lung_mask_key'], d['weight_map_key'])
-                # with train_lock:
-                print("after synthesis, label is " + str(d['label_key']) + str("\n"))
-            else:  # No synthesis, number of original images +1
-                with train_lock:
-                    ori_nb.value += 1
-                    print("ori_nb: " + str(ori_nb.value))
-                # with train_lock:
-                print("No need for synthesis, label is " + str(d['label_key']) + str("\n"))
+        if d['label_key'][0].item() == 0 and random.random() < self.sys_pro_in_0:  # Do synthesis
+            d[self.key], d['label_key'] = self._systhesis(d[self.key], d['lung_mask_key'], d['weight_map_key'])
+            self.image_numbers[self._row(), 1] += 1
         else:  # No synthesis, number of original images +1
-            with train_lock:
-                ori_nb.value += 1
-                print("ori_nb: " + str(ori_nb.value))
-
-            # with train_lock:
-            print("No need for synthesis, label is " + str(d['label_key']) + str("\n"))
+            self.image_numbers[self._row(), 0] += 1
 
         self._account_label(d['label_key'][0].item())
         return d
 
-    def rand_position_by_distribuiton(self, weight_map):
-        if self.weighted_syn_region:
-            # To select one point from 2D array accoring to weight map. I will firstly flattern the weight map and then
-            # random a value between [min, max] of weight map, then get the index using np.ravel of the flatterned
-            # weight map, then recover the position by the index using np.unravel
-            self.w_shape = weight_map.shape  # shape: (512, 512)
-            self.w_sum = np.cumsum(weight_map)
-
-            tmp = np.random.uniform()  # between 0 and 1
-            tmp_idx = np.searchsorted(self.w_sum, tmp * self.w_sum[-1])
-            y, x = np.unravel_index(tmp_idx, self.w_shape)
-            out = (x, y)  # exchange the x and y, because the point with cooridinate of (x, y) should be indexed by (y,x)
-            print(f"x: {x}, y:{y})")
-            with open('results/ellipse_position2.csv', 'a+') as f:
-                csv_writer = csv.writer(f)
-                csv_writer.writerow([x, y])
+    def _cum_weight(self, weight_map) -> Optional[np.ndarray]:
+        """Cumulative sum of the flattened weight map, or None if the synthesis region is not weighted."""
+        if not self.weighted_syn_region:
+            return None
+        if isinstance(weight_map, torch.Tensor):
+            weight_map = weight_map.numpy()
+        return np.cumsum(weight_map, dtype=np.float64)
+
+    def _rand_positions(self, cum_weight: Optional[np.ndarray], shape, nb: int) -> list:
+        """`nb` random points (x, y), sampled according to the weight map if `cum_weight` is not None."""
+        if cum_weight is None:
+            return [(random.randint(0, self.image_size), random.randint(0, self.image_size)) for _ in range(nb)]
+        # To select points from 2D array according to weight map: sample the flattened index by the cumulative
+        # weights, then recover the position by np.unravel_index.
+        idx = np.searchsorted(cum_weight, np.random.uniform(size=nb) * cum_weight[-1])
+        ys, xs = np.unravel_index(idx, shape)
+        # exchange the x and y, because the point with coordinate of (x, y) should be indexed by (y, x)
+        out = [(int(x), int(y)) for x, y in zip(xs, ys)]
+        with open('results/ellipse_position2.csv', 'a+') as f:
+            csv.writer(f).writerows(out)
+        return out
 
+    def rand_position_by_distribuiton(self, weight_map):
+        return self._rand_positions(self._cum_weight(weight_map), weight_map.shape, 1)[0]
 
-        else:
-            out = (random.randint(0, self.image_size), random.randint(0, self.image_size))
-        return out
-    def _random_mask(self, weight_map, nb_ellipse: int = 3, type: str = "ellipse"):
-        fig_: np.ndarray = np.zeros((self.image_size, self.image_size))
-        # Blue color in BGR
-        color = 1
-        # Line thickness of -1 px
-        thickness = -1
+    def _rand_ellipses(self, cum_weight: Optional[np.ndarray], shape, nb_ellipse: int = 3) -> list:
+        """Random ellipses [(center, axes, angle), ...] with 1 to `nb_ellipse` elements."""
         nb_shapes: int = random.randint(1, nb_ellipse)
+        ellipses = []
+        for center_coordinates in self._rand_positions(cum_weight, shape, nb_shapes):
+            angle = random.randint(0, 180)
+            if random.random() > 0.5:
+                axlen = random.randint(1, 100)
+            else:
+                axlen = random.randint(1, 200)
+            ellipses.append((center_coordinates, (axlen, int(axlen * (1 + random.random()))), angle))
+        return ellipses
+
+    def _draw_ellipses(self, fig_: np.ndarray, ellipses: list, scale: float = 1.0) -> np.ndarray:
+        """Draw filled ellipses (value 1) in `fig_`, with all axes multiplied by `scale`."""
+        fig_.fill(0)
+        max_axlen = 2 * self.image_size  # large enough to cover the whole image, small enough for cv2
+        for center_coordinates, axes, angle in ellipses:
+            axes_length = tuple(min(int(axlen * scale), max_axlen) for axlen in axes)
+            cv2.ellipse(fig_, center_coordinates, axes_length, angle, 0, 360, 1, -1)
+        return fig_
 
+    def _random_mask(self, weight_map, nb_ellipse: int = 3, type: str = "ellipse"):
+        fig_: np.ndarray = np.zeros((self.image_size, self.image_size), dtype=np.float32)
         if type == "ellipse":
-            startAngle = 0
-            endAngle = 360
-            # Using cv2.ellipse() method
-            # Draw a ellipse with blue line borders of thickness of -1 px
-            for i in range(nb_shapes):
-                angle = random.randint(0, 180)
-                center_coordinates = self.rand_position_by_distribuiton(weight_map)
-                if random.random() > 0.5:
-                    axlen = random.randint(1, 100)
-                else:
-                    axlen = random.randint(1, 200)
-                axesLength = (axlen, int(axlen * (1 + random.random())))
-
-                image = cv2.ellipse(fig_, center_coordinates, axesLength, angle,
-                                    startAngle, endAngle, color, thickness)
-                fig_ += image
-            fig_[fig_ > 0] = 1
+            ellipses = self._rand_ellipses(self._cum_weight(weight_map), np.shape(weight_map), nb_ellipse)
+            self._draw_ellipses(fig_, ellipses)
         else:
             radius = 200
-            for i in range(nb_shapes):
+            for i in range(random.randint(1, nb_ellipse)):
                 nb_points: int = random.randint(3, 10)
                 # Array of polygons where each polygon is represented as an array of points.
                 pts: np.ndarray = gen_pts(nb_points, limit=self.image_size, radius=radius)
-                # image: np.ndarray = cv2.polylines(fig_, [pts], True, color, thickness=1)
-
-                image: np.ndarray = cv2.fillPoly(fig_, [pts], color)
-                fig_ += image
-            fig_[fig_ > 0] = 1
-
-            # savefig(True, fig_, str(self.counter) + 'polygonmask.png')
-
+                cv2.fillPoly(fig_, [pts], 1)  # draw in place, fig_ stays binary
         return fig_
 
-    def _systhesis(self, img: torch.Tensor, lung_mask: Union[np.ndarray, torch.Tensor], weight_map: np.ndarray):
-        img = img.numpy()
-        if type(lung_mask) == torch.Tensor:
-            lung_mask = lung_mask.numpy()
-
-        if random.random() < 0.2:  # update affine every 5 images
-
-            # if random.random() < 0.02:  # update pattern egg every 50 images
-            self.retp_temp = self._generate_candidate(self.ret_eggs_fpath)
-            self.gg_temp = self._generate_candidate(self.gg_eggs_fpath)
-
-            self.retp_candidate = self._rand_affine_crop(self.retp_temp)
-            self.gg_candidate = self._rand_affine_crop(self.gg_temp)
-
-        save_img: bool = False  # If save the synthetic images and the intermediate images
-        savefig(save_img, img, str(self.counter) + '_0_ori_img_' + self.mode + '.png')
-        savefig(save_img, self.retp_candidate, str(self.counter) + '_1_retp_candidate.png')
-
-
-        while (1):
-            rand_retp_mask = self._random_mask(weight_map, 3, type="ellipse")
-            rand_gg_mask = self._random_mask(weight_map, 3, type="ellipse")
-
-            savefig(save_img, rand_gg_mask, str(self.counter) + '_2_rand_gg_mask.png')
-            savefig(save_img, rand_retp_mask, str(self.counter) + '_3_rand_retp_mask.png')
-            savefig(save_img, lung_mask, str(self.counter) + '_4_lung_mask.png')
-
-            rand_retp_mask *= lung_mask
-            rand_gg_mask *= lung_mask
-
-            savefig(save_img, rand_gg_mask, str(self.counter) + '_5_gg_mask_lung.png')
-            savefig(save_img, rand_retp_mask, str(self.counter) + '_6_retp_mask_lung.png')
-
-            union_mask = rand_gg_mask + rand_retp_mask
-            union_mask[union_mask > 0] = 1
-
-            savefig(save_img, union_mask, str(self.counter) + '_7_union_mask_lung.png')
-
-            intersection_mask = rand_gg_mask * rand_retp_mask
-            gg_exclude_retp = rand_gg_mask - intersection_mask
-
-            savefig(save_img, intersection_mask, str(self.counter) + '_8_intersection_mask_lung.png')
-            savefig(save_img, gg_exclude_retp, str(self.counter) + '_9_gg_exclude_retp.png')
-
-            # lung_area = np.sum(lung_mask)
-            # total_dis_area = np.sum(union_mask)
-            # gg_area = np.sum(rand_gg_mask)
-            # retp_area = np.sum(rand_retp_mask)
-            #
-            # y_disext = int(total_dis_area/lung_area * 100)
-            # y_gg = int(gg_area / lung_area * 100)
-            # y_retp = int(retp_area / lung_area * 100)
-            # y = np.array([y_disext, y_gg, y_retp])
-
-            smooth_edge = self.retp_blur
-            rand_retp_mask = cv2.blur(rand_retp_mask, (smooth_edge, smooth_edge))
-            savefig(save_img, rand_retp_mask, str(self.counter) + '_10_retp_mask_blur.png')
-
-            smooth_edge = self.gg_blur
-            rand_gg_mask = cv2.blur(rand_gg_mask, (smooth_edge, smooth_edge))
-            savefig(save_img, rand_gg_mask, str(self.counter) + '_11_gg_mask_blur.png')
+    def _buffer(self, name: str, shape, dtype=np.float32) -> np.ndarray:
+        """Buffer reused by all images synthesized in this worker. Its content is overwritten by each image."""
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buf
+        return buf
 
-            smooth_edge = self.gg_blur
-            intersection_mask = cv2.blur(intersection_mask, (smooth_edge, smooth_edge))
-            savefig(save_img, intersection_mask, str(self.counter) + '_11_intersection_mask_blur.png')
+    def _kernel(self, size: int) -> np.ndarray:
+        if size not in self._kernels:
+            self._kernels[size] = np.ones((size, size), dtype=np.uint8)
+        return self._kernels[size]
 
-            rand_retp_mask_cp = copy.deepcopy(rand_retp_mask)  # recalculate scores
-            rand_gg_mask_cp = copy.deepcopy(rand_gg_mask)
-            rand_retp_mask_cp[rand_retp_mask_cp > 0] = 1
-            rand_gg_mask_cp[rand_gg_mask_cp > 0] = 1
-            rand_retp_mask_cp = rand_retp_mask_cp * lung_mask
-            rand_gg_mask_cp = rand_gg_mask_cp * lung_mask
+    def _masks_and_scores(self, ellipses_retp: list, ellipses_gg: list, lung: np.ndarray, lung_area: int,
+                          scale: float = 1.0) -> np.ndarray:
+        """Draw the retp and gg masks (inside lung) to buffers and compute their scores [disext, gg, retp].
 
-            union_mask = rand_gg_mask_cp + rand_retp_mask_cp
-            union_mask[union_mask > 0] = 1
+        A blurred mask is positive exactly on the mask dilated by the blur kernel, so the scores of the blurred masks
+        are computed by binary dilation without blurring and copying float masks.
 
-            lung_area = np.sum(lung_mask)
-            total_dis_area = np.sum(union_mask)
-            gg_area = np.sum(rand_gg_mask_cp)
-            retp_area = np.sum(rand_retp_mask_cp)
-
-            y_disext = int(total_dis_area / lung_area * 100)
-            y_gg = int(gg_area / lung_area * 100)
-            y_retp = int(retp_area / lung_area * 100)
-            # print("old y: ", y)
-            y = np.array([y_disext, y_gg, y_retp])
-            print("new y: ", y)
+        """
+        shape = lung.shape
+        retp = self._draw_ellipses(self._buffer('retp_mask', shape, np.uint8), ellipses_retp, scale)
+        gg = self._draw_ellipses(self._buffer('gg_mask', shape, np.uint8), ellipses_gg, scale)
+        np.multiply(retp, lung, out=retp)
+        np.multiply(gg, lung, out=gg)
+
+        retp_area_mask = cv2.dilate(retp, self._kernel(self.retp_blur), dst=self._buffer('retp_area', shape, np.uint8))
+        gg_area_mask = cv2.dilate(gg, self._kernel(self.gg_blur), dst=self._buffer('gg_area', shape, np.uint8))
+        np.multiply(retp_area_mask, lung, out=retp_area_mask)
+        np.multiply(gg_area_mask, lung, out=gg_area_mask)
+        union_mask = np.bitwise_or(retp_area_mask, gg_area_mask, out=self._buffer('union_mask', shape, np.uint8))
+
+        total_dis_area = np.count_nonzero(union_mask)
+        gg_area = np.count_nonzero(gg_area_mask)
+        retp_area = np.count_nonzero(retp_area_mask)
+
+        y_disext = int(total_dis_area / lung_area * 100)
+        y_gg = int(gg_area / lung_area * 100)
+        y_retp = int(retp_area / lung_area * 100)
+        return np.array([y_disext, y_gg, y_retp])
+
+    def _fit_to_category(self, ellipses_retp: list, ellipses_gg: list, lung: np.ndarray, lung_area: int,
+                         category: int) -> np.ndarray:
+        """Scale all ellipses by one factor so that disext falls in [category, category + 5).
+
+        Disext increases monotonically with the scale factor (a scaled ellipse includes the original one), so the
+        factor is found by bisection in log scale instead of generating new images until one falls in the category.
 
-            if self.sampler:
-                if self._balanced(y_disext):
-                    break
-                else:
-                    print("not _balanced, re generate image")
+        """
+        y = self._masks_and_scores(ellipses_retp, ellipses_gg, lung, lung_area)
+        if category <= y[0] < category + 5:
+            return y
+        min_axlen = min(axlen for _, axes, _ in ellipses_retp + ellipses_gg for axlen in axes)
+        if y[0] < category:  # enlarge, until all ellipses cover the whole image
+            low, high = 0.0, np.log(2 * self.image_size / max(min_axlen, 1))
+        else:  # shrink
+            low, high = np.log(1e-3), 0.0
+        for _ in range(self.fit_iterations):
+            log_scale = (low + high) / 2
+            y = self._masks_and_scores(ellipses_retp, ellipses_gg, lung, lung_area, np.exp(log_scale))
+            if y[0] < category:
+                low = log_scale
+            elif y[0] >= category + 5:
+                high = log_scale
             else:
                 break
+        return y
 
-        if np.sum(y) > 0:
-            retp = rand_retp_mask * self.retp_candidate
-            savefig(save_img, retp, str(self.counter) + '_12_retp.png')
-
-            img_exclude_retp_mask = (1 - rand_retp_mask) * img
-            savefig(save_img, img_exclude_retp_mask,
-                    str(self.counter) + '_13_img_exclude_retp_mask.png')
-
-            img_wt_retp = retp + img_exclude_retp_mask
-            savefig(save_img, img_wt_retp, str(self.counter) + '_14_img_wt_retp.png')
-
-            if self.gen_gg_as_retp:
-                gg = rand_gg_mask * self.gg_candidate
-                savefig(save_img, gg, str(self.counter) + '_15_gg.png')
-
-                img_exclude_gg_mask = (1 - rand_gg_mask) * img_wt_retp
-                savefig(save_img, img_exclude_gg_mask,
-                        str(self.counter) + '_16_img_exclude_gg_mask.png')
-
-                img_wt_retp_gg = gg + img_exclude_gg_mask
-                savefig(save_img, img_wt_retp_gg,
-                        str(self.counter) + '_17_img_wt_retp_gg_wo_overlap.png')
-
-                merge = 0.5 * (intersection_mask * img_wt_retp_gg) + 0.5 * (
-                        intersection_mask * img_wt_retp)  # gg + retp
-                final = img_wt_retp_gg * (1 - intersection_mask) + merge
-                y_name = '_'.join([str(y[0]), str(y[1]), str(y[2])])
-                savefig(save_img, final,
-                        str(self.counter) + '_18_img_wt_retp_gg_final_' + y_name + '.png')
-
-                # retp part
-
-
+    def _blur(self, mask: np.ndarray, size: int, name: str) -> np.ndarray:
+        """Blur `mask` to buffer `name` with float32 precision."""
+        src = self._buffer(name + '_src', mask.shape)
+        np.copyto(src, mask, casting='unsafe')
+        return cv2.blur(src, (size, size), dst=self._buffer(name, mask.shape))
 
-            else:
-                smooth_edge = self.gg_blur
-                rand_gg_mask = cv2.blur(rand_gg_mask, (smooth_edge, smooth_edge))
-                savefig(save_img, rand_gg_mask, str(self.counter) + '_15_gg_mask_blur.png')
-
-                gg = copy.deepcopy(img_wt_retp)
-                savefig(save_img, gg, str(self.counter) + '_16_gg_candidate.png')
-
-                lighter_gg = copy.deepcopy(gg)
-                lighter_gg += self.gg_increase
-                gg = rand_gg_mask * lighter_gg + (1 - rand_gg_mask) * gg
-                savefig(save_img, gg, str(self.counter) + '_17_gg_lighter.png')
-
-                gg_blur = 3
-                gg = cv2.blur(gg, (gg_blur, gg_blur))
-                savefig(save_img, gg, str(self.counter) + '_18_gg_lighter_blur.png')
-
-                gg = rand_gg_mask * gg
-                savefig(save_img, gg, str(self.counter) + '_19_gg_lighter_blur_smoothed.png')
-
-                img_exclude_gg_mask = (1 - rand_gg_mask) * img_wt_retp
-                img_wt_retp_gg = img_exclude_gg_mask + gg
-                savefig(save_img, img_wt_retp_gg, str(self.counter) + '_20_img_wt_retp_gg.png')
+    def _systhesis(self, img: torch.Tensor, lung_mask: Union[np.ndarray, torch.Tensor], weight_map: np.ndarray):
+        img = np.asarray(img.numpy(), dtype=np.float32)
+        if type(lung_mask) == torch.Tensor:
+            lung_mask = lung_mask.numpy()
 
-            self.counter += 1
-            return torch.from_numpy(img_wt_retp_gg.astype(np.float32)), torch.tensor(y.astype(np.float32))
+        if random.random() < 0.2:  # update affine every 5 images
+            self._update_candidates()
+
+        shape = img.shape
+        lung = np.greater(lung_mask, 0, out=self._buffer('lung', shape, np.bool_)).view(np.uint8)
+        lung_area = np.count_nonzero(lung)
+        if lung_area == 0:  # no lung in this slice, nothing to synthesize
+            return torch.from_numpy(img.copy()), torch.tensor(np.array([0, 0, 0]).astype(np.float32))
+
+        cum_weight = self._cum_weight(weight_map)
+        if self.sampler:  # generate disext directly in one of the categories needed by the _balanced distribution
+            category = random.choice(self._balanced_categories())
+            for _ in range(self.fit_attempts):
+                ellipses_retp = self._rand_ellipses(cum_weight, np.shape(weight_map), 3)
+                ellipses_gg = self._rand_ellipses(cum_weight, np.shape(weight_map), 3)
+                y = self._fit_to_category(ellipses_retp, ellipses_gg, lung, lung_area, category)
+                if category <= y[0] < category + 5:
+                    break
+        else:
+            ellipses_retp = self._rand_ellipses(cum_weight, np.shape(weight_map), 3)
+            ellipses_gg = self._rand_ellipses(cum_weight, np.shape(weight_map), 3)
+            y = self._masks_and_scores(ellipses_retp, ellipses_gg, lung, lung_area)
+
+        if np.sum(y) == 0:
+            return torch.from_numpy(img.copy()), torch.tensor(np.array([0, 0, 0]).astype(np.float32))
+
+        rand_retp_mask = self._blur(self._buffers['retp_mask'], self.retp_blur, 'retp_blur')
+        rand_gg_mask = self._blur(self._buffers['gg_mask'], self.gg_blur, 'gg_blur')
+
+        # img_wt_retp = rand_retp_mask * retp_candidate + (1 - rand_retp_mask) * img
+        img_wt_retp = np.subtract(self.retp_candidate, img, out=self._buffer('img_wt_retp', shape))
+        img_wt_retp *= rand_retp_mask
+        img_wt_retp += img
+
+        img_wt_retp_gg = np.empty(shape, dtype=np.float32)  # returned, so it can not be a shared buffer
+        if self.gen_gg_as_retp:
+            # img_wt_retp_gg = rand_gg_mask * gg_candidate + (1 - rand_gg_mask) * img_wt_retp
+            np.subtract(self.gg_candidate, img_wt_retp, out=img_wt_retp_gg)
+            img_wt_retp_gg *= rand_gg_mask
+            img_wt_retp_gg += img_wt_retp
         else:
-            return torch.from_numpy(img.astype(np.float32)), torch.tensor(np.array([0, 0, 0]).astype(np.float32))
+            rand_gg_mask = self._blur(rand_gg_mask, self.gg_blur, 'gg_blur2')
+            # lighter gg part, blurred, then img_wt_retp_gg = rand_gg_mask * gg + (1 - rand_gg_mask) * img_wt_retp
+            gg = np.multiply(rand_gg_mask, self.gg_increase, out=self._buffer('gg', shape))
+            gg += img_wt_retp
+            gg_blur = 3
+            gg = cv2.blur(gg, (gg_blur, gg_blur), dst=self._buffer('gg_lighter_blur', shape))
+            np.subtract(gg, img_wt_retp, out=img_wt_retp_gg)
+            img_wt_retp_gg *= rand_gg_mask
+            img_wt_retp_gg += img_wt_retp
+
+        if self.save_img:  # save the synthetic images and the intermediate images
+            y_name = '_'.join([str(y[0]), str(y[1]), str(y[2])])
+            for name, image in [('_0_ori_img_' + self.mode, img), ('_1_retp_candidate', self.retp_candidate),
+                                ('_10_retp_mask_blur', rand_retp_mask), ('_11_gg_mask_blur', rand_gg_mask),
+                                ('_14_img_wt_retp', img_wt_retp), ('_18_img_wt_retp_gg_' + y_name, img_wt_retp_gg)]:
+                savefig(True, image, str(self.counter) + name + '.png')
+
+        self.counter += 1
+        return torch.from_numpy(img_wt_retp_gg), torch.tensor(y.astype(np.float32))
@@ -2,6 +2,7 @@
 # @Time    : 7/11/21 2:31 PM
 # @Author  : Jingnan
 # @Email   : jiajingnan2222@gmail.com
+import functools
 import random
 from medutils.medutils import load_itk
 
@@ -10,9 +11,12 @@ import torch
 # import streamlit as st
 from tqdm import tqdm
 import os
+from typing import Optional
 from monai.transforms import ScaleIntensityRange
 
 from torch.utils.data import Dataset
+from ssc_scoring.mymodules.slice_cache import load_packed_slices, lung_mask_fpath, weight_map_fpath
+from ssc_scoring.mymodules.tool import ordered_map
 
 
 class ReconDatasetd(Dataset):
@@ -23,10 +27,12 @@ class ReconDatasetd(Dataset):
         It is not used yet. This dataset code need to be double checked before using it.
     """
 
-    def __init__(self, data_x_names, transform=None):
+    def __init__(self, data_x_names, transform=None, load_workers: int = 0, load_mode: str = 'thread'):
         self.data_x_names = data_x_names
         print("loading 3D CT ...")
-        self.data_x = [load_itk(x, require_ori_sp=True) for x in tqdm(self.data_x_names)]
+        load = functools.partial(load_itk, require_ori_sp=True)
+        self.data_x = list(tqdm(ordered_map(load, self.data_x_names, load_workers, load_mode),
+                                total=len(self.data_x_names)))
         self.data_x_np = [i[0] for i in self.data_x]
 
         normalize0to1 = ScaleIntensityRange(a_min=-1500.0, a_max=1500.0, b_min=0.0, b_max=1.0, clip=True)
@@ -80,71 +86,71 @@ class SynDataset(Dataset):
         being fed to transforms. it's convinent for future transform, especially for
         :func:`ssc_scoring.mymodules.data_synthesis.SysthesisNewSampled`.
 
+    All slices, labels, origins/spacings, weight maps and lung masks are packed into contiguous arrays (see
+    :func:`ssc_scoring.mymodules.slice_cache.pack_slice_records`) and `__getitem__` returns views of them, so the
+    DataLoader workers share the same pages instead of copying per-slice objects. If `cache_dir` is given, the
+    arrays are memory-mapped from a :class:`ssc_scoring.mymodules.slice_cache.PackedSliceStore` in this directory.
+
+    If `registry` (:class:`ssc_scoring.mymodules.mydata.SliceRegistry`) is given, the slices are taken from the
+    arrays of the registry, which are shared by all datasets built on it, and `cache_dir` is ignored.
+
+    `load_workers` threads (or processes if `load_mode` is 'process') decode the slices, lung masks and weight maps
+    concurrently, see :func:`ssc_scoring.mymodules.tool.ordered_map`.
+
     """
 
-    def __init__(self, data_x_names, data_y_list, index: list = None, transform=None, synthesis=False, require_lung_mask=False):
+    def __init__(self, data_x_names, data_y_list, index: list = None, transform=None, synthesis=False,
+                 require_lung_mask=False, cache_dir: Optional[str] = None, registry=None, load_workers: int = 0,
+                 load_mode: str = 'thread'):
         self.require_lung_mask = require_lung_mask
         self.data_x_names, self.data_y_list = np.array(data_x_names), np.array(data_y_list)
         if index is not None:
             self.data_x_names = self.data_x_names[index]
             self.data_y_list = self.data_y_list[index]
-        print('loading data ...')  # All images are loaded. It is 2D slices, so gpu memory is okay to fit them.
-        self.data_x = [load_itk(x, require_ori_sp=True) for x in tqdm(self.data_x_names)]
-        self.weight_map_fpaths = [os.path.dirname(i) + "/weight_map.npy" for i in self.data_x_names]
-        self.weight_maps = [np.load(i) for i in self.weight_map_fpaths]
         self.synthesis = synthesis
+        self.weight_map_fpaths = np.array([weight_map_fpath(i) for i in self.data_x_names])
         if self.synthesis or self.require_lung_mask:  # return lung mask in the data dictionary
-            mask_end = "_lung_mask"  # load all lung masks
-            self.lung_masks_names = [x.split('.mha')[0] + mask_end + ".mha" for x in tqdm(self.data_x_names)]
-            self.lung_masks = [load_itk(x, require_ori_sp=False) for x in tqdm(self.lung_masks_names)]
-            # self.lung_masks = []
-
-
-        self.data_x_np = [i[0] for i in self.data_x]
-        normalize0to1 = ScaleIntensityRange(a_min=-1500.0, a_max=1500.0, b_min=0.0, b_max=1.0, clip=True)
-        print("truncated to [-1500, 1500], then to [0, 1]")
-
-        self.data_x_np = [normalize0to1(x_np) for x_np in tqdm(self.data_x_np)]
-
-        # if self.synthesis or self.require_lung_mask:  # return lung mask in the data dictionary
-        #     self.lung_masks = [normalize0to1(x_np) for x_np in tqdm(self.lung_masks)]
-
-        # scale data to 0~1, it's convinent for future transform during dataloader
-        self.data_x_or_sp = [[i[1], i[2]] for i in self.data_x]
-        self.ori = np.array([i[1] for i in self.data_x])  # shape order: z, y, x
-        self.sp = np.array([i[2] for i in self.data_x])  # shape order: z, y, x
-
-        # self.data_x_np = [normalize(x) for x in self.data_x_np]
-
-        # log_dict['normalize_data'] = True
-
-        self.data_x_np = [x.astype(np.float32) for x in self.data_x_np]
-        self.data_y_np = [y.astype(np.float32) for y in self.data_y_list]
-        # self.min = [np.min(x) for x in self.data_x_np]
-        # self.data_x_np = [np.pad(x, pad_width=((128, 128), (128, 128)), mode='constant') for x in self.data_x_np]
-        self.data_x_tensor = [torch.as_tensor(x) for x in self.data_x_np]
-        self.data_y_tensor = [torch.as_tensor(y) for y in self.data_y_np]
-
-        # self.min_value = [torch.min(x).item() for x in self.data_x_tensor]  # min values after normalization
-        # self.data_x_tensor = [functional.pad(x, padding=[128, 128], fill=min) for x, min in zip(self.data_x_tensor, self.min_value)]
+            self.lung_masks_names = np.array([lung_mask_fpath(x) for x in self.data_x_names])
+
+        # All images are loaded. It is 2D slices, so gpu memory is okay to fit them.
+        # Images are truncated to [-1500, 1500], then to [0, 1], it's convinent for future transform during dataloader
+        if registry is not None:
+            registry.register(self.data_x_names, self.synthesis or self.require_lung_mask)
+            packed = registry.load()
+            self.slice_idx = registry.index(self.data_x_names)  # position of each slice in the shared arrays
+        else:
+            print('loading data ...')
+            packed = load_packed_slices(list(self.data_x_names), self.synthesis or self.require_lung_mask, cache_dir,
+                                        load_workers, load_mode)
+            self.slice_idx = np.arange(len(self.data_x_names))
+
+        self.data_x = packed['image']  # shape: (N, 512, 512), float32
+        self.data_y = self.data_y_list.astype(np.float32)  # shape: (N, 3)
+        self.ori = packed['origin']  # shape order: z, y, x
+        self.sp = packed['space']  # shape order: z, y, x
+        self.weight_maps = packed['weight_map']  # one weight map per patient
+        self.weight_map_idx = packed['weight_map_idx']
+        if self.synthesis or self.require_lung_mask:
+            self.lung_masks = packed['lung_mask']
 
         self.transform = transform
 
     def __len__(self):
-        return len(self.data_y_np)
+        return len(self.data_y)
 
     def __getitem__(self, idx):
         if torch.is_tensor(idx):
             idx = idx.tolist()
 
-        data = {'image_key': self.data_x_tensor[idx],
-                'label_key': self.data_y_tensor[idx],
-                'space_key': self.sp[idx],
-                'origin_key': self.ori[idx],
+        i = self.slice_idx[idx]
+        data = {'image_key': torch.from_numpy(self.data_x[i]),
+                'label_key': torch.from_numpy(self.data_y[idx]),
+                'space_key': self.sp[i],
+                'origin_key': self.ori[i],
                 'fpath_key': self.data_x_names[idx],
-                'weight_map_key': self.weight_maps[idx]}
+                'weight_map_key': self.weight_maps[self.weight_map_idx[i]]}
         if self.synthesis or self.require_lung_mask:
-            new_dict = {'lung_mask_key': self.lung_masks[idx]}
+            new_dict = {'lung_mask_key': self.lung_masks[i]}
             data.update(new_dict)
         if self.transform:
             data = self.transform(data)
@@ -3,100 +3,204 @@
 # @Author  : Jingnan
 # @Email   : jiajingnan2222@gmail.com
 
-from typing import (Union, Dict)
+from typing import (Union, Dict, Optional, Iterable, Tuple)
 
 import monai
-import medutils.medutils as futil
 
 import numpy as np
 import torch
 from torch.utils.data import DataLoader
 
-from ssc_scoring.mymodules.mytrans import LoadDatad, NormImgPosd, RandCropLevelRegiond, CropCorseRegiond, CropPosd
+from ssc_scoring.mymodules.mytrans import LoadDatad, NormImgPosd, CropCorseRegiond
+from ssc_scoring.mymodules.composed_trans import batch_xformd_score
+from ssc_scoring.mymodules.cpu_infer import CpuInfer, compare_to_fp32, fp32_path
 from ssc_scoring.mymodules.path import PathInit
+from ssc_scoring.mymodules.pred_writer import PredWriter
 from ssc_scoring.mymodules.path import PathPos as Path
 
 
-def SlidingLoader(fpath, world_pos, z_size, stride=1, batch_size=1, mode='valid', args=None):
+def corse_level_in_img(corse: CropCorseRegiond, fpath: str, level: int, origin_z: float, space_z: float) -> int:
+    """Slice number of the coarse (1st stage) prediction of `level` in image `fpath`."""
+    corse_world = corse.corse_pred(fpath)[level - 1]  # world position in mm
+    return int((corse_world - origin_z) / space_z)
+
+
+def sliding_windows(fpath, world_pos, z_size, stride=1, mode='valid', args=None,
+                    corse: Optional[CropCorseRegiond] = None) -> Tuple[torch.Tensor, np.ndarray, np.ndarray]:
+    """Load and normalize one 3D image once and compute the start slices of its sliding windows along z.
+
+    Args:
+        fpath: Full path of the 3D image.
+        world_pos: World positions of 5 levels.
+        z_size: Patch size along z.
+        stride: Stride between 2 neighboring patches.
+        mode: 'train', 'validaug', 'valid' or 'test', used to find the coarse predictions if `args.infer_2nd`.
+        args: Arguments with `train_on_level`, `level_node`, `infer_2nd` and `eval_id`.
+        corse: Coarse predictions used if `args.infer_2nd`. It is built from the results of `args.eval_id` if None.
+
+    Returns:
+        Normalized image (float32 tensor, shape order: z, y, x), label (slice numbers of the predicted levels in the
+        image) with shape (nb_levels, ) and starts of the windows with shape (n, ).
+
+    """
     print(f'start load {fpath} for sliding window inference')
     xforms = [LoadDatad(), NormImgPosd()]  #
     trans = monai.transforms.Compose(xforms)
 
     data = trans({'fpath_key': fpath, 'world_key': world_pos})
-    raw_x = data['image_key']
+    raw_x = torch.from_numpy(np.ascontiguousarray(data['image_key'], dtype=np.float32))
 
     assert raw_x.shape[0] > z_size  # shape along z should be higher than z_size
 
+    label = data['label_in_img_key']
     if args.train_on_level or args.level_node:  # the output 3D patch should be around the specific level
-        data['label_in_img_key'] = np.array(data['label_in_img_key'][args.train_on_level - 1])
-        label = data['label_in_img_key']
-        start_lower: int = label - z_size  # start lower than this value can not crop a patch including the level
-        start_lower = max(0, start_lower)  # if start_lower<0, use 0
-
-        start_higher: int = label  # start higher than this value can not include the level
-        start_higher = min(raw_x.shape[0] - z_size, start_higher) # if start_higher > raw_x.shape[0]- z_size
+        label = np.array(label[args.train_on_level - 1]).reshape(-1, )
+        if args.infer_2nd:  # patches are around the coarse prediction instead of the label
+            if corse is None:
+                mypath2 = Path(args.eval_id)
+                corse = CropCorseRegiond(level_node=args.level_node, train_on_level=args.train_on_level,
+                                         height=z_size, rand_start=False, data_fpath=mypath2.data(mode),
+                                         pred_world_fpath=mypath2.pred_world(mode))
+            level = args.train_on_level if args.train_on_level else 5
+            center = corse_level_in_img(corse, fpath, level, data['origin_key'][0], data['space_key'][0])
+        else:
+            center = int(label[0])
+        start_lower: int = max(0, center - z_size)  # start lower than this value can not crop a patch including the level
+        start_higher: int = min(raw_x.shape[0] - z_size, center)  # start higher than this value can not include the level
     else:  # if not level is assigned, start should range from 0 to raw_x.shape[0] - z_size
         start_lower = 0
         start_higher = raw_x.shape[0] - z_size
-    # print('data_world_key', data['world_key'])
 
-    # ranges = raw_x.shape[0] - z_size
     print(f'start point ranges: {start_lower} to {start_higher}')
-
-    batch_patch = []
-    batch_new_label = []
-    batch_start = []
-    i = 0
-
-    start = start_lower
-    while start < start_higher:
-        if i < batch_size:
-            print(f'start: {start}, i: {i}')
-            if args.infer_2nd:
-                mypath2 = Path(args.eval_id)
-                crop = CropCorseRegiond(level_node=args.level_node,
-                                        train_on_level=args.train_on_level,
-                                        height=args.z_size,
-                                        rand_start=False,
-                                        start=start,
-                                        data_fpath=mypath2.data(mode),
-                                        pred_world_fpath=mypath2.pred_world(mode))
-            elif args.level_node or args.train_on_level:
-                crop = RandCropLevelRegiond(level_node=args.level_node,
-                                            train_on_level=args.train_on_level,
-                                            height=args.z_size,
-                                            rand_start=False,
-                                            start=start)
-            else:
-                crop = CropPosd(start=start, height=args.z_size)
-
-            new_data = crop(data)
-            new_patch, new_label = new_data['image_key'], new_data['label_in_patch_key']
-            # patch: np.ndarray = raw_x[start:start + z_size]  # z, y, z
-            # patch = patch.astype(np.float32)
-            # new_label: torch.Tensor = label - start
-            new_patch = new_patch[None]  # add a channel
-            batch_patch.append(new_patch)
-            batch_new_label.append(new_label)
+    starts = np.arange(start_lower, start_higher, stride)
+    if len(starts) == 0:  # at least one patch
+        starts = np.array([min(max(start_lower, 0), raw_x.shape[0] - z_size)])
+    return raw_x, label, starts
+
+
+def SlidingLoader(fpath, world_pos, z_size, stride=1, batch_size=1, mode='valid', args=None,
+                  corse: Optional[CropCorseRegiond] = None):
+    """Sliding-window patches along z of one 3D image.
+
+    The image is loaded and normalized once. Each patch is a view of the normalized image which is copied directly to
+    a (pinned if cuda is available) batch buffer, so no transform is built and no patch is copied twice per window.
+
+    .. warning::
+        The same batch buffer is yielded for every batch, and it is overwritten by the next batch. Move it to device
+        or copy it before the next iteration.
+
+    Args:
+        fpath: Full path of the 3D image.
+        world_pos: World positions of 5 levels.
+        z_size: Patch size along z.
+        stride: Stride between 2 neighboring patches.
+        batch_size: Number of patches per batch.
+        mode: 'train', 'validaug', 'valid' or 'test', used to find the coarse predictions if `args.infer_2nd`.
+        args: Arguments with `train_on_level`, `level_node`, `infer_2nd` and `eval_id`.
+        corse: Coarse predictions used if `args.infer_2nd`. It is built from the results of `args.eval_id` if None.
+
+    Yields:
+        batch_patch with shape (n, 1, z_size, y, x), batch_new_label with shape (n, nb_levels) and batch_start with
+        shape (n, ).
+
+    """
+    raw_x, label, starts = sliding_windows(fpath, world_pos, z_size, stride, mode, args, corse)
+    batch_patch = torch.empty((min(batch_size, len(starts)), 1, z_size, *raw_x.shape[1:]), dtype=torch.float32,
+                              pin_memory=torch.cuda.is_available())
+    for batch_idx in range(0, len(starts), batch_size):
+        batch_start = starts[batch_idx: batch_idx + batch_size]
+        for i, start in enumerate(batch_start):
+            batch_patch[i, 0].copy_(raw_x[start: start + z_size])  # view of the image, one copy to the batch
+        batch_new_label = torch.from_numpy((label[None] - batch_start.reshape(-1, 1)).astype(np.float32))
+
+        yield batch_patch[:len(batch_start)], batch_new_label, torch.from_numpy(batch_start)
+
+
+def PooledSlidingLoader(scans: Iterable[Tuple[str, np.ndarray]], z_size, stride=1, batch_size=1, mode='valid',
+                        args=None, corse: Optional[CropCorseRegiond] = None):
+    """Sliding-window patches along z of several 3D images, pooled into full batches.
+
+    Same patches as :func:`SlidingLoader`, but the windows of consecutive images fill the same batch, so images with
+    fewer windows than `batch_size` do not lead to small forward passes. Only one image is loaded at a time. Windows
+    are yielded in the order of `scans`, so all windows of an image have been yielded once a window of a later image
+    is yielded. A batch is yielded early only if the next image has another shape along y and x.
+
+    .. warning::
+        The same batch buffer is yielded for every batch, and it is overwritten by the next batch. Move it to device
+        or copy it before the next iteration.
+
+    Args:
+        scans: (fpath, world positions of 5 levels) of each image.
+        z_size: Patch size along z.
+        stride: Stride between 2 neighboring patches.
+        batch_size: Number of patches per batch.
+        mode: 'train', 'validaug', 'valid' or 'test', used to find the coarse predictions if `args.infer_2nd`.
+        args: Arguments with `train_on_level`, `level_node`, `infer_2nd` and `eval_id`.
+        corse: Coarse predictions used if `args.infer_2nd`. It is built from the results of `args.eval_id` if None.
+
+    Yields:
+        batch_patch with shape (n, 1, z_size, y, x), batch_new_label with shape (n, nb_levels), batch_start with
+        shape (n, ) and batch_owner with shape (n, ), the index in `scans` of the image of each patch.
+
+    Examples:
+        :meth:`Evaluater_pos.run`
+
+    """
+    batch_patch: Optional[torch.Tensor] = None
+    new_labels, batch_start, batch_owner = [], [], []
+
+    def batch():
+        n = len(batch_start)
+        return (batch_patch[:n], torch.from_numpy(np.array(new_labels, dtype=np.float32)),
+                torch.from_numpy(np.array(batch_start)), torch.tensor(batch_owner))
+
+    for owner, (fpath, world_pos) in enumerate(scans):
+        raw_x, label, starts = sliding_windows(fpath, world_pos, z_size, stride, mode, args, corse)
+        shape = (batch_size, 1, z_size, *raw_x.shape[1:])
+        if batch_patch is None or batch_patch.shape != shape:
+            if batch_start:
+                yield batch()
+                new_labels, batch_start, batch_owner = [], [], []
+            batch_patch = torch.empty(shape, dtype=torch.float32, pin_memory=torch.cuda.is_available())
+        for start in starts:
+            batch_patch[len(batch_start), 0].copy_(raw_x[start: start + z_size])  # one copy to the batch
+            new_labels.append(label - start)
             batch_start.append(start)
-
-            start += stride
-            i += 1
-
-        if start >= start_higher or i >= batch_size:
-            batch_patch = torch.tensor(np.array(batch_patch))
-            batch_new_label = torch.tensor(batch_new_label)
-            batch_start = torch.tensor(batch_start)
-
-            yield batch_patch, batch_new_label, batch_start
-
-            batch_patch = []
-            batch_new_label = []
-            batch_start = []
-            i = 0
+            batch_owner.append(owner)
+            if len(batch_start) == batch_size:
+                yield batch()
+                new_labels, batch_start, batch_owner = [], [], []
+    if batch_start:
+        yield batch()
+
+
+def cpu_infer_of(net: torch.nn.Module, device: torch.device, args) -> Optional[CpuInfer]:
+    """The CPU inference mode of `net` if `args.cpu_infer` and `device` is CPU, otherwise None."""
+    if device.type != 'cpu' or not getattr(args, 'cpu_infer', 0):
+        return None
+    return CpuInfer(net, bf16=bool(args.cpu_bf16), channels_last=bool(args.channels_last),
+                    threads=args.infer_threads, net_name=args.net)
+
+
+def predict(net: torch.nn.Module, batch_x, amp: bool, cpu_infer: Optional[CpuInfer] = None) -> torch.Tensor:
+    """Forward pass without gradients, with autocast on cuda if `amp`, or by `cpu_infer` if it is not None."""
+    if cpu_infer is not None:
+        return cpu_infer(batch_x)
+    if amp:
+        with torch.cuda.amp.autocast():
+            with torch.no_grad():
+                pred = net(batch_x)
+    else:
+        with torch.no_grad():
+            pred = net(batch_x)
+    return pred
 
 
-def record_preds(mode, batch_y, pred, mypath):
+def record_preds(mode, batch_y, pred, mypath, writer: Optional[PredWriter] = None):
+    """Record labels and predictions of one batch. They are written at once if `writer` is None, otherwise they are
+    buffered in `writer` until it is flushed."""
+    flush = writer is None
+    writer = PredWriter() if writer is None else writer
     batch_label = batch_y.cpu().detach().numpy().astype('int')
     batch_preds = pred.cpu().detach().numpy()
     batch_preds_int = batch_preds.astype('int')
@@ -104,10 +208,12 @@ def record_preds(mode, batch_y, pred, mypath):
     batch_preds_end5 = batch_preds_end5.astype('int')
 
     head = ['disext', 'gg', 'retp']
-    futil.appendrows_to(mypath.label(mode), batch_label, head=head)
-    futil.appendrows_to(mypath.pred(mode), batch_preds, head=head)
-    futil.appendrows_to(mypath.pred_int(mode), batch_preds_int, head=head)
-    futil.appendrows_to(mypath.pred_end5(mode), batch_preds_end5, head=head)
+    writer.append(mypath.label(mode), batch_label, head=head)
+    writer.append(mypath.pred(mode), batch_preds, head=head)
+    writer.append(mypath.pred_int(mode), batch_preds_int, head=head)
+    writer.append(mypath.pred_end5(mode), batch_preds_end5, head=head)
+    if flush:
+        writer.flush()
 
 
 def round_to_5(pred: Union[torch.Tensor, np.ndarray], device=torch.device("cpu")) -> Union[torch.Tensor, np.ndarray]:
@@ -139,84 +245,103 @@ class Evaluater_pos():
         self.net = self.net.to(self.device).eval()
         self.amp = True if torch.cuda.is_available() else False
         self.args = args
-
-    def run(self):
+        self.cpu_infer = cpu_infer_of(self.net, self.device, args)
+        self.corse = None
+        if self.args.infer_2nd:  # read the coarse predictions once for all images
+            mypath2 = Path(self.args.eval_id)
+            self.corse = CropCorseRegiond(level_node=self.args.level_node, train_on_level=self.args.train_on_level,
+                                          height=self.args.z_size, rand_start=False,
+                                          data_fpath=mypath2.data(self.mode),
+                                          pred_world_fpath=mypath2.pred_world(self.mode))
+        self.writer = PredWriter()  # predictions of this mode are written once at the end of run()
+
+    def scans(self, images: Dict[int, Dict]):
+        """Yield (fpath, world positions) of all images in the dataloader, and keep the data needed to record the
+        predictions of each image in `images`, keyed by the index of the image in the dataloader."""
+        owner = 0  # index of the image in the dataloader, same as the owner of its windows in PooledSlidingLoader
         for batch_data in self.dataloader:
             for idx in range(len(batch_data['image_key'])):
-                print('len_batch', len(batch_data))
-                print(batch_data['fpath_key'][idx], batch_data['ori_world_key'][idx])
-                sliding_loader = SlidingLoader(batch_data['fpath_key'][idx], batch_data['ori_world_key'][idx],
-                                               z_size=self.args.z_size, stride=self.args.infer_stride,
-                                               batch_size=self.args.batch_size,
-                                               mode=self.mode, args=self.args)
-                pred_in_img_ls = []
-                pred_in_patch_ls = []
-                label_in_patch_ls = []
-                for patch, new_label, start in sliding_loader:
-                    batch_x = patch.to(self.device)
-                    if self.args.level_node != 0:
-                        batch_level = torch.ones((len(batch_x), 1)) * self.args.train_on_level
-                        batch_level = batch_level.to(self.device)
-                        print('batch_level', batch_level.clone().cpu().numpy())
-                        batch_x = [batch_x, batch_level]
-
-                    if self.amp:
-                        with torch.cuda.amp.autocast():
-                            with torch.no_grad():
-                                pred = self.net(batch_x)
-                    else:
-                        with torch.no_grad():
-                            pred = self.net(batch_x)
-
-                    # pred = pred.cpu().detach().numpy()
-                    pred_in_patch = pred.cpu().detach().numpy()
-                    pred_in_patch_ls.append(pred_in_patch)
-
-                    start_np = start.numpy().reshape((-1, 1))
-                    pred_in_img = pred_in_patch + start_np  # re organize it to original coordinate
-                    pred_in_img_ls.append(pred_in_img)
-
-                    new_label_ = new_label + start_np
-                    label_in_patch_ls.append(new_label_)
-
-                pred_in_img_all = np.concatenate(pred_in_img_ls, axis=0)
-                pred_in_patch_all = np.concatenate(pred_in_patch_ls, axis=0)
-                label_in_patch_all = np.concatenate(label_in_patch_ls, axis=0)
-
-                batch_label: np.ndarray = batch_data['label_in_img_key'][idx].cpu().detach().numpy().astype(int)
-                batch_preds_ave: np.ndarray = np.median(pred_in_img_all, 0)  # todo: compare mean and medial!
-                batch_preds_int: np.ndarray = batch_preds_ave.astype(int)
-                batch_preds_world: np.ndarray = batch_preds_ave * batch_data['space_key'][idx][0].item() + \
-                                                batch_data['origin_key'][idx][0].item()
-                batch_world: np.ndarray = batch_data['world_key'][idx].cpu().detach().numpy()
-                head = ['L1', 'L2', 'L3', 'L4', 'L5']
-                if self.args.train_on_level:
-                    head = [head[self.args.train_on_level - 1]]
-                if idx < 5:
-                    futil.appendrows_to(self.mypath.pred(self.mode).split('.csv')[0] + '_' + str(idx) + '.csv',
-                                        pred_in_img_all, head=head)
-                    futil.appendrows_to(self.mypath.pred(self.mode).split('.csv')[0] + '_' + str(idx) + '_in_patch.csv',
-                                        pred_in_patch_all, head=head)
-                    futil.appendrows_to(
-                        self.mypath.label(self.mode).split('.csv')[0] + '_' + str(idx) + '_in_patch.csv',
-                        label_in_patch_all, head=head)
-
-                    pred_all_world = pred_in_img_all * batch_data['space_key'][idx][0].item() + \
-                                     batch_data['origin_key'][idx][0].item()
-                    futil.appendrows_to(self.mypath.pred(self.mode).split('.csv')[0] + '_' + str(idx) + '_world.csv',
-                                        pred_all_world, head=head)
-
-                if self.args.train_on_level:
-                    batch_label = np.array(batch_label).reshape(-1, )
-                    batch_preds_ave = np.array(batch_preds_ave).reshape(-1, )
-                    batch_preds_int = np.array(batch_preds_int).reshape(-1, )
-                    batch_preds_world = np.array(batch_preds_world).reshape(-1, )
-                    batch_world = np.array(batch_world).reshape(-1, )
-                futil.appendrows_to(self.mypath.label(self.mode), batch_label, head=head)  # label in image
-                futil.appendrows_to(self.mypath.pred(self.mode), batch_preds_ave, head=head)  # pred in image
-                futil.appendrows_to(self.mypath.pred_int(self.mode), batch_preds_int, head=head)
-                futil.appendrows_to(self.mypath.pred_world(self.mode), batch_preds_world, head=head)  # pred in world
-                futil.appendrows_to(self.mypath.world(self.mode), batch_world, head=head)  # 33 label in world
+                images[owner] = {'idx': idx,  # index in the dataloader batch
+                                       'label_in_img': batch_data['label_in_img_key'][idx].cpu().detach().numpy(),
+                                       'space_z': batch_data['space_key'][idx][0].item(),
+                                       'origin_z': batch_data['origin_key'][idx][0].item(),
+                                       'world': batch_data['world_key'][idx].cpu().detach().numpy(),
+                                       'pred_in_patch': [], 'new_label': [], 'start': []}
+                owner += 1
+                yield batch_data['fpath_key'][idx], batch_data['ori_world_key'][idx]
+
+    def run(self):
+        images: Dict[int, Dict] = {}
+        sliding_loader = PooledSlidingLoader(self.scans(images), z_size=self.args.z_size,
+                                             stride=self.args.infer_stride,
+                                             batch_size=self.args.infer_batch_size or self.args.batch_size,
+                                             mode=self.mode, args=self.args, corse=self.corse)
+        next_owner = 0  # images before it are recorded
+        for patch, new_label, start, owner in sliding_loader:
+            # safe to reuse the pinned buffer: pred.cpu() below waits for this copy before the next batch
+            batch_x = patch.to(self.device, non_blocking=True)
+            if self.args.level_node != 0:
+                batch_level = torch.ones((len(batch_x), 1)) * self.args.train_on_level
+                batch_level = batch_level.to(self.device)
+                print('batch_level', batch_level.clone().cpu().numpy())
+                batch_x = [batch_x, batch_level]
+
+            pred = predict(self.net, batch_x, self.amp, self.cpu_infer)
+
+            # scatter the predictions of the pooled windows back to their images
+            pred_in_patch = pred.cpu().detach().numpy()
+            owner_np, start_np, new_label_np = owner.numpy(), start.numpy(), new_label.numpy()
+            for own in np.unique(owner_np):
+                rows = owner_np == own
+                images[int(own)]['pred_in_patch'].append(pred_in_patch[rows])
+                images[int(own)]['new_label'].append(new_label_np[rows])
+                images[int(own)]['start'].append(start_np[rows])
+            for own in range(next_owner, int(owner_np[-1])):  # windows are in order, these images are complete
+                self.record_image(images.pop(own))
+            next_owner = max(next_owner, int(owner_np[-1]))
+        for own in sorted(images):
+            self.record_image(images.pop(own))
+        self.writer.flush()
+
+    def record_image(self, image: Dict):
+        """Aggregate the predictions of all windows of one image by the median and record them."""
+        idx = image['idx']
+        start_np = np.concatenate(image['start']).reshape((-1, 1))
+        pred_in_patch_all = np.concatenate(image['pred_in_patch'], axis=0)
+        pred_in_img_all = pred_in_patch_all + start_np  # re organize it to original coordinate
+        label_in_patch_all = np.concatenate(image['new_label'], axis=0) + start_np
+
+        batch_label: np.ndarray = image['label_in_img'].astype(int)
+        batch_preds_ave: np.ndarray = np.median(pred_in_img_all, 0)  # todo: compare mean and medial!
+        batch_preds_int: np.ndarray = batch_preds_ave.astype(int)
+        batch_preds_world: np.ndarray = batch_preds_ave * image['space_z'] + image['origin_z']
+        batch_world: np.ndarray = image['world']
+        head = ['L1', 'L2', 'L3', 'L4', 'L5']
+        if self.args.train_on_level:
+            head = [head[self.args.train_on_level - 1]]
+        if idx < 5:
+            self.writer.append(self.mypath.pred(self.mode).split('.csv')[0] + '_' + str(idx) + '.csv',
+                               pred_in_img_all, head=head)
+            self.writer.append(self.mypath.pred(self.mode).split('.csv')[0] + '_' + str(idx) + '_in_patch.csv',
+                               pred_in_patch_all, head=head)
+            self.writer.append(self.mypath.label(self.mode).split('.csv')[0] + '_' + str(idx) + '_in_patch.csv',
+                               label_in_patch_all, head=head)
+
+            pred_all_world = pred_in_img_all * image['space_z'] + image['origin_z']
+            self.writer.append(self.mypath.pred(self.mode).split('.csv')[0] + '_' + str(idx) + '_world.csv',
+                               pred_all_world, head=head)
+
+        if self.args.train_on_level:
+            batch_label = np.array(batch_label).reshape(-1, )
+            batch_preds_ave = np.array(batch_preds_ave).reshape(-1, )
+            batch_preds_int = np.array(batch_preds_int).reshape(-1, )
+            batch_preds_world = np.array(batch_preds_world).reshape(-1, )
+            batch_world = np.array(batch_world).reshape(-1, )
+        self.writer.append(self.mypath.label(self.mode), batch_label, head=head)  # label in image
+        self.writer.append(self.mypath.pred(self.mode), batch_preds_ave, head=head)  # pred in image
+        self.writer.append(self.mypath.pred_int(self.mode), batch_preds_int, head=head)
+        self.writer.append(self.mypath.pred_world(self.mode), batch_preds_world, head=head)  # pred in world
+        self.writer.append(self.mypath.world(self.mode), batch_world, head=head)  # 33 label in world
 
 
 class Evaluater_score():
@@ -229,6 +354,9 @@ class Evaluater_score():
         self.net = self.net.to(self.device).eval()
         self.amp = True if torch.cuda.is_available() else False
         self.args = args
+        self.cpu_infer = cpu_infer_of(self.net, self.device, args)
+        self.batch_xform = batch_xformd_score(mode, args)
+        self.writer = PredWriter()  # predictions of this mode are written once at the end of run()
 
     def run(self):
         for data in self.dataloader:
@@ -245,26 +373,36 @@ class Evaluater_score():
 
             batch_x = batch_x.to(self.device)
             batch_y = batch_y.to(self.device)
+            if self.batch_xform is not None:
+                batch_x = self.batch_xform(batch_x)
 
-            if self.amp:
-                with torch.cuda.amp.autocast():
-                    with torch.no_grad():
-                        pred = self.net(batch_x)
-            else:
-                with torch.no_grad():
-                    pred = self.net(batch_x)
+            pred = predict(self.net, batch_x, self.amp, self.cpu_infer)
             print(f'batch_pred is: {pred}')
             print(f'mode: {self.mode}, ==========')
 
-            record_preds(self.mode, batch_y, pred, self.mypath)
+            record_preds(self.mode, batch_y, pred, self.mypath, self.writer)
+        self.writer.flush()
 
 
-def record_best_preds(net: torch.nn.Module, data_dict: Dict[str, DataLoader], mypath: Path, args):
+def record_best_preds(net: torch.nn.Module, data_dict: Dict[str, DataLoader], mypath: Path, args) -> Dict[str, float]:
+    """Record the predictions of the best weights for all modes.
+
+    Returns:
+        Differences of the metrics to fp32 predictions (see :func:`ssc_scoring.mymodules.cpu_infer.compare_to_fp32`)
+        if the bf16 CPU inference is validated by `args.validate_cpu_infer`, otherwise an empty dict.
+
+    """
     net.load_state_dict(torch.load(mypath.model_fpath))  # load the best weights to do evaluation
+    Evaluater = Evaluater_score if mypath.project_name == 'score' else Evaluater_pos
+    cpu_infer_dt = {}
     for mode, data in data_dict.items():
         dataloader = data['dl'] if isinstance(data, dict) else data
-        if mypath.project_name=='score':
-            evaluater = Evaluater_score(net, dataloader, mode, mypath, args)
-        else:
-            evaluater = Evaluater_pos(net, dataloader, mode, mypath, args)
+        evaluater = Evaluater(net, dataloader, mode, mypath, args)
         evaluater.run()
+        if evaluater.cpu_infer is not None and evaluater.cpu_infer.bf16 and getattr(args, 'validate_cpu_infer', 0):
+            evaluater_fp32 = Evaluater(net, dataloader, mode, fp32_path(mypath), args)
+            evaluater_fp32.cpu_infer.bf16 = False  # reference predictions
+            evaluater_fp32.run()
+            cpu_infer_dt.update(compare_to_fp32(mypath, evaluater_fp32.mypath, mode))
+            print(f'bf16 - fp32 metrics of {mode}: {cpu_infer_dt}')
+    return cpu_infer_dt
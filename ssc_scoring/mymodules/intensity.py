@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 11:20 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+import warnings
+from typing import Tuple, Union
+
+import numpy as np
+import torch
+
+ArrayType = Union[np.ndarray, torch.Tensor]
+
+
+def clip_cast(x: np.ndarray, a_min: float, a_max: float, dtype=np.float32) -> np.ndarray:
+    """Clip `x` to [a_min, a_max] and cast it to `dtype` in one pass with one allocation.
+
+    Examples:
+        :class:`ssc_scoring.mymodules.mytrans.LoadDatad`
+
+    """
+    out = np.empty(x.shape, dtype=dtype)
+    np.clip(x, a_min, a_max, out=out)
+    return out
+
+
+def clip_scale(x: np.ndarray, a_min: float, a_max: float, b_min: float, b_max: float,
+               dtype=np.float32) -> np.ndarray:
+    """Same as `monai.transforms.ScaleIntensityRange(a_min, a_max, b_min, b_max, clip=True)` followed by a cast to
+    `dtype`, with one allocation. Clipping to [a_min, a_max] before scaling equals clipping to [b_min, b_max] after.
+
+    Examples:
+        :func:`ssc_scoring.mymodules.slice_cache.load_slice`
+
+    """
+    out = clip_cast(x, a_min, a_max, dtype)
+    out -= a_min
+    out /= (a_max - a_min)
+    out *= (b_max - b_min)
+    out += b_min
+    return out
+
+
+def std_mean(x: ArrayType, unbiased: bool = False) -> Tuple[float, float]:
+    """Standard deviation and mean of all elements in a single pass (Welford reduction of `torch.std_mean`).
+
+    Numpy arrays are wrapped without copy. `unbiased=False` equals `np.std`, `unbiased=True` equals `torch.std`.
+
+    """
+    if isinstance(x, torch.Tensor):
+        t = x
+    else:
+        with warnings.catch_warnings():  # read-only arrays (e.g. memory-mapped) are only read here
+            warnings.simplefilter('ignore', UserWarning)
+            t = torch.from_numpy(np.asarray(x))
+    if not t.is_floating_point():
+        t = t.float()
+    std, mean = torch.std_mean(t, unbiased=unbiased)
+    return std.item(), mean.item()
+
+
+def standardize(x: ArrayType, inplace: bool = False, unbiased: bool = False) -> ArrayType:
+    """Standardize `x` to zero mean and unit standard deviation.
+
+    Args:
+        x: A float numpy array or torch tensor.
+        inplace: Overwrite `x`. Otherwise one output array is allocated.
+        unbiased: Use the unbiased standard deviation.
+
+    Examples:
+        :class:`ssc_scoring.mymodules.mytrans.NormImgPosd`
+
+    """
+    std, mean = std_mean(x, unbiased=unbiased)
+    if isinstance(x, torch.Tensor):
+        out = x if inplace else x.clone()
+        return out.sub_(mean).div_(std)
+    out = np.subtract(x, mean, out=x if inplace else None)
+    np.divide(out, std, out=out)
+    return out
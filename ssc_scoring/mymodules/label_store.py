@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 3:31 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+import os
+import pickle
+from typing import Dict, Sequence
+
+import numpy as np
+import pandas as pd
+
+LEVELS = [1, 2, 3, 4, 5]
+SCORES = ['disext', 'gg', 'retp']
+
+
+class GohLabelStore:
+    """Goh scores and level positions of all patients, parsed from the label excel file only once.
+
+    The parsed table is cached as a pickle file next to the excel file (`GohScores.xlsx.pkl`) together with the
+    modification time of the excel file, so the slow openpyxl parsing is only done again after the excel file is
+    changed. All scores are kept in one array of shape (nb_pats, 5 levels, 3 scores) and all level positions in one
+    array of shape (nb_pats, 5 levels).
+
+    Args:
+        label_file: Full path of the excel file, with columns 'PatID', 'L{level}_disext', 'L{level}_gg',
+            'L{level}_retp' and 'L{level}_pos'.
+
+    Examples:
+        :class:`ssc_scoring.mymodules.mydata.LoaderInit`
+
+    """
+
+    def __init__(self, label_file: str):
+        self.label_file = label_file
+        self.cache_fpath = label_file + '.pkl'
+        self.df = self._load_df()  # index: PatID
+        self.pat_ids = self.df.index.to_numpy().astype(int)
+        self.row_of_pat = {pat_id: row for row, pat_id in enumerate(self.pat_ids)}
+        self._arrays: Dict[str, np.ndarray] = {}  # built at the first use, an excel file may have no positions
+
+    @property
+    def score_array(self) -> np.ndarray:
+        if 'score' not in self._arrays:
+            self._arrays['score'] = self._columns_array([[f'L{level}_{score}' for score in SCORES]
+                                                         for level in LEVELS])
+        return self._arrays['score']
+
+    @property
+    def pos_array(self) -> np.ndarray:
+        if 'pos' not in self._arrays:
+            self._arrays['pos'] = self._columns_array([f'L{level}_pos' for level in LEVELS])
+        return self._arrays['pos']
+
+    def _load_df(self) -> pd.DataFrame:
+        mtime_ns = os.stat(self.label_file).st_mtime_ns
+        if os.path.isfile(self.cache_fpath):
+            try:
+                with open(self.cache_fpath, 'rb') as f:
+                    cached = pickle.load(f)
+                if cached['mtime_ns'] == mtime_ns:
+                    return cached['df']
+            except Exception:  # e.g. a cache written by another version of pandas or numpy, parse the excel again
+                pass
+
+        df = pd.read_excel(self.label_file, engine='openpyxl').set_index('PatID')
+        try:
+            tmp_fpath = self.cache_fpath + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp_fpath, 'wb') as f:
+                pickle.dump({'mtime_ns': mtime_ns, 'df': df}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_fpath, self.cache_fpath)
+        except OSError as err:
+            print(f"can not cache labels to {self.cache_fpath}: {err}")
+        return df
+
+    def _columns_array(self, columns) -> np.ndarray:
+        """Array of `columns` (nested list of column names) with shape (nb_pats, *shape of columns)."""
+        columns = np.array(columns)
+        names = list(columns.reshape(-1))
+        missing = [name for name in names if name not in self.df.columns]
+        if missing:
+            raise KeyError(f"Can not find the columns {missing} in {self.label_file}")
+        return self.df[names].to_numpy().reshape(len(self.df), *columns.shape)  # keep int dtype of scores
+
+    def rows(self, pat_ids: Sequence[int]) -> np.ndarray:
+        try:
+            return np.array([self.row_of_pat[int(pat_id)] for pat_id in pat_ids], dtype=np.int64)
+        except KeyError as err:
+            raise Exception(f"Can not find patient {err} in {self.label_file}")
+
+    def scores(self, pat_ids: Sequence[int]) -> np.ndarray:
+        """Goh scores with shape (len(pat_ids), 5, 3), the last axis is ordered by disext, gg, retp."""
+        return self.score_array[self.rows(pat_ids)]
+
+    def positions(self, pat_ids: Sequence[int]) -> np.ndarray:
+        """Level positions with shape (len(pat_ids), 5)."""
+        return self.pos_array[self.rows(pat_ids)]
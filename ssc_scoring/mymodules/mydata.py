@@ -17,6 +17,11 @@ from monai.data import DataLoader
 from monai.transforms import Transform
 from ssc_scoring.mymodules.composed_trans import xformd_pos, xformd_score, xformd_pos2score
 from ssc_scoring.mymodules.datasets import SynDataset
+from ssc_scoring.mymodules.slice_cache import load_packed_slices
+from ssc_scoring.mymodules.volume_cache import VolumeCache
+from ssc_scoring.mymodules.raw_volume import convert_all_to_raw
+from ssc_scoring.mymodules.pat_index import load_pat_index
+from ssc_scoring.mymodules.label_store import GohLabelStore
 from ssc_scoring.mymodules.tool import sampler_by_disext
 import pathlib
 
@@ -44,6 +49,48 @@ def clean_data(pft_df, data_dir):
 
     return pft_df
 
+class SliceRegistry:
+    """Decoded 2D slices shared by all :class:`ssc_scoring.mymodules.datasets.SynDataset` of one `LoadScore`.
+
+    Datasets register their slice paths, then the union of all registered paths is decoded (or read from the slice
+    cache) once and packed into one set of contiguous arrays. Each dataset only keeps the positions of its slices in
+    these arrays, so e.g. `validaug` and `valid`, which use the same `vd_x`, do not decode and store it twice.
+
+    Lung masks are loaded for all slices as soon as one registered dataset requires them.
+
+    Examples:
+        :meth:`ssc_scoring.mymodules.mydata.LoadScore.load`
+
+    """
+    def __init__(self, cache_dir: str = None, load_workers: int = 0, load_mode: str = 'thread'):
+        self.cache_dir = cache_dir
+        self.load_workers = load_workers
+        self.load_mode = load_mode
+        self.fpaths: List[str] = []
+        self.fpath_idx = {}
+        self.require_lung_mask = False
+        self.packed = None
+
+    def register(self, fpaths, require_lung_mask: bool = False) -> None:
+        new_fpaths = [f for f in dict.fromkeys(fpaths) if f not in self.fpath_idx]
+        for f in new_fpaths:
+            self.fpath_idx[f] = len(self.fpaths)
+            self.fpaths.append(f)
+        if new_fpaths or (require_lung_mask and not self.require_lung_mask):
+            self.packed = None  # arrays need to be (re-)built, datasets built before keep the old ones
+        self.require_lung_mask = self.require_lung_mask or require_lung_mask
+
+    def load(self) -> dict:
+        if self.packed is None:
+            print(f'loading {len(self.fpaths)} slices to the shared registry ...')
+            self.packed = load_packed_slices(self.fpaths, self.require_lung_mask, self.cache_dir, self.load_workers,
+                                             self.load_mode)
+        return self.packed
+
+    def index(self, fpaths) -> np.ndarray:
+        return np.array([self.fpath_idx[f] for f in fpaths], dtype=np.int64)
+
+
 class LoaderInit(ABC):
     """Abstract class for `LoadScore`, `LoadPos` and `LoadPos2Score`. Methods of and `load`, `xformd` and `load_per_xy`,
     need to be implemented for the three class. The reason is:
@@ -58,8 +105,8 @@ class LoaderInit(ABC):
         self.resample_z = resample_z
         self.mypath = mypath
         self.label_file = label_file
-        df_excel = pd.read_excel(self.label_file, engine='openpyxl')
-        self.df_excel = df_excel.set_index('PatID')
+        self.label_store = GohLabelStore(self.label_file)  # parse the excel file once, cached next to it
+        self.df_excel = self.label_store.df  # index: PatID
 
         self.kfold_seed = kfold_seed
         self.fold = fold
@@ -122,10 +169,7 @@ class LoaderInit(ABC):
         if len(dir_pats) == 0:  # does not find patients in this directory
             dir_pats = sorted(glob.glob(os.path.join(self.mypath.dataset_dir(self.resample_z), "Pat_*CTimage*.mha")))
 
-        label_excel = pd.read_excel(self.label_file, engine='openpyxl')
-        # 3 labels for one level
-        pats_id_in_excel = pd.DataFrame(label_excel, columns=['PatID']).values
-        pats_id_in_excel = [i[0] for i in pats_id_in_excel]
+        pats_id_in_excel = list(self.label_store.pat_ids)
         print(f"len(dir): {len(dir_pats)}, len(pats_in_excel): {len(pats_id_in_excel)} ")
         print("======================")
         assert len(dir_pats) == len(pats_id_in_excel)
@@ -186,11 +230,7 @@ class LoaderInit(ABC):
             # if len(dir_pats) == 0:
             #     dir_pats = sorted(glob.glob(os.path.join(self.mypath.dataset_dir, "Pat_*", "CTimage.mha")))
 
-        label_excel = pd.read_excel(self.label_file, engine='openpyxl')
-
-        # 3 labels for one level
-        pats_id_in_excel = pd.DataFrame(label_excel, columns=['PatID']).values
-        pats_id_in_excel = [i[0] for i in pats_id_in_excel]
+        pats_id_in_excel = list(self.label_store.pat_ids)
         print(f"len(dir): {len(dir_pats)}, len(pats_in_excel): {len(pats_id_in_excel)} ")
         print("======================")
         assert len(dir_pats) == len(pats_id_in_excel)
@@ -247,25 +287,38 @@ class LoaderInit(ABC):
 
 
 class LoadPos(LoaderInit):
-    """ LoadData for Position prediction."""
+    """ LoadData for Position prediction.
+
+    If `volume_cache`, all scans are loaded once to a shared :class:`ssc_scoring.mymodules.volume_cache.VolumeCache`
+    which is read by all datasets and their workers, instead of one `CacheDataset` per dataset. Otherwise, if
+    `raw_volume`, the scans are converted once to uncompressed copies (see :mod:`ssc_scoring.mymodules.raw_volume`)
+    from which each sample only reads its cropped patch.
+    """
     def __init__(self, resample_z, mypath, label_file, kfold_seed, fold, total_folds, ts_level_nb, level_node,
-                 train_on_level, z_size, y_size, x_size, batch_size, workers):
+                 train_on_level, z_size, y_size, x_size, batch_size, workers, volume_cache: bool = False,
+                 raw_volume: bool = False):
         super().__init__(resample_z, mypath, label_file, kfold_seed, fold, total_folds, ts_level_nb, level_node,
                  train_on_level, z_size, y_size, x_size, batch_size, workers)
+        self.volume_cache = volume_cache
+        self.raw_volume = raw_volume and not volume_cache
+        self.cache = None  # VolumeCache, built in `load`
 
     def load_per_xy(self, dir_pat: str) -> Tuple[str, np.ndarray]:
         data_name = dir_pat
         idx = int(dir_pat.split('Pat_')[-1][:3])
-        data_label = []
-        for level in [1, 2, 3, 4, 5]:
-            y = self.df_excel.at[idx, 'L' + str(level) + '_pos']
-            data_label.append(y)
-        return data_name, np.array(data_label)
+        data_label = self.label_store.positions([idx])[0]  # positions of 5 levels
+        return data_name, data_label
 
     def xformd(self, mode):
         return xformd_pos(mode, level_node=self.level_node,
                    train_on_level=self.train_on_level,
-                   z_size=self.z_size, y_size = self.y_size, x_size=self.x_size)
+                   z_size=self.z_size, y_size = self.y_size, x_size=self.x_size, volume_cache=self.cache,
+                   raw_volume=self.raw_volume)
+
+    def dataset(self, data, mode):
+        if self.cache is not None or self.raw_volume:  # transforms crop views of cached or memory-mapped scans
+            return monai.data.Dataset(data=data, transform=self.xformd(mode))
+        return monai.data.CacheDataset(data=data, transform=self.xformd(mode), num_workers=1, cache_rate=1)
 
     def load(self, nb=None):
 
@@ -280,10 +333,14 @@ class LoadPos(LoaderInit):
         tr_data = [{'fpath_key': x, 'world_key': y} for x, y in zip(tr_x, tr_y)]
         vd_data = [{'fpath_key': x, 'world_key': y} for x, y in zip(vd_x, vd_y)]
         ts_data = [{'fpath_key': x, 'world_key': y} for x, y in zip(ts_x, ts_y)]
-        tr_dataset = monai.data.CacheDataset(data=tr_data, transform=self.xformd('train'), num_workers=1, cache_rate=1)
-        vdaug_dataset = monai.data.CacheDataset(data=vd_data, transform=self.xformd('train'), num_workers=1, cache_rate=1)
-        vd_dataset = monai.data.CacheDataset(data=vd_data, transform=self.xformd('valid'), num_workers=1, cache_rate=1)
-        ts_dataset = monai.data.CacheDataset(data=ts_data, transform=self.xformd('valid'), num_workers=1, cache_rate=1)
+        if self.volume_cache and self.cache is None:
+            self.cache = VolumeCache([*tr_x, *vd_x, *ts_x], workers=self.workers)
+        if self.raw_volume:
+            convert_all_to_raw([*tr_x, *vd_x, *ts_x], workers=self.workers)
+        tr_dataset = self.dataset(tr_data, 'train')
+        vdaug_dataset = self.dataset(vd_data, 'train')
+        vd_dataset = self.dataset(vd_data, 'valid')
+        ts_dataset = self.dataset(ts_data, 'valid')
         # self.workers = 0
         train_dataloader = DataLoader(tr_dataset, batch_size=self.batch_size, shuffle=True, num_workers=self.workers,
                                       pin_memory=False, persistent_workers=True)
@@ -343,6 +400,31 @@ class LoadScore(LoaderInit):
         self.nb_img = nb_img
         self.masked_by_lung = args.masked_by_lung
         self.require_lung_mask = require_lung_mask
+        self.cache_dir = self.mypath.slice_cache_dir() if args.slice_cache else None
+        self.registry = SliceRegistry(self.cache_dir, args.load_workers, args.load_mode)
+        self.pat_index = None  # index of 2D slices of all patients, see `_load_pat_index`
+
+    def load_data_of_pats(self, dir_pats: Union[List, np.ndarray]) -> Tuple[list, list]:
+        """Slices and labels of all patients. The labels of the whole cohort are taken by one array indexing."""
+        if len(dir_pats) == 0:
+            return [], []
+        self._load_pat_index(os.path.dirname(dir_pats[0]))
+        x = []
+        for dir_pat in dir_pats:
+            for level in [1, 2, 3, 4, 5]:
+                x.extend(self._slices_of_a_level(dir_pat, level))
+
+        pat_ids = [self._pat_id(dir_pat) for dir_pat in dir_pats]
+        scores = self.label_store.scores(pat_ids)  # shape: (nb_pats, 5 levels, 3 scores)
+        y = np.repeat(scores.reshape(-1, 3), 3, axis=0)  # 3 neighboring slices share the scores of one level
+        assert len(x) == len(y)
+        return x, list(y)
+
+    def _load_pat_index(self, data_dir: str) -> None:
+        """One index of all 2D slices instead of globbing each level of each patient, loaded (and rebuilt if stale)
+        only once per data directory."""
+        if self.pat_index is None or self.pat_index['data_dir'] != os.path.abspath(data_dir):
+            self.pat_index = load_pat_index(data_dir)
 
     def load_per_xy(self, dir_pat: str) -> Tuple[List, List]:
         """
@@ -350,45 +432,22 @@ class LoadScore(LoaderInit):
         :param dir_pat:
         :return:
         """
-        x, y = [], []
-        for level in [1, 2, 3, 4, 5]:
-            x_level, y_level = self._load_data_of_a_level(dir_pat, level)
-            x.extend(x_level)
-            y.extend(y_level)
-        return x, y
-
-    def _load_data_of_a_level(self, dir_pat, level):
-        df_excel = self.df_excel
-        file_prefix = "Level" + str(level)
-        # 3 neighboring slices for one level
-        # print(dir_pat)
-        if self.masked_by_lung:
-            x_up = glob.glob(os.path.join(dir_pat, file_prefix + "_up_MaskedByLung.mha"))[0]
-            x_middle = glob.glob(os.path.join(dir_pat, file_prefix + "_middle_MaskedByLung.mha"))[0]
-            x_down = glob.glob(os.path.join(dir_pat, file_prefix + "_down_MaskedByLung.mha"))[0]
-        else:
-            x_up = glob.glob(os.path.join(dir_pat, file_prefix + "_up.mha"))[0]
-            x_middle = glob.glob(os.path.join(dir_pat, file_prefix + "_middle.mha"))[0]
-            x_down = glob.glob(os.path.join(dir_pat, file_prefix + "_down.mha"))[0]
-        x = [x_up, x_middle, x_down]
+        return self.load_data_of_pats([dir_pat])
 
-        excel = df_excel
-        idx = int(dir_pat.split('/')[-1].split('Pat_')[-1])
-
-        y_disext = excel.at[idx, 'L' + str(level) + '_disext']
-        y_gg = excel.at[idx, 'L' + str(level) + '_gg']
-        y_retp = excel.at[idx, 'L' + str(level) + '_retp']
-
-        y_disext = [y_disext, y_disext, y_disext]
-        y_gg = [y_gg, y_gg, y_gg]
-        y_retp = [y_retp, y_retp, y_retp]
-
-        y = [np.array([a_, b_, c_]) for a_, b_, c_ in zip(y_disext, y_gg, y_retp)]
+    @staticmethod
+    def _pat_id(dir_pat: str) -> int:
+        return int(dir_pat.split('/')[-1].split('Pat_')[-1])
 
+    def _slices_of_a_level(self, dir_pat: str, level: int) -> List[str]:
+        suffix = "_MaskedByLung" if self.masked_by_lung else ""
+        # 3 neighboring slices for one level
+        try:
+            level_files = self.pat_index['pats'][os.path.basename(dir_pat)]['levels'][str(level)]
+            x = [level_files[pos + suffix] for pos in ['up', 'middle', 'down']]
+        except KeyError as err:
+            raise FileNotFoundError(f"can not find Level{level} slice {err} of {dir_pat} in the patient index")
         assert os.path.dirname(x[0]) == os.path.dirname(x[1]) == os.path.dirname(x[2])
-        assert len(x) == len(y)
-
-        return x, y
+        return x
 
     def xformd(self, *arg, **karg):
         return xformd_score(*arg, **karg)
@@ -420,7 +479,7 @@ class LoadScore(LoaderInit):
             all_y = [*tr_y, *vd_y, *ts_y]
             all_dataset = SynDataset(all_x, all_y, transform=self.xformd("valid", synthesis=self.sys, args=self.args,
                                                                          require_lung_mask=self.require_lung_mask, tr_x=tr_x),
-                                     synthesis=False)
+                                     synthesis=False, registry=self.registry)
             all_loader = DataLoader(all_dataset, batch_size=self.batch_size, shuffle=False, num_workers=self.workers,
                                          pin_memory=True)
             return all_loader
@@ -432,10 +491,21 @@ class LoadScore(LoaderInit):
                 sampler, self.args.sys_pro_in_0 = sampler_by_disext(tr_y, self.sys_ratio)
             else:
                 sampler = sampler_by_disext(tr_y)
+        # register all slices first, so that the shared registry decodes them in one pass
+        if 'train' in onlyreturn:
+            self.registry.register(tr_x, self.sys or self.require_lung_mask)
+        if 'valid_aug' in onlyreturn:
+            self.registry.register(vd_x, self.sys or self.require_lung_mask)
+        if 'valid' in onlyreturn:
+            self.registry.register(vd_x, self.require_lung_mask)
+        if 'test' in onlyreturn:
+            self.registry.register(ts_x, self.require_lung_mask)
+
         out = []
         if 'train' in onlyreturn:
             tr_dataset = SynDataset(tr_x, tr_y, transform=self.xformd("train", synthesis=self.sys, args=self.args, tr_x=tr_x),
-                                    synthesis=self.sys, require_lung_mask=self.require_lung_mask)
+                                    synthesis=self.sys, require_lung_mask=self.require_lung_mask,
+                                    registry=self.registry)
             print(f'sampler is {sampler}')
             tr_shuffle = True if sampler is None else False
             train_dataloader = DataLoader(tr_dataset, batch_size=self.batch_size, shuffle=tr_shuffle, num_workers=self.workers,
@@ -443,20 +513,23 @@ class LoadScore(LoaderInit):
             out.append(train_dataloader)
         if 'valid_aug' in onlyreturn:
             vd_data_aug = SynDataset(vd_x, vd_y, transform=self.xformd("validaug", synthesis=self.sys, args=self.args, tr_x=tr_x),
-                                    synthesis=self.sys, require_lung_mask=self.require_lung_mask)
+                                    synthesis=self.sys, require_lung_mask=self.require_lung_mask,
+                                    registry=self.registry)
             validaug_dataloader = DataLoader(vd_data_aug, batch_size=self.batch_size, shuffle=False, num_workers=self.workers,
                                     pin_memory=True)
             out.append(validaug_dataloader)
         if 'valid' in onlyreturn:
             vd_dataset = SynDataset(vd_x, vd_y, transform=self.xformd("valid", synthesis=False, args=self.args, tr_x=tr_x),
-                                    synthesis=False, require_lung_mask=self.require_lung_mask)  # valid original data, without synthetic images
+                                    synthesis=False, require_lung_mask=self.require_lung_mask,
+                                    registry=self.registry)  # valid original data, without synthetic images
             valid_dataloader = DataLoader(vd_dataset, batch_size=self.batch_size, shuffle=False, num_workers=self.workers,
                                         pin_memory=True)
             out.append(valid_dataloader)
         if 'test' in onlyreturn:
                                         
             ts_dataset = SynDataset(ts_x, ts_y, transform=self.xformd("test", synthesis=False, args=self.args, tr_x=tr_x),
-                                    synthesis=False, require_lung_mask=self.require_lung_mask)  # test original data, without synthetic images
+                                    synthesis=False, require_lung_mask=self.require_lung_mask,
+                                    registry=self.registry)  # test original data, without synthetic images
             test_dataloader = DataLoader(ts_dataset, batch_size=self.batch_size, shuffle=False, num_workers=self.workers,
                                         pin_memory=True)
             out.append(test_dataloader)
@@ -475,11 +548,8 @@ class LoadPos2Score(LoaderInit):
     def load_per_xy(self, dir_pat: str) -> Tuple[str, np.ndarray]:
         data_name = dir_pat
         idx = int(dir_pat.split('Pat_')[-1][:3])
-        data_label = []
-        for level in [1, 2, 3, 4, 5]:
-            y = self.df_excel.at[idx, 'L' + str(level) + '_pos']
-            data_label.append(y)
-        return data_name, np.array(data_label)
+        data_label = self.label_store.positions([idx])[0]  # positions of 5 levels
+        return data_name, data_label
 
     def xformd(self, mode):
         return xformd_pos2score(mode, self.mypath)
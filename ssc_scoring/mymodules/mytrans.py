@@ -4,20 +4,54 @@
 # @Email   : jiajingnan2222@gmail.com
 import os
 import random
-from typing import Dict, Optional, Union, Hashable, Sequence
+from typing import Dict, Optional, Union, Hashable, Sequence, Tuple
 
 from medutils.medutils import load_itk
 
 import numpy as np
 import pandas as pd
 import torch
+import torch.nn.functional as F
 from monai.transforms import RandGaussianNoise, Transform, RandomizableTransform, ThreadUnsafe
 from torchvision.transforms import RandomHorizontalFlip, RandomVerticalFlip, CenterCrop, RandomAffine
 
+from ssc_scoring.mymodules.intensity import clip_cast, standardize
+from ssc_scoring.mymodules.raw_volume import load_raw_volume
+
 TransInOut = Dict[Hashable, Optional[Union[np.ndarray, torch.Tensor, str, int]]]
 # Note: all transforms here must inheritage Transform, Transform, or RandomTransform.
 
 
+def load_volume(fpath: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Load a 3D image truncated to [-1500, 1500] in its original dtype, with its origin and spacing.
+
+    Returns:
+        image (shape order: z, y, x), origin and spacing (float32, shape order: z, y, x)
+
+    """
+    x, ori, sp = load_itk(fpath, require_ori_sp=True)
+    np.clip(x, -1500, 1500, out=x)
+    return x, np.array(ori).astype(np.float32), np.array(sp).astype(np.float32)
+
+
+def pos_data_dict(fpath: str, world_key, x: np.ndarray, ori: np.ndarray, sp: np.ndarray) -> TransInOut:
+    """Build the data dict of :class:`LoadDatad` from a loaded image and the world positions of the levels."""
+    world_pos = np.array(world_key).astype(np.float32)
+    y = ((world_pos - ori[0]) / sp[0]).astype(int)
+    data_y_np = y.astype(np.float32)
+
+    data = {'image_key': x,  # original image
+            'label_in_img_key': data_y_np,  # label in  the whole image, keep fixed, a np.array with shape(-1, )
+            'label_in_patch_key': data_y_np,  # relative label (slice number) in  a patch, np.array with shape(-1, )
+            'ori_label_in_img_key': data_y_np,  # label in  the whole image, keep fixed, a np.array with shape(-1, )
+            'world_key': world_pos,  # world position in mm, keep fixed,  a np.array with shape(-1, )
+            'ori_world_key': world_pos,  # world position in mm, keep fixed,  a np.array with shape(-1, )
+            'space_key': sp,  # space,  a np.array with shape(-1, )
+            'origin_key': ori,  # origin,  a np.array with shape(-1, )
+            'fpath_key': fpath}  # full path, a array of string
+    return data
+
+
 class LoadDatad(Transform):
     """Load data. The output image values range from -1500 to 1500.
 
@@ -34,34 +68,47 @@ class LoadDatad(Transform):
     """
 
     def __call__(self, data: TransInOut) -> TransInOut:
-        fpath = data['fpath_key']
-        world_pos = np.array(data['world_key']).astype(np.float32)
-        data_x = load_itk(fpath, require_ori_sp=True)
-        # print('load a image')
-        x = data_x[0]  # shape order: z, y, x
-        # print("cliping ... ")
-        x[x < -1500] = -1500
-        x[x > 1500] = 1500
-        # x = self.normalize0to1(x)
-        # scale data to 0~1, it's convinent for future transform (add noise) during dataloader
-        ori = np.array(data_x[1]).astype(np.float32)  # shape order: z, y, x
-        sp = np.array(data_x[2]).astype(np.float32)  # shape order: z, y, x
-        y = ((world_pos - ori[0]) / sp[0]).astype(int)
-
-        data_x_np = x.astype(np.float32)
-        data_y_np = y.astype(np.float32)
-
-        data = {'image_key': data_x_np,  # original image
-                'label_in_img_key': data_y_np,  # label in  the whole image, keep fixed, a np.array with shape(-1, )
-                'label_in_patch_key': data_y_np,  # relative label (slice number) in  a patch, np.array with shape(-1, )
-                'ori_label_in_img_key': data_y_np,  # label in  the whole image, keep fixed, a np.array with shape(-1, )
-                'world_key': world_pos,  # world position in mm, keep fixed,  a np.array with shape(-1, )
-                'ori_world_key': world_pos,  # world position in mm, keep fixed,  a np.array with shape(-1, )
-                'space_key': sp,  # space,  a np.array with shape(-1, )
-                'origin_key': ori,  # origin,  a np.array with shape(-1, )
-                'fpath_key': fpath}  # full path, a array of string
+        x, ori, sp = load_itk(data['fpath_key'], require_ori_sp=True)
+        x = clip_cast(x, -1500, 1500, np.float32)  # one pass, no boolean masks and no extra copy
+        ori, sp = np.array(ori).astype(np.float32), np.array(sp).astype(np.float32)  # shape order: z, y, x
+        return pos_data_dict(data['fpath_key'], data['world_key'], x, ori, sp)
 
-        return data
+
+class CachedLoadDatad(Transform):
+    """Same as :class:`LoadDatad`, but the image is a view of the volume in a shared
+    :class:`ssc_scoring.mymodules.volume_cache.VolumeCache` instead of being loaded from disk.
+
+    The image keeps the dtype of the cache (int16 for integer CT scans), so it needs to be cropped by :func:`cropd` or
+    :class:`RandCropLevelRegiond` which return float32 patches. The view must not be modified in place.
+
+    Examples:
+        :func:`ssc_scoring.mymodules.composed_trans.xformd_pos`
+
+    """
+
+    def __init__(self, volume_cache):
+        self.volume_cache = volume_cache
+
+    def __call__(self, data: TransInOut) -> TransInOut:
+        x, ori, sp = self.volume_cache.get(data['fpath_key'])
+        return pos_data_dict(data['fpath_key'], data['world_key'], x, ori.copy(), sp.copy())
+
+
+class RawLoadDatad(Transform):
+    """Same as :class:`LoadDatad`, but the image is memory-mapped from its uncompressed copy (see
+    :mod:`ssc_scoring.mymodules.raw_volume`), so the following crop transform only reads the bytes of its patch.
+
+    The image is read-only and keeps the dtype of the copy (int16 for integer CT scans), so it needs to be cropped by
+    :func:`cropd` or :class:`RandCropLevelRegiond` which return float32 patches.
+
+    Examples:
+        :func:`ssc_scoring.mymodules.composed_trans.xformd_pos`
+
+    """
+
+    def __call__(self, data: TransInOut) -> TransInOut:
+        x, ori, sp = load_raw_volume(data['fpath_key'])
+        return pos_data_dict(data['fpath_key'], data['world_key'], x, ori, sp)
 
 
 class AddChanneld(Transform):
@@ -75,20 +122,22 @@ class AddChanneld(Transform):
 
 
 class NormImgPosd(Transform):
-    """Normalize image to standard Normalization distribution"""
+    """Normalize image to standard Normalization distribution.
+
+    Mean and std are computed in one pass. The image is normalized in place if it owns its memory (e.g. a patch copied
+    by a crop), otherwise (e.g. a view of a cached image) a new array is returned and the input is not modified.
+    """
     def __init__(self, key='image_key'):
         self.key = key
 
     def __call__(self, data: TransInOut) -> TransInOut:
         d = data
-
-        if isinstance(d[self.key], torch.Tensor):
-            mean, std = torch.mean(d[self.key]), torch.std(d[self.key])
+        x = d[self.key]
+        if isinstance(x, torch.Tensor):
+            d[self.key] = standardize(x, inplace=False, unbiased=True)
         else:
-            mean, std = np.mean(d[self.key]), np.std(d[self.key])
-
-        d[self.key] = d[self.key] - mean
-        d[self.key] = d[self.key] / std
+            inplace = x.flags.owndata and x.flags.writeable and np.issubdtype(x.dtype, np.floating)
+            d[self.key] = standardize(x, inplace=inplace)
         # print('end norm')
 
         return d
@@ -119,8 +168,8 @@ def cropd(d: TransInOut, start: Sequence[int], z_size: int, y_size: int, x_size:
     :param x_size: sub-image size along x
     :return: data dict, including cropped sub-image, along with updated `label_in_patch_key`
     """
-    d[key] = d[key][start[0]:start[0] + z_size, start[1]:start[1] + y_size,
-             start[2]:start[2] + x_size]
+    d[key] = np.asarray(d[key][start[0]:start[0] + z_size, start[1]:start[1] + y_size,
+                        start[2]:start[2] + x_size], dtype=np.float32)  # no copy if it is float32 already
     d['label_in_patch_key'] = d['label_in_img_key'] - start[0]  # image is shifted up, and relative position down
     d['label_in_patch_key'][d['label_in_patch_key'] < 0] = 0  # position outside the edge would be set as edge
     d['label_in_patch_key'][d['label_in_patch_key'] > z_size] = z_size  # position outside the edge would be set as edge
@@ -220,7 +269,7 @@ class RandCropLevelRegiond(RandomizableTransform):
         self.train_on_level = train_on_level
         self.height = height
         self.rand_start = rand_start
-        self.start = int(start)
+        self.start = None if start is None else int(start)
         self.key = key
         super().__init__()
 
@@ -236,7 +285,7 @@ class RandCropLevelRegiond(RandomizableTransform):
             level = random.randint(1, 5)  # 1,2,3,4,5 level is randomly selected
 
         d['label_in_img_key'] = np.array(d['ori_label_in_img_key'][level - 1]).reshape(-1, )
-        label: int = d['label_in_img_key']  # z slice number
+        label: int = int(d['label_in_img_key'][0])  # z slice number
         lower: int = max(0, label - self.height)
         if self.rand_start:
             start = random.randint(lower, label)  # between lower and label
@@ -255,11 +304,73 @@ class RandCropLevelRegiond(RandomizableTransform):
             end = d[self.key].shape[0]
             start = end - self.height
         d[self.key] = d[self.key][start: end].astype(np.float32)
-        d['label_in_patch_key'] = d['label_in_img_key'] - self.start
+        d['label_in_patch_key'] = d['label_in_img_key'] - start
 
         return d
 
 
+def pat_id_of(fpath: str) -> str:
+    """Patient id (3 digits after 'Pat_') of an image path, like '012' for '.../Pat_012_CTimage.mha'."""
+    return fpath.split('Pat_')[-1][:3]
+
+
+class CorsePosTable:
+    """Coarse (1st stage) predictions of all images, indexed by patient id.
+
+    The csv files are read once, then the prediction of one image is found by one dict lookup.
+
+    Args:
+        data_fpath: Csv file of image paths and world positions, like `valid_data.csv`, with or without header.
+        pred_world_fpath: Csv file of predicted world positions with header 'L1', ..., 'L5', like
+            `valid_pred_world.csv`. Its rows are in the same order as `data_fpath`.
+
+    Examples:
+        :func:`get_corse_table`
+
+    """
+
+    def __init__(self, data_fpath: str, pred_world_fpath: str):
+        self.data_fpath = data_fpath
+        self.pred_world_fpath = pred_world_fpath
+        df_pred_world = pd.read_csv(pred_world_fpath, delimiter=',')
+        df_data = pd.read_csv(data_fpath, header=None, delimiter=',')
+        if len(df_data) and df_data.iloc[0, 0] == 'img_fpath':  # data file with header
+            df_data = df_data.iloc[1:]
+        if len(df_pred_world) != len(df_data):
+            raise Exception(f"the length of data: {len(df_data)} and pred_world: {len(df_pred_world)} is not the same")
+
+        self.img_fpaths = list(df_data.iloc[:, 0])
+        self.preds = df_pred_world.to_numpy()  # shape (nb_images, 5)
+        self.row_of_pat: Dict[str, int] = {}
+        for row, img_fpath in enumerate(self.img_fpaths):
+            self.row_of_pat.setdefault(pat_id_of(img_fpath), row)  # the first image of one patient is used
+
+    def __len__(self):
+        return len(self.img_fpaths)
+
+    def row(self, image_fpath: str) -> int:
+        try:
+            return self.row_of_pat[pat_id_of(image_fpath)]
+        except KeyError:
+            raise Exception(f"Can not find the image id of {image_fpath} from data file {self.data_fpath}")
+
+    def pred(self, image_fpath: str) -> np.ndarray:
+        return self.preds[self.row(image_fpath)]
+
+
+_corse_tables: Dict[Tuple, Tuple[Tuple, CorsePosTable]] = {}  # (data, pred_world) -> (mtimes, table)
+
+
+def get_corse_table(data_fpath: str, pred_world_fpath: str) -> CorsePosTable:
+    """:class:`CorsePosTable` of the 2 files, shared by all transforms of this process (and of the DataLoader workers
+    forked after it is built). It is built again, and replaces the old one, if one of the files is modified."""
+    fpaths = (os.path.abspath(data_fpath), os.path.abspath(pred_world_fpath))
+    mtimes = tuple(os.stat(f).st_mtime_ns for f in fpaths)
+    if fpaths not in _corse_tables or _corse_tables[fpaths][0] != mtimes:
+        _corse_tables[fpaths] = (mtimes, CorsePosTable(data_fpath, pred_world_fpath))
+    return _corse_tables[fpaths][1]
+
+
 class CropCorseRegiond(RandomizableTransform):
     """
     Only keep the label of the current level: label_in_img.shape=(1,), label_in_patch.shape=(1,)
@@ -289,28 +400,13 @@ class CropCorseRegiond(RandomizableTransform):
         self.start = start
         self.data_fpath = data_fpath
         self.pred_world_fpath = pred_world_fpath
-        self.df_data = pd.read_csv(self.data_fpath, delimiter=',')
-        self.df_pred_world = pd.read_csv(self.pred_world_fpath, delimiter=',')
-        if len(self.df_pred_world) == (len(self.df_data) + 1):  # df_data should not have header
-            self.df_data = pd.read_csv(self.data_fpath, header=None, delimiter=',')
-            self.df_data.columns = ['img_fpath', 'world_pos']
-        elif len(self.df_pred_world) == len(self.df_data):
-            pass
-        else:
-            raise Exception(
-                f"the length of data: {len(self.df_data)} and pred_world: {len(self.df_pred_world)} is not the same")
+        self.corse_table = get_corse_table(self.data_fpath, self.pred_world_fpath)
 
     def get_img_idx(self, image_fpath: str) -> int:
-        id_str = image_fpath.split("Pat_")[-1].split("_")[0]  # like: Pat_012
-        for i in range(len(self.df_data)):
-            if id_str in self.df_data['img_fpath'].iloc[i]:
-                return i
-        raise Exception(f"Can not find the image id from data file")
+        return self.corse_table.row(image_fpath)
 
     def corse_pred(self, image_fpath):
-        img_idx = self.get_img_idx(image_fpath)
-        level_pred = self.df_pred_world.iloc[img_idx].to_numpy()
-        return level_pred
+        return self.corse_table.pred(image_fpath)
 
     def update_label(self, d):
         corse_pred: int = self.corse_pred(d['fpath_key'])  # get corse predictions for this data
@@ -501,6 +597,81 @@ class RandomVerticalFlipd(RandomizableTransform):
         return d
 
 
+class BatchRandomAffine:
+    """Random affine transform of a whole batch, used after collation instead of :class:`RandomAffined`.
+
+    One random rotation, translation and scale is drawn per sample as `torchvision.transforms.RandomAffine` does, the
+    per-sample matrices are stacked to one (B, 2, 3) tensor and the batch is resampled by one `affine_grid` and one
+    `grid_sample` call on the device of the batch.
+
+    Args:
+        degrees: Rotation range (-degrees, degrees).
+        translate: Maximum fractions of the width and height for the translation.
+        scale: Range of the scale factor.
+        interpolation: 'nearest' (same as the default of `RandomAffine`) or 'bilinear'.
+
+    Examples:
+        :func:`ssc_scoring.mymodules.composed_trans.batch_xformd_score`
+
+    """
+
+    def __init__(self, degrees: float, translate: Sequence[float], scale: Sequence[float],
+                 interpolation: str = 'nearest'):
+        self.degrees = degrees
+        self.translate = translate
+        self.scale = scale
+        self.interpolation = interpolation
+
+    def theta(self, batch_size: int, height: int, width: int, device=None) -> torch.Tensor:
+        """Affine matrices (B, 2, 3) which map output grid to input grid, in normalized coordinates."""
+        def uniform(low, high):
+            return torch.rand(batch_size, device=device) * (high - low) + low
+
+        angle = torch.deg2rad(uniform(-self.degrees, self.degrees))
+        tx = uniform(-self.translate[0] * width, self.translate[0] * width)  # pixels
+        ty = uniform(-self.translate[1] * height, self.translate[1] * height)
+        s = uniform(self.scale[0], self.scale[1])
+
+        cos, sin = torch.cos(angle) / s, torch.sin(angle) / s  # inverse of rotation and scale
+        theta = torch.empty((batch_size, 2, 3), device=device)
+        theta[:, 0, 0] = cos
+        theta[:, 0, 1] = sin * height / width
+        theta[:, 1, 0] = -sin * width / height
+        theta[:, 1, 1] = cos
+        theta[:, 0, 2] = -(cos * tx + sin * ty) * 2 / width
+        theta[:, 1, 2] = -(-sin * tx + cos * ty) * 2 / height
+        return theta
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        """Transform batch with shape (B, C, H, W)."""
+        b, _, h, w = batch.shape
+        theta = self.theta(b, h, w, device=batch.device)
+        grid = F.affine_grid(theta, list(batch.shape), align_corners=False)
+        out = F.grid_sample(batch.float(), grid, mode=self.interpolation, padding_mode='zeros', align_corners=False)
+        return out.to(batch.dtype)
+
+
+class BatchRandGaussianNoise:
+    """Gaussian noise of a whole batch in one vectorized pass, used after collation instead of
+    :class:`RandGaussianNoised`.
+
+    Same as `monai.transforms.RandGaussianNoise`: each sample gets noise with probability `prob`, and the standard
+    deviation of its noise is drawn from U(0, std).
+
+    """
+
+    def __init__(self, prob: float = 0.1, mean: float = 0.0, std: float = 0.1):
+        self.prob = prob
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        shape = (len(batch),) + (1,) * (batch.ndim - 1)
+        apply = (torch.rand(shape, device=batch.device) < self.prob).to(batch.dtype)
+        std = torch.rand(shape, device=batch.device, dtype=batch.dtype) * self.std
+        return batch + apply * (torch.randn_like(batch) * std + self.mean)
+
+
 class Clip:
     def __init__(self, min, max):
         self.min = min
@@ -550,43 +721,10 @@ class CoresPosd(Transform):
     def __init__(self, corse_fpath, data_fpath):
         self.corse_fpath = corse_fpath  # valid_pred_world.csv
         self.data_fpath = data_fpath  # valid_data.csv
-
+        self.corse_table = get_corse_table(self.data_fpath, self.corse_fpath)  # shared with the DataLoader workers
 
     def __call__(self, data):
-        print('start corse pos extration ...')
-        df_corse_pos = pd.read_csv(self.corse_fpath, delimiter=',')
-        df_data = pd.read_csv(self.data_fpath, delimiter=',', header=None)  # no header for dat.csv
-        print(f'len_cores_pred: ', len(df_corse_pos))
-        print(f'len_data: ', len(df_data))
-        if len(df_corse_pos) != len(df_data):
-            print(f'df_corse_pos:{df_corse_pos}')
-            print(f'df_data: {df_data}')
-            raise Exception(f'the lenth of {self.corse_fpath} and {self.data_fpath} IS Not equal.')
-
-        pat_idx = None
-        # print("df_data", df_data)
-        for idx, row in df_data.iterrows():
-            # print(f'idx: ', idx)
-            # print('========')
-            # print(data['fpath_key'].split('Pat_')[-1][:3])
-            # print(row.iloc[0].split('Pat_')[-1][:3])
-            if data['fpath_key'].split('Pat_')[-1][:3] == row.iloc[0].split('Pat_')[-1][:3]:
-                pat_idx = idx
-                break
-        print(f'pat_idx: {pat_idx}')
-
-        corse_pred = df_corse_pos.iloc[pat_idx]
-        # print('type:', type(corse_pred))
-        data['coarse_pred_world_key'] = corse_pred.to_numpy().astype(np.int32)
-        # data['fpath'] = np.array(data['fpath'])
-        # print('corse_pred', data['corse_pred_int_key'])
-        # print('type_pred', type(data['corse_pred_int_key']))
-        print('coarse_pred_world_key:')
-        print(data['coarse_pred_world_key'][0],
-              data['coarse_pred_world_key'][1],
-              data['coarse_pred_world_key'][2],
-              data['coarse_pred_world_key'][3],
-              data['coarse_pred_world_key'][4])
+        data['coarse_pred_world_key'] = self.corse_table.pred(data['fpath_key']).astype(np.int32)
         return data
 
 
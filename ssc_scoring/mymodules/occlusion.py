@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/19/26 1:30 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+from typing import Optional, Tuple, Union
+
+import numpy as np
+import psutil
+import torch
+import torch.nn.functional as F
+
+ArrayType = Union[np.ndarray, torch.Tensor]
+
+
+def occlusion_positions(lung_mask: torch.Tensor, patch_size: int, stride: int) -> torch.Tensor:
+    """Top-left corners (i, j) of all occluded patches which overlap the lung, in row-major order.
+
+    Patches outside the lung do not change the occlusion maps, so they are not predicted. The overlap of each patch is
+    counted from one summed-area table of `lung_mask`.
+
+    Returns:
+        A long tensor with shape (n, 2).
+
+    """
+    h, w = lung_mask.shape
+    sat = F.pad(lung_mask.double().cumsum(0).cumsum(1), (1, 0, 1, 0))  # sat[i, j] = lung_mask[:i, :j].sum()
+    i0 = torch.arange(0, h, stride, device=lung_mask.device)
+    j0 = torch.arange(0, w, stride, device=lung_mask.device)
+    i1, j1 = (i0 + patch_size).clamp(max=h), (j0 + patch_size).clamp(max=w)
+    count = sat[i1][:, j1] - sat[i0][:, j1] - sat[i1][:, j0] + sat[i0][:, j0]
+    ii, jj = torch.nonzero(count > 0, as_tuple=True)
+    return torch.stack([i0[ii], j0[jj]], dim=1)
+
+
+def box_masks(positions: torch.Tensor, patch_size: int, h: int, w: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Rows and columns of the patch at each position, as float tensors with shape (n, h) and (n, w).
+
+    The patch mask of position k is the outer product `rows[k, :, None] * cols[k, None, :]`.
+
+    """
+    rows = torch.arange(h, device=positions.device)[None]
+    cols = torch.arange(w, device=positions.device)[None]
+    i, j = positions[:, :1], positions[:, 1:]
+    return (((rows >= i) & (rows < i + patch_size)).float(),
+            ((cols >= j) & (cols < j + patch_size)).float())
+
+
+def blur5(masks: torch.Tensor) -> torch.Tensor:
+    """Same as `cv2.blur(mask, (5, 5))` (5x5 box filter, border reflected without the edge pixel) for a batch of
+    masks with shape (n, 1, h, w)."""
+    return F.avg_pool2d(F.pad(masks, (2, 2, 2, 2), mode='reflect'), kernel_size=5, stride=1)
+
+
+def occlusion_batch_size(h: int, w: int, device: torch.device, max_batch: int = 256, act_factor: int = 32,
+                         mem_fraction: float = 0.5) -> int:
+    """Number of occluded slices per forward pass which fit in `mem_fraction` of the free memory of `device`.
+
+    One occluded slice is estimated to need `act_factor` times the bytes of one float32 slice, for its masks, the
+    slice itself and the activations of the network.
+
+    """
+    if device.type == 'cuda':
+        free = torch.cuda.mem_get_info(device)[0]
+    else:
+        free = psutil.virtual_memory().available
+    per_slice = h * w * 4 * act_factor
+    return int(max(1, min(max_batch, free * mem_fraction // per_slice)))
+
+
+def occlusion_maps(net: torch.nn.Module, x: ArrayType, occ_patch: ArrayType, lung_mask: ArrayType, patch_size: int,
+                   stride: int, batch_size: int = 0, device: Optional[torch.device] = None
+                   ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Occlusion sensitivity maps of one 2D slice for all outputs of `net`, with batched forward passes.
+
+    For each position (i, j) on a grid with `stride`, the patch `[i: i + patch_size, j: j + patch_size]` inside the
+    lung is blurred by a 5x5 box filter and used to blend `occ_patch` into `x`. The difference between the prediction
+    of the occluded slice and of `x` is added to all pixels of the patch inside the lung, and each map is divided by
+    the number of patches covering each pixel. This is the same map as a loop over all positions with one
+    `cv2.blur` and one forward pass each, but the occluded slices of up to `batch_size` positions are built on
+    `device` and predicted at once, and since each patch is a box, the differences of a batch are added to the maps
+    by one product of its row and column masks instead of one masked addition per position.
+
+    Args:
+        net: Network in eval mode, predicting (n, nb_outputs) from (n, 1, h, w).
+        x: Slice with shape (h, w) or (1, h, w).
+        occ_patch: Occluder with shape (h, w), e.g. a slice filled with healthy patches.
+        lung_mask: Lung mask with shape (h, w) or (1, h, w). Pixels > 0 are in the lung.
+        patch_size: Side length of the occluded patch.
+        stride: Stride between 2 neighboring positions.
+        batch_size: Occluded slices per forward pass. 0 means :func:`occlusion_batch_size`.
+        device: Device of the forward passes. Default is the device of `net`.
+
+    Returns:
+        maps with shape (nb_outputs, h, w), prediction of `x` with shape (nb_outputs, ), positions with shape (n, 2)
+        and predictions of the occluded slices with shape (n, nb_outputs).
+
+    Examples:
+        :func:`ssc_scoring.occlusion_sensitivity.occlusion_map`
+
+    """
+    device = device if device is not None else next(net.parameters()).device
+    x = torch.as_tensor(x, dtype=torch.float32, device=device).reshape(x.shape[-2:])
+    occ = torch.as_tensor(np.asarray(occ_patch), dtype=torch.float32, device=device)
+    lung = (torch.as_tensor(lung_mask, device=device).reshape(x.shape) > 0).float()
+    h, w = x.shape
+    batch_size = batch_size if batch_size > 0 else occlusion_batch_size(h, w, device)
+
+    positions = occlusion_positions(lung, patch_size, stride)
+    sums = None
+    weight = torch.zeros((h, w), dtype=torch.float64, device=device)
+    outs = []
+    with torch.no_grad():
+        out_ori = net(x[None, None]).float()[0]
+        for start in range(0, len(positions), batch_size):
+            rows, cols = box_masks(positions[start: start + batch_size], patch_size, h, w)
+            masks_ori = rows[:, :, None] * cols[:, None, :] * lung  # (n, h, w)
+            masks = blur5(masks_ori[:, None])
+            out = net(x + masks * (occ - x)).float()  # (n, 1, h, w) occluded slices
+            dif = (out - out_ori).double()  # (n, nb_outputs)
+            batch_sums = torch.einsum('nc,nh,nw->chw', dif, rows.double(), cols.double())
+            sums = batch_sums if sums is None else sums + batch_sums
+            weight += rows.double().T @ cols.double()
+            outs.append(out.cpu())
+
+    nb_outputs = len(out_ori)
+    if sums is None:  # no patch in the lung
+        sums = torch.zeros((nb_outputs, h, w), dtype=torch.float64, device=device)
+    lung64 = lung.double()
+    weight = weight * lung64
+    weight[weight == 0] = 1
+    maps = sums * lung64 / weight
+    outs = torch.cat(outs).numpy() if outs else np.zeros((0, nb_outputs), dtype=np.float32)
+    return maps.cpu().numpy(), out_ori.cpu().numpy(), positions.cpu().numpy(), outs
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/19/26 3:20 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+INDEX_FNAME = 'index.json'
+INDEX_VERSION = 1
+CHUNK_ARRAYS = ('maps', 'image', 'lung')
+
+
+def store_dir_of(id_dir: str, mode: str, occ_status: str, patch_size: int, stride: int) -> str:
+    """Directory of the occlusion maps of one model (`id_dir`) for one setting, e.g.
+    `.../models/1903/occlusion_store/valid_healthy_p64_s16`."""
+    return os.path.join(id_dir, 'occlusion_store', f"{mode}_{occ_status}_p{patch_size}_s{stride}")
+
+
+class OcclusionStore:
+    """Occlusion maps of many 2D slices in chunked `.npy` arrays with one `index.json`.
+
+    Each chunk holds the difference maps (float32, shape (n, 3, h, w)), the images (float32, shape (n, h, w)) and the
+    lung masks (uint8, shape (n, h, w)) of up to `chunk_size` slices, in the files `chunk_00000_maps.npy`, ... The
+    index maps the key of each slice, e.g. 'Pat_023/Level1', to its chunk, its row and its meta data (file path,
+    label and prediction of the unoccluded slice). Chunks are written to temporary files and renamed before the index
+    is updated, so the store can be read at any time and an interrupted run loses at most the slices of one chunk.
+
+    The maps are only valid for the model, patch size, stride and occluder of `params`. If the stored index has other
+    `params`, the store is started anew.
+
+    Args:
+        store_dir: Directory of the store, see :func:`store_dir_of`.
+        params: Setting of the maps, e.g. {'net_id': 1903, 'model_mtime_ns': ..., 'patch_size': 64, 'stride': 16,
+            'occ_status': 'healthy'}. None means reading the store with whatever setting it has.
+        chunk_size: Number of slices per chunk.
+
+    Examples:
+        :func:`ssc_scoring.occlusion_cohort.run_cohort` and `heatmap_threshold_explore.py`
+
+    """
+
+    def __init__(self, store_dir: str, params: Optional[Dict] = None, chunk_size: int = 16):
+        self.store_dir = store_dir
+        self.chunk_size = chunk_size
+        self.pending: List[Tuple[str, Dict[str, np.ndarray], Dict]] = []
+        self._chunks: Dict[int, Dict[str, np.ndarray]] = {}
+        self.index = self._load_index()
+        if params is not None and self.index.get('params') != params:
+            self.index = {'version': INDEX_VERSION, 'params': params, 'nb_chunks': 0, 'slices': {}}
+            if os.path.isdir(self.store_dir):  # old chunks are overwritten, readers must not find them in the index
+                self._save_index()
+
+    def _load_index(self) -> Dict:
+        try:
+            with open(os.path.join(self.store_dir, INDEX_FNAME)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {'version': INDEX_VERSION, 'params': None, 'nb_chunks': 0, 'slices': {}}
+        if index.get('version') != INDEX_VERSION:
+            return {'version': INDEX_VERSION, 'params': None, 'nb_chunks': 0, 'slices': {}}
+        return index
+
+    def _chunk_fpath(self, chunk: int, name: str) -> str:
+        return os.path.join(self.store_dir, f"chunk_{chunk:05d}_{name}.npy")
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index['slices'] or any(k == key for k, _, _ in self.pending)
+
+    def __len__(self):
+        return len(self.index['slices'])
+
+    def keys(self) -> List[str]:
+        return sorted(self.index['slices'])
+
+    def add(self, key: str, maps: np.ndarray, image: np.ndarray, lung: np.ndarray, meta: Dict) -> None:
+        """Add the maps (shape (3, h, w)) of one slice. They are written when a chunk is full or at :meth:`flush`."""
+        arrays = {'maps': np.asarray(maps, dtype=np.float32),
+                  'image': np.asarray(image, dtype=np.float32).reshape(maps.shape[-2:]),
+                  'lung': (np.asarray(lung).reshape(maps.shape[-2:]) > 0).astype(np.uint8)}
+        self.pending.append((key, arrays, meta))
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the pending slices as one chunk and update the index."""
+        if not self.pending:
+            return
+        os.makedirs(self.store_dir, exist_ok=True)
+        chunk = self.index['nb_chunks']
+        self._chunks.pop(chunk, None)
+        for name in CHUNK_ARRAYS:
+            fpath = self._chunk_fpath(chunk, name)
+            tmp_fpath = fpath + '.' + str(os.getpid()) + '.tmp'
+            with open(tmp_fpath, 'wb') as f:
+                np.save(f, np.stack([arrays[name] for _, arrays, _ in self.pending]))
+            os.replace(tmp_fpath, fpath)
+        for row, (key, _, meta) in enumerate(self.pending):
+            self.index['slices'][key] = {'chunk': chunk, 'row': row, **meta}
+        self.index['nb_chunks'] = chunk + 1
+        self.pending = []
+        self._save_index()
+
+    def _save_index(self) -> None:
+        fpath = os.path.join(self.store_dir, INDEX_FNAME)
+        tmp_fpath = fpath + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_fpath, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_fpath, fpath)
+
+    def _chunk(self, chunk: int) -> Dict[str, np.ndarray]:
+        if chunk not in self._chunks:
+            self._chunks[chunk] = {name: np.load(self._chunk_fpath(chunk, name), mmap_mode='r')
+                                   for name in CHUNK_ARRAYS}
+        return self._chunks[chunk]
+
+    def get(self, key: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Dict]:
+        """Read-only maps (shape (3, h, w)), image, lung mask and meta data of the slice `key`."""
+        entry = self.index['slices'][key]
+        arrays = self._chunk(entry['chunk'])
+        return arrays['maps'][entry['row']], arrays['image'][entry['row']], arrays['lung'][entry['row']], entry
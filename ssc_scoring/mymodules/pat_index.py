@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 2:15 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+import json
+import os
+import re
+from typing import Dict, Optional
+
+# Level1_up.mha, Level1_up_MaskedByLung.mha, Level1_up_lung_mask.mha, ...
+LEVEL_FILE_PATTERN = re.compile(r'^Level(\d)_(up|middle|down)(.*)\.mha$')
+INDEX_FNAME = 'pat_index.json'
+INDEX_VERSION = 1
+
+
+def scan_pat_dir(pat_dir: str) -> Dict:
+    """Scan the directory of one patient once.
+
+    Args:
+        pat_dir: Directory like `.../Pat_001` with the 2D slices of 5 levels.
+
+    Returns:
+        A dict: {'dir': pat_dir, 'mtime_ns': ..., 'weight_map': fpath or None,
+        'levels': {'1': {'up': fpath, 'up_MaskedByLung': fpath, 'up_lung_mask': fpath, 'middle': ...}, ...}}
+
+    """
+    levels: Dict[str, Dict[str, str]] = {}
+    weight_map = None
+    with os.scandir(pat_dir) as it:
+        for entry in it:
+            if entry.name == 'weight_map.npy':
+                weight_map = entry.path
+                continue
+            match = LEVEL_FILE_PATTERN.match(entry.name)
+            if match:
+                level, pos, variant = match.groups()
+                levels.setdefault(level, {})[pos + variant] = entry.path
+    return {'dir': pat_dir, 'mtime_ns': os.stat(pat_dir).st_mtime_ns, 'weight_map': weight_map, 'levels': levels}
+
+
+def _pat_dirs(data_dir: str) -> Dict[str, os.DirEntry]:
+    with os.scandir(data_dir) as it:
+        return {entry.name: entry for entry in it if entry.name.startswith('Pat_') and entry.is_dir()}
+
+
+def build_pat_index(data_dir: str, old_index: Optional[Dict] = None) -> Dict:
+    """Build the index of all `Pat_*` directories in `data_dir`.
+
+    Patients whose directory has the same modification time as in `old_index` are not scanned again.
+
+    """
+    old_pats = old_index['pats'] if old_index else {}
+    pats = {}
+    for name, entry in sorted(_pat_dirs(data_dir).items()):
+        old_pat = old_pats.get(name)
+        if old_pat is not None and old_pat['mtime_ns'] == entry.stat().st_mtime_ns:
+            pats[name] = old_pat
+        else:
+            pats[name] = scan_pat_dir(entry.path)
+    return {'version': INDEX_VERSION, 'data_dir': os.path.abspath(data_dir), 'pats': pats}
+
+
+def is_stale(index: Dict, data_dir: str) -> bool:
+    """If patients were added/removed in `data_dir` or files were added/removed in one of the patient directories.
+
+    Adding/removing files changes the modification time of the parent directory, so one listing of `data_dir` and
+    one `stat` per patient are enough.
+
+    """
+    if index.get('version') != INDEX_VERSION:
+        return True
+    pat_dirs = _pat_dirs(data_dir)
+    if set(pat_dirs.keys()) != set(index['pats'].keys()):
+        return True
+    return any(entry.stat().st_mtime_ns != index['pats'][name]['mtime_ns'] for name, entry in pat_dirs.items())
+
+
+def load_pat_index(data_dir: str, index_fpath: Optional[str] = None) -> Dict:
+    """Load the patient index of `data_dir` from `index_fpath`, rebuild and save it if it is missing or stale.
+
+    One index replaces the `glob` calls per level and per patient in
+    :meth:`ssc_scoring.mymodules.mydata.LoadScore._slices_of_a_level`.
+
+    Args:
+        data_dir: Directory including `Pat_*` directories.
+        index_fpath: Json file of the index. Default is `pat_index.json` in `data_dir`.
+
+    Returns:
+        The index, see :func:`build_pat_index` and :func:`scan_pat_dir`.
+
+    """
+    index_fpath = index_fpath if index_fpath else os.path.join(data_dir, INDEX_FNAME)
+    index = None
+    if os.path.isfile(index_fpath):
+        try:
+            with open(index_fpath) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+    if index is not None and not is_stale(index, data_dir):
+        return index
+
+    print(f"build patient index of {data_dir}")
+    index = build_pat_index(data_dir, index)
+    try:
+        tmp_fpath = index_fpath + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_fpath, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_fpath, index_fpath)
+    except OSError as err:  # read-only dataset, use the index in memory only
+        print(f"can not save patient index to {index_fpath}: {err}")
+    return index
@@ -7,6 +7,12 @@ import os
 from typing import Union
 from abc import ABC, abstractmethod
 
+# resample_z: shape (z, y, x) of the resampled scans in `PathPos.dataset_dir(resample_z)`, written by resample_dataset.py
+RESAMPLE_SHAPES = {256: (256, 256, 256),
+                   512: (512, 192, 192),
+                   800: (800, 160, 160),
+                   1024: (1024, 256, 256)}
+
 
 class PathInit(ABC):
     """ Set the directory for results. Leave the project name and record file as not implemented.
@@ -129,14 +135,8 @@ class PathPos(Path, PathPosInit):
         """ Dataset directory. Different resample size means different dataset directory."""
         if resample_z == 0:  # use original images
             res_dir: str = 'SSc_DeepLearning'
-        elif resample_z == 256:
-            res_dir = 'LowRes256_256_256'
-        elif resample_z == 512:
-            res_dir = 'LowRes512_192_192'
-        elif resample_z == 800:
-            res_dir = 'LowRes800_160_160'
-        elif resample_z == 1024:
-            res_dir = 'LowRes1024_256_256'
+        elif resample_z in RESAMPLE_SHAPES:
+            res_dir = 'LowRes' + '_'.join(map(str, RESAMPLE_SHAPES[resample_z]))
         else:
             raise Exception("wrong resample_z:" + str(resample_z))
         return os.path.join(self.data_dir, res_dir)
@@ -169,3 +169,7 @@ class PathScore(Path, PathScoreInit):
 
     def data(self, mode: str):
         return os.path.join(self.id_dir, mode + '_data.csv')
+
+    def slice_cache_dir(self) -> str:
+        """ Directory of the preprocessed 2D slices shared by all experiments and folds."""
+        return os.path.join(self.data_dir, 'slice_cache')
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 8:05 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+import csv
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+def npz_fpath_of(csv_fpath: str) -> str:
+    """`.npz` file written next to the prediction csv file `csv_fpath`."""
+    return os.path.splitext(csv_fpath)[0] + '.npz'
+
+
+def npz_is_fresh(csv_fpath: str) -> bool:
+    """Whether the csv file and its `.npz` copy exist and the `.npz` copy is at least as new as the csv file."""
+    npz_fpath = npz_fpath_of(csv_fpath)
+    if not os.path.isfile(npz_fpath) or not os.path.isfile(csv_fpath):  # a deleted csv file is not up to date
+        return False
+    return os.stat(npz_fpath).st_mtime_ns >= os.stat(csv_fpath).st_mtime_ns
+
+
+def read_npz_preds(csv_fpath: str) -> Optional[pd.DataFrame]:
+    """Read the `.npz` copy of `csv_fpath` if it is at least as new as the csv file, otherwise return None.
+
+    A csv file which is appended to after its `.npz` copy was written (e.g. by an old version of the code) is newer
+    than the `.npz` file, so it is read from the csv file again.
+
+    Examples:
+        :func:`ssc_scoring.mymodules.confusion_test.read_check`
+
+    """
+    if not npz_is_fresh(csv_fpath):
+        return None
+    with np.load(npz_fpath_of(csv_fpath)) as npz:
+        return pd.DataFrame(npz['data'], columns=list(npz['head']))
+
+
+class PredWriter:
+    """Buffer the rows of prediction/label csv files in memory and write each file in bulk.
+
+    :func:`medutils.medutils.appendrows_to` opens, appends and closes a csv file for every batch (or every image). This
+    writer keeps the rows of each file in memory and writes them with one open per file in :meth:`flush`, which is
+    called at the end of each mode. The output csv files are the same as before: the head is only written if the file
+    does not exist, a 1D array is one row. A `.npz` copy (arrays `data` and `head`) is written next to each csv file
+    (`valid_pred.csv` -> `valid_pred.npz`), which is read by :func:`ssc_scoring.mymodules.confusion_test.read_check`
+    without parsing text.
+
+    Args:
+        save_npz: Also write the `.npz` copy of each csv file.
+        flush_rows: Flush all files when this number of rows is buffered, to bound the memory. 0 means no limit.
+
+    Examples:
+        :class:`ssc_scoring.mymodules.inference.Evaluater_pos` and
+        :class:`ssc_scoring.mymodules.inference.Evaluater_score`
+
+    """
+
+    def __init__(self, save_npz: bool = True, flush_rows: int = 1000000):
+        self.save_npz = save_npz
+        self.flush_rows = flush_rows
+        self.buffers: Dict[str, List[np.ndarray]] = {}
+        self.heads: Dict[str, Optional[Sequence[str]]] = {}
+        self.nb_rows = 0
+
+    def append(self, fpath: str, data: np.ndarray, head: Optional[Sequence[str]] = None):
+        """Buffer `data` to be appended to `fpath`, with the same arguments as :func:`futil.appendrows_to`."""
+        data = np.asarray(data)
+        if data.ndim == 1:  # one row, like appendrows_to
+            data = data.reshape(1, -1)
+        self.buffers.setdefault(fpath, []).append(data)
+        self.heads.setdefault(fpath, head)
+        self.nb_rows += len(data)
+        if self.flush_rows and self.nb_rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows to their files and empty the buffers."""
+        for fpath, data_ls in self.buffers.items():
+            data = np.concatenate(data_ls, axis=0)
+            head = self.heads[fpath]
+            csv_existed = os.path.isfile(fpath)
+            npz_valid = not csv_existed or npz_is_fresh(fpath)
+            with open(fpath, 'a') as csv_file:
+                writer = csv.writer(csv_file, delimiter=',')
+                if not csv_existed and head is not None:
+                    writer.writerow(head)
+                writer.writerows(data)
+            if self.save_npz:
+                self._write_npz(fpath, data, head, append=csv_existed, npz_valid=npz_valid)
+        self.buffers, self.heads, self.nb_rows = {}, {}, 0
+
+    @staticmethod
+    def _write_npz(fpath: str, data: np.ndarray, head: Optional[Sequence[str]], append: bool, npz_valid: bool):
+        npz_fpath = npz_fpath_of(fpath)
+        if not npz_valid:  # the csv file has rows which are not in the npz file, keep reading the csv file
+            if os.path.isfile(npz_fpath):
+                os.remove(npz_fpath)
+            return
+        if append:
+            with np.load(npz_fpath) as npz:
+                data = np.concatenate([npz['data'], data.astype(npz['data'].dtype)], axis=0)
+                head = list(npz['head'])
+        if head is None:
+            head = [str(i) for i in range(data.shape[1])]
+        tmp_fpath = npz_fpath + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_fpath, 'wb') as f:
+            np.savez(f, data=data, head=np.array(head))
+        os.replace(tmp_fpath, npz_fpath)
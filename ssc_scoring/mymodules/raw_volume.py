@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 10:20 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+import json
+import os
+from typing import Sequence, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from ssc_scoring.mymodules.tool import ordered_map
+
+
+def raw_fpath(fpath: str) -> str:
+    """Uncompressed copy of a 3D scan, e.g. `Pat_001_CTimage_raw.npy` for `Pat_001_CTimage.mha`."""
+    return os.path.splitext(fpath)[0] + '_raw.npy'
+
+
+def raw_meta_fpath(fpath: str) -> str:
+    """Origin, spacing and source modification time of the uncompressed copy of `fpath`."""
+    return os.path.splitext(fpath)[0] + '_raw.json'
+
+
+def is_converted(fpath: str) -> bool:
+    """If the uncompressed copy of `fpath` exists and was written from the current version of `fpath`."""
+    try:
+        with open(raw_meta_fpath(fpath)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get('mtime_ns') == os.stat(fpath).st_mtime_ns and os.path.isfile(raw_fpath(fpath))
+
+
+def convert_to_raw(fpath: str) -> str:
+    """Write the clipped scan `fpath` as an uncompressed `.npy` file (int16 for integer scans, otherwise float32).
+
+    The `.npy` file and its `.json` meta file are written to temporary files and renamed, meta file last, so a
+    half-written copy is never used and several processes can convert the same scan safely.
+
+    Returns:
+        Full path of the `.npy` file.
+
+    """
+    from ssc_scoring.mymodules.mytrans import load_volume  # mytrans imports this module
+    mtime_ns = os.stat(fpath).st_mtime_ns
+    x, ori, sp = load_volume(fpath)
+    dtype = np.int16 if np.issubdtype(x.dtype, np.integer) else np.float32  # values are in [-1500, 1500]
+
+    out_fpath = raw_fpath(fpath)
+    tmp_fpath = out_fpath + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_fpath, 'wb') as f:
+        np.save(f, np.ascontiguousarray(x, dtype=dtype))
+    os.replace(tmp_fpath, out_fpath)
+
+    meta = {'origin': ori.tolist(), 'space': sp.tolist(), 'shape': list(x.shape), 'mtime_ns': mtime_ns}
+    tmp_fpath = raw_meta_fpath(fpath) + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_fpath, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_fpath, raw_meta_fpath(fpath))
+    return out_fpath
+
+
+def convert_all_to_raw(fpaths: Sequence[str], workers: int = 0) -> int:
+    """Convert the scans which have no up-to-date uncompressed copy, with a pool of `workers` processes.
+
+    Returns:
+        Number of converted scans.
+
+    Examples:
+        :meth:`ssc_scoring.mymodules.mydata.LoadPos.load`
+
+    """
+    todo = [fpath for fpath in dict.fromkeys(fpaths) if not is_converted(fpath)]
+    if todo:
+        print(f"convert {len(todo)} scans to uncompressed raw volumes ...")
+        for _ in tqdm(ordered_map(convert_to_raw, todo, workers, mode='process'), total=len(todo)):
+            pass
+    return len(todo)
+
+
+def load_raw_volume(fpath: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Memory-map the uncompressed copy of `fpath`, converting it first if needed.
+
+    Nothing is read from the image until it is indexed. Slicing returns a read-only `np.memmap` view, and only the
+    bytes of the requested z/y/x slab are read when the view is converted to an array, e.g. by
+    :func:`ssc_scoring.mymodules.mytrans.cropd`.
+
+    Returns:
+        Read-only memory-mapped image (shape order: z, y, x), origin and spacing (float32, shape order: z, y, x)
+
+    """
+    if not is_converted(fpath):
+        convert_to_raw(fpath)
+    with open(raw_meta_fpath(fpath)) as f:
+        meta = json.load(f)
+    x = np.load(raw_fpath(fpath), mmap_mode='r')
+    return x, np.array(meta['origin'], dtype=np.float32), np.array(meta['space'], dtype=np.float32)
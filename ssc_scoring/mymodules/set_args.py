@@ -5,11 +5,15 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+from typing import Optional, Sequence
 
 
-def get_args() -> argparse.Namespace:
+def get_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
     """Get arguments/hyper-parameters for the experiment.
 
+    Args:
+        argv: Command line arguments. `sys.argv[1:]` is used if None.
+
     Returns:
         Args instance
 
@@ -60,8 +64,34 @@ def get_args() -> argparse.Namespace:
     parser.add_argument('--retp_blur', help='retp_blur', type=int, default=20)  # must be a float number !
     parser.add_argument('--gg_blur', help='gg_blur', type=int, default=20)  # must be a float number !
     parser.add_argument('--gen_gg_as_retp', help='gen_gg_as_retp', type=int, choices=(1, 0), default=1)
+    parser.add_argument('--slice_cache', choices=(1, 0), help='if cache preprocessed 2D slices on disk', type=int,
+                        default=0)
+    parser.add_argument('--load_workers', help='number of threads/processes to load slices, 0 means sequential',
+                        type=int, default=0)
+    parser.add_argument('--load_mode', choices=('thread', 'process'), help='pool to load slices', type=str,
+                        default='thread')
+    parser.add_argument('--texture_bank_size', help='precomputed retp/gg candidates for synthesis in shared '
+                                                    'memory, 0 means generating them on the fly', type=int,
+                        default=0)
+    parser.add_argument('--texture_refresh', help='seconds between 2 refreshed candidates of the texture bank, '
+                                                  '0 means no refresh', type=float, default=0)
+    parser.add_argument('--batch_aug', choices=(1, 0), help='apply random affine and noise to collated batches on '
+                                                            'device instead of per sample in workers', type=int,
+                        default=0)
+
+    parser.add_argument('--cpu_infer', choices=(1, 0), help='inference on CPU with torch.inference_mode and '
+                                                            'channels_last, used if cuda is not available', type=int,
+                        default=0)
+    parser.add_argument('--cpu_bf16', choices=(1, 0), help='bfloat16 autocast for cpu_infer', type=int, default=1)
+    parser.add_argument('--channels_last', choices=(1, 0), help='channels_last memory format for cpu_infer', type=int,
+                        default=1)
+    parser.add_argument('--infer_threads', help='torch threads for cpu_infer, 0 means the default of the network',
+                        type=int, default=0)
+    parser.add_argument('--validate_cpu_infer', choices=(1, 0), help='also predict in fp32 and log the differences '
+                                                                     'of the metrics of cpu_infer', type=int,
+                        default=0)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if (args.mode != 'train') and (args.eval_id == 0):
         parser.error("Please provide valid eval_id if the mode is: " + args.mode)
@@ -5,9 +5,10 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+from typing import Optional, Sequence
 
 
-def get_args():
+def get_args(argv: Optional[Sequence[str]] = None):
     parser = argparse.ArgumentParser(description="SSc score prediction.")
 
     # Common args with set_args.py
@@ -52,8 +53,27 @@ def get_args():
     parser.add_argument('--y_size', help='length of patch along y axil ', type=int, default=256)
     parser.add_argument('--x_size', help='length of patch along x axil ', type=int, default=256)
     parser.add_argument('--infer_stride', help='infer_stride', type=int, default=4)
+    parser.add_argument('--infer_batch_size', help='number of sliding windows per forward pass during inference, '
+                                                   '0 means batch_size', type=int, default=0)
+    parser.add_argument('--volume_cache', choices=(1, 0), help='keep each 3D scan once in shared memory for all '
+                                                               'datasets and dataloader workers', type=int, default=0)
+    parser.add_argument('--raw_volume', choices=(1, 0), help='read only the cropped patches from uncompressed copies '
+                                                             'of the 3D scans, used if volume_cache is 0', type=int,
+                        default=0)
+
+    parser.add_argument('--cpu_infer', choices=(1, 0), help='inference on CPU with torch.inference_mode and '
+                                                            'channels_last, used if cuda is not available', type=int,
+                        default=0)
+    parser.add_argument('--cpu_bf16', choices=(1, 0), help='bfloat16 autocast for cpu_infer', type=int, default=1)
+    parser.add_argument('--channels_last', choices=(1, 0), help='channels_last memory format for cpu_infer', type=int,
+                        default=1)
+    parser.add_argument('--infer_threads', help='torch threads for cpu_infer, 0 means the default of the network',
+                        type=int, default=0)
+    parser.add_argument('--validate_cpu_infer', choices=(1, 0), help='also predict in fp32 and log the differences '
+                                                                     'of the metrics of cpu_infer', type=int,
+                        default=0)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if args.level_node == 1:
         args.train_on_level = 0  # use data from all levels to train this network
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 9:12 AM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+import functools
+import hashlib
+import os
+import shutil
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from filelock import FileLock
+from medutils.medutils import load_itk
+from tqdm import tqdm
+
+from ssc_scoring.mymodules.intensity import clip_scale
+from ssc_scoring.mymodules.tool import ordered_map
+
+SliceRecord = Dict[str, np.ndarray]
+
+# Intensity normalization applied to all 2D slices before they are fed to transforms.
+NORM_PARAMS: Tuple[float, float, float, float] = (-1500.0, 1500.0, 0.0, 1.0)  # a_min, a_max, b_min, b_max
+
+
+def weight_map_fpath(slice_fpath: str) -> str:
+    """Weight map shared by all slices of one patient."""
+    return os.path.dirname(slice_fpath) + "/weight_map.npy"
+
+
+def lung_mask_fpath(slice_fpath: str) -> str:
+    """Lung mask of a 2D slice, e.g. `Level1_up_lung_mask.mha` for `Level1_up.mha`."""
+    return slice_fpath.split('.mha')[0] + "_lung_mask" + ".mha"
+
+
+def load_slice(fpath: str, require_lung_mask: bool = False,
+               norm_params: Tuple[float, float, float, float] = NORM_PARAMS) -> SliceRecord:
+    """Load one 2D slice and everything :class:`ssc_scoring.mymodules.datasets.SynDataset` needs from disk.
+
+    The slice is truncated to [a_min, a_max], rescaled to [b_min, b_max] and cast to float32.
+
+    Args:
+        fpath: Full path of the 2D slice.
+        require_lung_mask: If the lung mask of the slice is loaded as well.
+        norm_params: (a_min, a_max, b_min, b_max) of `ScaleIntensityRange`.
+
+    Returns:
+        A dict with 'image', 'origin', 'space', 'weight_map' and optionally 'lung_mask'.
+
+    """
+    a_min, a_max, b_min, b_max = norm_params
+    x, ori, sp = load_itk(fpath, require_ori_sp=True)
+    record = {'image': clip_scale(x, a_min, a_max, b_min, b_max, np.float32),
+              'origin': np.array(ori),  # shape order: z, y, x
+              'space': np.array(sp),  # shape order: z, y, x
+              'weight_map': np.load(weight_map_fpath(fpath))}
+    if require_lung_mask:
+        record['lung_mask'] = load_itk(lung_mask_fpath(fpath), require_ori_sp=False)
+    return record
+
+
+class SliceCache:
+    """On-disk cache of preprocessed 2D slices for Goh score prediction.
+
+    Each entry is an uncompressed `.npz` file holding the normalized float32 slice, origin, spacing, weight map and
+    (optionally) lung mask. The entry name is a hash of the slice path, the modification time of every source file
+    and the normalization parameters, so changed sources or a different normalization simply miss the cache. Entries
+    are written to a temporary file and renamed, so several folds can share one cache directory safely.
+
+    Examples:
+        :class:`ssc_scoring.mymodules.datasets.SynDataset`
+
+    """
+
+    def __init__(self, cache_dir: str, norm_params: Tuple[float, float, float, float] = NORM_PARAMS):
+        self.cache_dir = cache_dir
+        self.norm_params = norm_params
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, fpath: str, require_lung_mask: bool) -> str:
+        fpath = os.path.abspath(fpath)
+        sources = [fpath, weight_map_fpath(fpath)]
+        if require_lung_mask:
+            sources.append(lung_mask_fpath(fpath))
+        mtimes = [str(os.stat(src).st_mtime_ns) for src in sources]
+        token = '|'.join([*sources, *mtimes, *[str(p) for p in self.norm_params]])
+        return hashlib.sha1(token.encode()).hexdigest()
+
+    def entry_fpath(self, fpath: str, require_lung_mask: bool) -> str:
+        return os.path.join(self.cache_dir, self.key(fpath, require_lung_mask) + '.npz')
+
+    def get(self, fpath: str, require_lung_mask: bool = False) -> SliceRecord:
+        """Return the preprocessed record of `fpath`, loading and storing it on a cache miss."""
+        entry = self.entry_fpath(fpath, require_lung_mask)
+        if os.path.isfile(entry):
+            try:
+                with np.load(entry) as f:
+                    record = {k: f[k] for k in f.files}
+                self.hits += 1
+                return record
+            except (OSError, ValueError, EOFError):  # truncated/corrupted entry, rebuild it
+                pass
+
+        record = load_slice(fpath, require_lung_mask, self.norm_params)
+        tmp_entry = entry + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_entry, 'wb') as f:
+            np.savez(f, **record)
+        os.replace(tmp_entry, entry)
+        self.misses += 1
+        return record
+
+
+def _cached_slice(fpath: str, require_lung_mask: bool, cache_dir: str,
+                  norm_params: Tuple[float, float, float, float] = NORM_PARAMS) -> Tuple[SliceRecord, bool]:
+    """Get one record from the cache in `cache_dir`, and if it was a cache hit. Picklable for process pools."""
+    cache = SliceCache(cache_dir, norm_params)
+    record = cache.get(fpath, require_lung_mask)
+    return record, cache.hits == 1
+
+
+def load_slice_records(fpaths, require_lung_mask: bool = False, cache_dir: Optional[str] = None,
+                       workers: int = 0, mode: str = 'thread') -> list:
+    """Load the records of all `fpaths`, through a :class:`SliceCache` if `cache_dir` is given.
+
+    With `workers` > 0, slices, lung masks and weight maps are loaded concurrently by a pool of threads or processes
+    (`mode`), see :func:`ssc_scoring.mymodules.tool.ordered_map`. The order of the records is always the order of
+    `fpaths`.
+
+    """
+    if cache_dir:
+        func = functools.partial(_cached_slice, require_lung_mask=require_lung_mask, cache_dir=cache_dir)
+        out = list(tqdm(ordered_map(func, fpaths, workers, mode), total=len(fpaths)))
+        records = [record for record, _ in out]
+        hits = sum([hit for _, hit in out])
+        print(f"slice cache {cache_dir}: {hits} hits, {len(out) - hits} misses")
+    else:
+        func = functools.partial(load_slice, require_lung_mask=require_lung_mask)
+        records = list(tqdm(ordered_map(func, fpaths, workers, mode), total=len(fpaths)))
+    return records
+
+
+def pack_slice_records(fpaths, records: list) -> Dict[str, np.ndarray]:
+    """Pack per-slice records into contiguous arrays.
+
+    Weight maps are shared by all slices of one patient, so only the unique ones are stored, together with a
+    'weight_map_idx' array pointing each slice to its weight map.
+
+    Returns:
+        A dict with 'image' (N, H, W), 'origin' (N, -1), 'space' (N, -1), 'weight_map' (P, H, W),
+        'weight_map_idx' (N,) and 'lung_mask' (N, H, W), which is an empty array if the records have no lung masks.
+
+    """
+    if len(records) == 0:
+        packed = {k: np.zeros((0,)) for k in ('image', 'origin', 'space', 'weight_map', 'lung_mask')}
+        packed['weight_map_idx'] = np.zeros((0,), dtype=np.int64)
+        return packed
+    wm_fpaths = [weight_map_fpath(fpath) for fpath in fpaths]
+    wm_first_record = {}  # weight map path -> the first record holding it, in order
+    for i, wm in enumerate(wm_fpaths):
+        wm_first_record.setdefault(wm, i)
+    wm_idx = {wm: i for i, wm in enumerate(wm_first_record)}
+    packed = {'image': np.stack([r['image'] for r in records]),
+              'origin': np.stack([r['origin'] for r in records]),
+              'space': np.stack([r['space'] for r in records]),
+              'weight_map': np.stack([records[i]['weight_map'] for i in wm_first_record.values()]),
+              'weight_map_idx': np.array([wm_idx[wm] for wm in wm_fpaths], dtype=np.int64)}
+    if 'lung_mask' in records[0]:
+        packed['lung_mask'] = np.stack([r['lung_mask'] for r in records])
+    else:
+        packed['lung_mask'] = np.zeros((0,))
+    return packed
+
+
+class PackedSliceStore:
+    """Memory-mapped store of all slices of one dataset.
+
+    All arrays of :func:`pack_slice_records` are saved as `.npy` files in one directory and re-opened with
+    `mmap_mode='c'`. The pages are backed by the page cache and shared by the main process and all DataLoader
+    workers, instead of being copied into every worker as soon as Python touches the refcount of per-slice objects.
+    Copy-on-write mapping keeps the arrays writable for `torch.from_numpy` while the files stay untouched.
+
+    The directory name is a hash of the :class:`SliceCache` keys of all slices, so the store is rebuilt whenever
+    one of the slices, their masks/weight maps or the normalization change.
+
+    Examples:
+        :class:`ssc_scoring.mymodules.datasets.SynDataset`
+
+    """
+    done_fname = 'done'
+
+    def __init__(self, cache_dir: str, fpaths, require_lung_mask: bool = False, workers: int = 0,
+                 mode: str = 'thread'):
+        self.cache = SliceCache(cache_dir)
+        self.workers = workers
+        self.mode = mode
+        keys = [self.cache.key(fpath, require_lung_mask) for fpath in fpaths]
+        store_key = hashlib.sha1('|'.join(keys).encode()).hexdigest()
+        self.store_dir = os.path.join(cache_dir, 'packed', store_key)
+        self.fpaths = fpaths
+        self.require_lung_mask = require_lung_mask
+
+    def is_built(self) -> bool:
+        return os.path.isfile(os.path.join(self.store_dir, self.done_fname))
+
+    def build(self) -> None:
+        records = load_slice_records(self.fpaths, self.require_lung_mask, self.cache.cache_dir, self.workers,
+                                     self.mode)
+        packed = pack_slice_records(self.fpaths, records)
+        del records
+        tmp_dir = self.store_dir + '.' + str(os.getpid()) + '.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+        for k, v in packed.items():
+            np.save(os.path.join(tmp_dir, k + '.npy'), v)
+        open(os.path.join(tmp_dir, self.done_fname), 'w').close()
+        try:
+            os.replace(tmp_dir, self.store_dir)
+        except OSError:  # another process has built the same store meanwhile
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def load(self) -> Dict[str, np.ndarray]:
+        if not self.is_built():
+            with FileLock(self.store_dir + '.lock'):  # concurrent folds wait for one build instead of building it again
+                if not self.is_built():
+                    print(f"build packed slice store at {self.store_dir}")
+                    self.build()
+        arrays = {}
+        for fname in os.listdir(self.store_dir):
+            if fname.endswith('.npy'):
+                arrays[fname[:-len('.npy')]] = np.load(os.path.join(self.store_dir, fname), mmap_mode='c')
+        return arrays
+
+
+def load_packed_slices(fpaths, require_lung_mask: bool = False, cache_dir: Optional[str] = None,
+                       workers: int = 0, mode: str = 'thread') -> Dict[str, np.ndarray]:
+    """Contiguous arrays of all `fpaths`, memory-mapped from a :class:`PackedSliceStore` if `cache_dir` is given.
+
+    `workers` and `mode` are passed to :func:`load_slice_records`.
+
+    """
+    if cache_dir:
+        return PackedSliceStore(cache_dir, fpaths, require_lung_mask, workers, mode).load()
+    return pack_slice_records(fpaths, load_slice_records(fpaths, require_lung_mask, None, workers, mode))
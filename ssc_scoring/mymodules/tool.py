@@ -3,11 +3,13 @@
 # @Author  : Jingnan
 # @Email   : jiajingnan2222@gmail.com
 import argparse
+import collections
 import datetime
 import os
 import shutil
 import time
-from typing import Union, Tuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Union, Tuple, Callable, Iterable, Iterator, Optional
 from medutils.medutils import icc
 
 import numpy as np
@@ -39,6 +41,47 @@ log_metric = try_func(log_metric)
 log_metrics = try_func(log_metrics)
 
 
+def ordered_map(func: Callable, items: Iterable, workers: int = 0, mode: str = 'thread',
+                window: Optional[int] = None) -> Iterator:
+    """Apply `func` to `items` with a pool of threads or processes and yield the results in the order of `items`.
+
+    At most `window` (default: 2 * `workers`) items are in flight at the same time, so the results which are finished
+    but not consumed yet do not pile up in memory.
+
+    Args:
+        func: Function with one argument. It needs to be picklable (a top-level function or `functools.partial` of
+            it) if `mode` is 'process'.
+        items: Arguments of `func`.
+        workers: Number of threads/processes. 0 means sequential loading in the current thread.
+        mode: 'thread' for I/O-bound functions (reading files), 'process' for CPU-bound functions.
+        window: Maximum number of submitted but not yet yielded items.
+
+    Examples:
+        :func:`ssc_scoring.mymodules.slice_cache.load_slice_records`
+
+    """
+    if workers <= 0:
+        for item in items:
+            yield func(item)
+        return
+
+    if mode == 'thread':
+        executor_cls = ThreadPoolExecutor
+    elif mode == 'process':
+        executor_cls = ProcessPoolExecutor
+    else:
+        raise Exception(f"mode should be thread or process, but is {mode}")
+    window = window if window else 2 * workers
+    with executor_cls(max_workers=workers) as executor:
+        futures = collections.deque()
+        for item in items:
+            if len(futures) >= window:
+                yield futures.popleft().result()
+            futures.append(executor.submit(func, item))
+        while futures:
+            yield futures.popleft().result()
+
+
 def sampler_by_disext(tr_y, sys_ratio=None) -> WeightedRandomSampler:
     """Balanced sampler according to score distribution of disext.
 
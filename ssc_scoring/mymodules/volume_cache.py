@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 9:40 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from ssc_scoring.mymodules.mytrans import load_volume
+from ssc_scoring.mymodules.tool import ordered_map
+
+
+class VolumeCache:
+    """3D CT scans for position prediction, loaded once and kept in shared memory.
+
+    Each scan is truncated to [-1500, 1500] and stored once as a torch shared-memory tensor, as int16 if the scan has
+    an integer dtype (half the memory of float32) and as float32 otherwise. All datasets (`train`, `validaug`,
+    `valid`, `test`) read views of the same volumes through
+    :class:`ssc_scoring.mymodules.mytrans.CachedLoadDatad`, and DataLoader workers map the same memory instead of
+    receiving a copy of each dataset.
+
+    Args:
+        fpaths: Full paths of all 3D scans. Duplicated paths are stored once.
+        workers: Number of threads to load the scans. 0 means sequential loading.
+
+    Examples:
+        :meth:`ssc_scoring.mymodules.mydata.LoadPos.load`
+
+    """
+
+    def __init__(self, fpaths: Sequence[str], workers: int = 0):
+        self.fpaths = list(dict.fromkeys(fpaths))
+        self.volumes: Dict[str, torch.Tensor] = {}
+        self.origins: Dict[str, np.ndarray] = {}
+        self.spaces: Dict[str, np.ndarray] = {}
+        for fpath, (x, ori, sp) in zip(self.fpaths, tqdm(ordered_map(load_volume, self.fpaths, workers),
+                                                          total=len(self.fpaths))):
+            dtype = np.int16 if np.issubdtype(x.dtype, np.integer) else np.float32  # values are in [-1500, 1500]
+            self.volumes[fpath] = torch.from_numpy(np.ascontiguousarray(x, dtype=dtype)).share_memory_()
+            self.origins[fpath] = ori
+            self.spaces[fpath] = sp
+        print(f"volume cache: {len(self.volumes)} scans, {self.nbytes / 1024 ** 3:.2f} GB in shared memory")
+
+    @property
+    def nbytes(self) -> int:
+        return sum([v.numel() * v.element_size() for v in self.volumes.values()])
+
+    def __len__(self):
+        return len(self.volumes)
+
+    def __contains__(self, fpath: str) -> bool:
+        return fpath in self.volumes
+
+    def get(self, fpath: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """A numpy view of the cached scan `fpath` (do not modify it), its origin and spacing."""
+        if fpath not in self.volumes:
+            raise Exception(f"{fpath} is not in the volume cache")
+        return self.volumes[fpath].numpy(), self.origins[fpath], self.spaces[fpath]
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/19/26 3:50 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+"""Occlusion sensitivity maps of all slices of a cohort, computed by a pool of processes into one result store.
+
+The middle slice of each level of each patient in `--mode` (same slices as
+:func:`ssc_scoring.occlusion_sensitivity.batch_occlusion`) is sent to a worker process, which loads the network once
+and computes the maps with the batched engine :func:`ssc_scoring.mymodules.occlusion.occlusion_maps`. The maps, the
+image and the lung mask of each slice are written to a chunked
+:class:`ssc_scoring.mymodules.occlusion_store.OcclusionStore` in the directory of the model. Slices which are already
+in the store for the same model, patch size, stride and occluder are skipped, so an interrupted run is continued by
+starting it again. Overlays (`.jpg`) are not rendered during the run. They are rendered from the store on demand with
+`--render`.
+
+Usage:
+
+    python occlusion_cohort.py --net_id 1903 --patch_size 64 --stride 16 --workers 2
+    python occlusion_cohort.py --net_id 1903 --patch_size 64 --stride 16 --render Pat_023/Level1
+
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from ssc_scoring.mymodules.occlusion_store import OcclusionStore, store_dir_of
+
+_worker: Dict = {}  # network, occluder and device of this worker process
+
+
+def _init_worker(net_name: str, model_fpath: str, occ_status: str, threads: int, batch_size: int) -> None:
+    torch.set_num_threads(threads)
+    from ssc_scoring.mymodules.networks.cnn_fc2d import get_net
+    from ssc_scoring.mymodules.set_args import get_args
+    from ssc_scoring.occlusion_sensitivity import generate_candidate, occ_seed_fpath
+
+    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+    net = get_net(net_name, 3, get_args([]))
+    net.load_state_dict(torch.load(model_fpath, map_location=device))
+    _worker.update({'net': net.to(device).eval(), 'device': device, 'batch_size': batch_size,
+                    'occ_patch': generate_candidate(occ_seed_fpath(occ_status))})
+
+
+def _occlusion_worker(item: Tuple[str, np.ndarray, np.ndarray, int, int]) -> Tuple[str, np.ndarray, np.ndarray]:
+    """Maps (shape (3, h, w)) and prediction of the unoccluded slice of one slice (key, image, lung mask, patch size,
+    stride)."""
+    from ssc_scoring.mymodules.occlusion import occlusion_maps
+    key, x, lung_mask, patch_size, stride = item
+    maps, out_ori, _, _ = occlusion_maps(_worker['net'], x, _worker['occ_patch'], lung_mask, patch_size, stride,
+                                         batch_size=_worker['batch_size'], device=_worker['device'])
+    return key, maps, out_ori
+
+
+def cohort_slices(net_id: int, mode: str = 'valid', max_img_nb: int = 0) -> Iterator[Tuple[str, Dict]]:
+    """(key, slice) of the middle slices of `mode`, with the image, the lung mask, the label and the file path.
+
+    The key is the patient and level directory of the slice, e.g. 'Pat_023/Level1'.
+
+    """
+    from ssc_scoring.mymodules.mydata import LoadScore
+    from ssc_scoring.mymodules.set_args import get_args
+    from ssc_scoring.occlusion_sensitivity import get_level_dir, get_pat_dir
+    from ssc_scoring.run import Path
+
+    args = get_args([])
+    args.batch_size = 15  # 15/3=5, all 5 levels in the same patient will be loaded in one batch
+    mypath = Path(net_id)
+    all_loader = LoadScore(mypath, mypath.label_excel_fpath, 49, args, nb_img=None, require_lung_mask=True)
+    dataloaders = dict(zip(['train', 'validaug', 'valid', 'test'], all_loader.load()))
+    for nb_img, data in enumerate(dataloaders[mode], start=1):
+        if max_img_nb and nb_img > max_img_nb:
+            break
+        for idx, (x, y, lung_mask, fpath) in enumerate(zip(data['image_key'], data['label_key'],
+                                                          data['lung_mask_key'], data['fpath_key']), start=1):
+            if idx % 3 == 0:  # skip next 2 images because the neighboring 3 images are similar (up, middl, down)
+                key = get_pat_dir(fpath) + '/' + get_level_dir(fpath)
+                yield key, {'image': x.numpy()[0], 'lung_mask': lung_mask.numpy()[0], 'label': y.numpy().tolist(),
+                            'fpath': fpath}
+
+
+def run_cohort(net_id: int, net_name: str = 'convnext_tiny', mode: str = 'valid', patch_size: int = 64,
+               stride: int = 16, occ_status: str = 'healthy', workers: int = 1, threads: int = 0,
+               batch_size: int = 0, max_img_nb: int = 0, chunk_size: int = 16) -> OcclusionStore:
+    """Compute the occlusion maps of all slices of `mode` which are not in the store yet.
+
+    Returns:
+        The store with the maps of all slices.
+
+    """
+    from ssc_scoring.run import Path
+    mypath = Path(net_id)
+    params = {'net_id': net_id, 'net': net_name, 'model_mtime_ns': os.stat(mypath.model_fpath).st_mtime_ns,
+              'patch_size': patch_size, 'stride': stride, 'occ_status': occ_status}
+    store = OcclusionStore(store_dir_of(mypath.id_dir, mode, occ_status, patch_size, stride), params, chunk_size)
+
+    slices = {key: sl for key, sl in cohort_slices(net_id, mode, max_img_nb) if key not in store}
+    print(f"{len(store)} slices in {store.store_dir}, {len(slices)} slices to compute")
+    if not slices:
+        return store
+
+    workers = max(1, workers)
+    threads = threads if threads > 0 else max(1, (os.cpu_count() or 1) // workers)
+    ctx = multiprocessing.get_context('spawn')  # no CUDA context or torch thread pool inherited
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(net_name, mypath.model_fpath, occ_status, threads, batch_size)) as executor:
+        items = [(key, sl['image'], sl['lung_mask'], patch_size, stride) for key, sl in slices.items()]
+        for key, maps, out_ori in tqdm(executor.map(_occlusion_worker, items), total=len(items)):
+            sl = slices.pop(key)
+            store.add(key, maps, sl['image'], sl['lung_mask'],
+                      {'fpath': sl['fpath'], 'label': sl['label'], 'pred': out_ori.tolist()})
+    store.flush()
+    return store
+
+
+def render(store: OcclusionStore, keys: Optional[Sequence[str]] = None, out_dir: Optional[str] = None) -> None:
+    """Render the overlays of the slices `keys` (all slices if None) of `store` to `out_dir/<key>`, by default to
+    `<store_dir>/figures/<key>`."""
+    from ssc_scoring.occlusion_sensitivity import save_occlusion_figures
+    out_dir = out_dir or os.path.join(store.store_dir, 'figures')
+    for key in (keys or store.keys()):
+        maps, image, _, meta = store.get(key)
+        occlusion_dir = os.path.join(out_dir, key)
+        os.makedirs(occlusion_dir, exist_ok=True)
+        save_occlusion_figures(np.array(image)[None], list(np.array(maps, dtype=np.float64)), meta['label'],
+                               meta['pred'], occlusion_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Occlusion sensitivity maps of a cohort.")
+    parser.add_argument('--net_id', help='experiment ID of the trained score model', type=int, default=1922)
+    parser.add_argument('--net', help='network name of the model', type=str, default='convnext_tiny')
+    parser.add_argument('--mode', choices=('train', 'validaug', 'valid', 'test'), help='dataset', type=str,
+                        default='valid')
+    parser.add_argument('--patch_size', help='side length of the occluded patch', type=int, default=64)
+    parser.add_argument('--stride', help='stride between 2 positions, 0 means patch_size // 4', type=int, default=0)
+    parser.add_argument('--occ_status', choices=('healthy', 'diseased', 'diseased_gg', 'diseased_ret'),
+                        help='occluder', type=str, default='healthy')
+    parser.add_argument('--workers', help='number of worker processes', type=int, default=1)
+    parser.add_argument('--threads', help='torch threads per worker, 0 means all cores divided by workers',
+                        type=int, default=0)
+    parser.add_argument('--batch_size', help='occluded slices per forward pass, 0 means by free memory', type=int,
+                        default=0)
+    parser.add_argument('--max_img_nb', help='maximum number of batches of the dataloader, 0 means all', type=int,
+                        default=0)
+    parser.add_argument('--chunk_size', help='slices per chunk of the store', type=int, default=16)
+    parser.add_argument('--render', help='render the overlays of these slices (or "all") instead of computing maps',
+                        type=str, nargs='*', default=None)
+    args = parser.parse_args()
+    stride = args.stride or args.patch_size // 4
+
+    if args.render is not None:
+        from ssc_scoring.run import Path
+        store = OcclusionStore(store_dir_of(Path(args.net_id).id_dir, args.mode, args.occ_status, args.patch_size,
+                                            stride))
+        render(store, None if args.render in ([], ['all']) else args.render)
+    else:
+        run_cohort(args.net_id, args.net, args.mode, args.patch_size, stride, args.occ_status, args.workers,
+                   args.threads, args.batch_size, args.max_img_nb, args.chunk_size)
+    print('finish!')
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,7 @@ from ssc_scoring.mymodules.mydata import LoadScore
 from ssc_scoring.mymodules.set_args import get_args
 from ssc_scoring.mymodules.data_synthesis import savefig
 from ssc_scoring.mymodules.colormap import get_continuous_cmap
+from ssc_scoring.mymodules.occlusion import occlusion_maps
 
 from scipy.ndimage import morphology
 import matplotlib.pyplot as plt
@@ -160,10 +161,37 @@ def generate_candidate(fpath: str, image_size: int = 512):
     return temp
 
 
+def occ_seed_fpath(occ_status: str = 'healthy') -> str:
+    """Seed patch of the occluder: 'healthy', 'diseased', 'diseased_gg' or 'diseased_ret'."""
+    if occ_status=='healthy':
+        occ_seed = "/home/jjia/data/ssc_scoring/ssc_scoring/dataset/special_samples/healthy/healthy.mha"
+    elif 'diseased' in occ_status:
+        if occ_status=='diseased_gg':
+            occ_seed = "/home/jjia/data/ssc_scoring/ssc_scoring/dataset/special_samples/diseased/diseased_gg.mha"
+        elif occ_status=='diseased_ret':
+            occ_seed = "/home/jjia/data/ssc_scoring/ssc_scoring/dataset/special_samples/diseased/diseased_ret.mha"
+        else:
+            occ_seed = "/home/jjia/data/ssc_scoring/ssc_scoring/dataset/special_samples/diseased/diseased.mha"
+    else:
+        raise Exception("wrong occ_status: " + occ_status)
+    return occ_seed
+
+
+def occluded_slice(x: np.ndarray, occ_patch: np.ndarray, lung_mask: np.ndarray, i: int, j: int, ptch: int):
+    """The slice `x` (shape [w, h]) occluded by `occ_patch` at the patch (i, j) inside the lung."""
+    mask = np.zeros(x.shape)
+    mask[i: i + ptch, j: j + ptch] = 1
+    mask = cv2.blur(mask * lung_mask, (5, 5))  # exclude area outside lung
+    return x * (1 - mask) + occ_patch * mask
+
+
 def occlusion_map(patch_size, x, y, net, lung_mask=None, occlusion_dir=None, save_occ_x=False, stride=None,occ_status='healthy',
-                  map_2_w=None):  # for one image
+                  map_2_w=None, batch_size=0):  # for one image
     """Save occlusion map to disk.
 
+    The occluded images of all positions are predicted in batches by
+    :func:`ssc_scoring.mymodules.occlusion.occlusion_maps`.
+
     Args:
         patch_size: patch side lenth
         x: image to be predicted, shape [channel, w, h]
@@ -171,6 +199,7 @@ def occlusion_map(patch_size, x, y, net, lung_mask=None, occlusion_dir=None, sav
         net: network
         lung_mask: lung mask to ensure the occlusion occurs in lung area, shape [channel, w, h]
         occlusion_dir: directory to save occlusion maps
+        batch_size: occluded images per forward pass, 0 means as many as fit in the free memory
 
     Returns:
         None
@@ -178,167 +207,59 @@ def occlusion_map(patch_size, x, y, net, lung_mask=None, occlusion_dir=None, sav
     if not os.path.isdir(occlusion_dir):
         os.makedirs(occlusion_dir)
 
-
     # lung_mask = morphology.binary_erosion(lung_mask.numpy(), np.ones((6, 6))).astype(int)
     lung_mask = lung_mask.numpy()
     lung_mask[lung_mask > 0] = 1
     lung_mask[lung_mask <= 0] = 0
     # np.save(os.path.join(occlusion_dir, f"lung_mask.npy"), lung_mask)
-    x = x.to(device)  # shape [channel, w, h]
     net.to(device)
-    x_ = x.unsqueeze(0)
-    out_ori = net(x_)
     _, w, h = x.shape
-    # print(x.shape)  # [1, 512, 512] [channel, w, h]
-    # print(out_ori.shape)  # [1, 3]
-
-    # Three-pattern scores
-    out_ori = out_ori.detach().cpu().numpy()
-    out_ori_1 = out_ori[0, 0]  # tot score
-    out_ori_2 = out_ori[0, 1]  # gg score
-    out_ori_3 = out_ori[0, 2]  # ret score
-
-    # out_ori_2 = out_ori[0][1].item()
-    # out_ori_3 = out_ori[0][2].item()
-    # print(out_ori_2)
-
     x_np = x.clone().detach().cpu().numpy()  # shape [channel, w, h]
 
-    # y_np = y.clone().detach()..cpu().numpy()  # (1,3)
+    occ_patch = generate_candidate(occ_seed_fpath(occ_status))  # the healthy image is filled by healthy patches
 
-    map_1 = np.zeros((w, h))
-    map_2 = np.zeros((w, h))
-    map_3 = np.zeros((w, h))
+    # Three-pattern scores: tot, gg, ret
+    maps, out_ori, positions, outs = occlusion_maps(net, x_np, occ_patch, lung_mask, patch_size, stride,
+                                                    batch_size=batch_size, device=device)
+    map_1, map_2, map_3 = maps[0], maps[1], maps[2]
+    out_ori_1, out_ori_2, out_ori_3 = out_ori[0], out_ori[1], out_ori[2]
+    out_np = out_ori.reshape(1, -1)
 
-    map_1_w = np.zeros((w, h))
-    map_2_w = np.zeros((w, h))
-    map_3_w = np.zeros((w, h))
+    savefig(False, lung_mask, 'lung_mask.png', occlusion_dir)
+    savefig(True, x_np[0], f"ori_image_tot_{int(out_ori_1)}_gg_{int(out_ori_2)}_ret_{int(out_ori_3)}.png", occlusion_dir)
 
-    # # why do we need the following code?
-    # x_mean = np.mean(x_np, axis=(1, 2, 3))  # (10, 1)
-    # x_std = np.std(x_np, axis=(1, 2, 3))
+    if save_occ_x:
+        ptch = patch_size
+        for (i, j), (out_1, out_2, out_3) in zip(positions, outs):
+            if i % patch_size == 0 and j % patch_size == 0:  # do not save all steps
+                tmp = occluded_slice(x_np[0], occ_patch, lung_mask.reshape(w, h), i, j, ptch)
+                savefig(True, tmp, f"{i}_{j}_x_tot_{int(out_1)}_gg_{int(out_2)}_ret_{int(out_3)}.png", occlusion_dir)
+                save_x_countor = False
+                if save_x_countor:
+                    tmp2 = copy.deepcopy(tmp)
+                    edge = 5
+                    tmp2[i : i + edge, j : j + ptch] = 1
+                    tmp2[i + ptch - edge: i + ptch, j: j + ptch] = 1
+                    tmp2[i : i + ptch, j : j + edge] = 1
+                    tmp2[i : i + ptch, j+ ptch - edge: j+ ptch] = 1
 
-    if occ_status=='healthy':
-        occ_seed = "/home/jjia/data/ssc_scoring/ssc_scoring/dataset/special_samples/healthy/healthy.mha"
-    elif 'diseased' in occ_status:
-        if occ_status=='diseased_gg':
-            occ_seed = "/home/jjia/data/ssc_scoring/ssc_scoring/dataset/special_samples/diseased/diseased_gg.mha"
-        elif occ_status=='diseased_ret':
-            occ_seed = "/home/jjia/data/ssc_scoring/ssc_scoring/dataset/special_samples/diseased/diseased_ret.mha"
-        else:
-            occ_seed = "/home/jjia/data/ssc_scoring/ssc_scoring/dataset/special_samples/diseased/diseased.mha"
-    occ_patch = generate_candidate(occ_seed)  # the healthy image is filled by healthy patches
+                    savefig(True, tmp2, f"{i}_{j}_occlusion_x_tot_{int(out_1)}_gg_{int(out_2)}_ret_{int(out_3)}.png", occlusion_dir)
+
+    save_occlusion_figures(x_np, [map_1, map_2, map_3], list(y.numpy()), list(out_np.reshape(-1,)), occlusion_dir)
 
-    # print(f'x_np.mean: {x_mean}, x_np.std: {x_std}, ')
-    # print(f"sum of lung mask: {np.sum(lung_mask.numpy())}")
-    savefig(False, lung_mask, 'lung_mask.png', occlusion_dir)
-    savefig(True, x_np[0], f"ori_image_tot_{int(out_ori_1)}_gg_{int(out_ori_2)}_ret_{int(out_ori_3)}.png", occlusion_dir)
 
-    # nb_ptchs = math.ceil(512 / patch_size)
-    ptch = patch_size
-    i, j = 0, 0  # row index, column index
-    while i < 512:
-        while j < 512:
-            # print(f'i, {i}, j, {j}')
-
-            mask_ori = np.zeros((w, h))
-            mask_ori[i : i + ptch, j: j + ptch] = 1
-            # print(f"before lung mask, the patch mask sum is {np.sum(mask)}")
-            mask_ori = mask_ori * lung_mask # exclude area outside lung
-            # print(f"after lung mask, the patch mask sum is {np.sum(mask)}")
-
-            # mask[nb_, 0, i * ptch: (i + 1) * ptch, j * ptch: (j + 1) * ptch] = 1
-            mask = cv2.blur(mask_ori, (5, 5))
-            # new_x = copy.deepcopy(x_np)  # shape [0, 512, 512], avoid changing the original x-np
-            tmp = x_np[0] * (1-mask) + occ_patch * mask
-
-            # import matplotlib.pyplot as plt
-            # plt.figure()
-            # fig, ax = plt.subplots()
-            # ax.imshow(tmp, cmap='gray')
-            # plt.show()
-            # ax.axis('off')
-            # fig.savefig(str(nb_) + '_sliding.png')
-            # plt.close()
-            # new_x = torch.tensor(new_x)
-            # new_x[nb_, 0, i * ptch: (i + 1) * ptch, j * ptch: (j + 1) * ptch] = torch.tensor(x_health[:ptch, :ptch])
-            new_x = torch.tensor(tmp).float()
-            # new_x = new_x.double()
-            new_x = new_x.unsqueeze(0).unsqueeze(0)
-            # print(f"nex_x.shape: {new_x.shape}")
-            #
-            # new_x = new_x.unsqueeze(0)  # add channel and batch dims
-            # print(f"nex_x.shape: {new_x.shape}")
-            new_x = new_x.to(device)
-            out = net(new_x)
-            # print(f'out: {out}')
-            # t3 = time.time()
-
-            # print('t3-t2', t3-t2)
-
-            out_np = out.clone().detach().cpu().numpy()
-            out_1 = out_np[0, 0]  # scalar
-            out_2 = out_np[0, 1]
-            out_3 = out_np[0, 2]
-            # print(f'out1: {out_1}')
-
-            dif_1 = out_1 - out_ori_1  # use np.rint to ignore the random noise
-            dif_2 = out_2 - out_ori_2
-            dif_3 = out_3 - out_ori_3
-
-            if save_occ_x:
-                if i%patch_size==0 and j%patch_size==0:  # do not save all steps
-                    savefig(True, tmp, f"{i}_{j}_x_tot_{int(out_1)}_gg_{int(out_2)}_ret_{int(out_3)}.png", occlusion_dir)
-                    save_x_countor = False
-                    if save_x_countor:
-                        tmp2 = copy.deepcopy(tmp)
-                        edge = 5
-                        tmp2[i : i + edge, j : j + ptch] = 1
-                        tmp2[i + ptch - edge: i + ptch, j: j + ptch] = 1
-                        tmp2[i : i + ptch, j : j + edge] = 1
-                        tmp2[i : i + ptch, j+ ptch - edge: j+ ptch] = 1
-
-                        savefig(True, tmp2, f"{i}_{j}_occlusion_x_tot_{int(out_1)}_gg_{int(out_2)}_ret_{int(out_3)}.png", occlusion_dir)
-
-            # print(f"out_1: {np.rint(out_1)}, out_2: {np.rint(out_2)}, out_3: {np.rint(out_3)}, "
-            #       f"dif_1: {dif_1}, dif_2: {dif_2}, dif_3: {dif_3}")
-            # threshold = 3  # mae difference greater than 3 is regarded valuable
-            # if abs(dif_1) < threshold:
-            #     dif_1 = 0
-            # if abs(dif_2) < threshold:
-            #     dif_2 = 0
-            # if abs(dif_3) < threshold:
-            #     dif_3 = 0
-            # mask[mask>0]=1
-            map_1[mask_ori > 0] += dif_1
-            map_2[mask_ori > 0] += dif_2
-            map_3[mask_ori > 0] += dif_3
-            # print(f'sum of dif_1: {np.sum(dif_1)}')
-            # print(f'sum of map1: {np.sum(map_1)}')
-            map_1_w[mask_ori > 0] += 1
-            map_2_w[mask_ori > 0] += 1
-            map_3_w[mask_ori > 0] += 1
-            j += stride
-        i += stride
-        j = 0
-        # print(f'i: {i}')
-            # map_1[i * ptch: (i + 1) * ptch, j * ptch: (j + 1) * ptch] = dif_1
-            # map_2[i * ptch: (i + 1) * ptch, j * ptch: (j + 1) * ptch] = dif_2
-            # map_3[i * ptch: (i + 1) * ptch, j * ptch: (j + 1) * ptch] = dif_3
-            # t4 = time.time()
-
-            # print('t4-t3', t4 - t3)
-    # print(f'sum of map1: {sum(map_1)}')
-
-    map_1_w[map_1_w==0] = 1
-    map_2_w[map_2_w==0] = 1
-    map_3_w[map_3_w==0] = 1
-
-    map_1 = map_1 / map_1_w
-    map_2 = map_2 / map_2_w
-    map_3 = map_3 / map_3_w
+def save_occlusion_figures(x_np, maps, y_ls, pred_ls, occlusion_dir):
+    """Save the difference maps of tot, gg and ret scores (`.npy`) and their overlays on the image (`.jpg`).
 
+    Args:
+        x_np: image, shape [channel, w, h]
+        maps: 3 difference maps, shape [w, h]
+        y_ls: 3 labels
+        pred_ls: 3 predictions of the image
+        occlusion_dir: directory to save the files
 
+    """
+    _, w, h = x_np.shape
     x_min = np.min(x_np)
     x_max = np.max(x_np)
     # print(f"x_min: {x_min}, x_max: {x_max}")
@@ -347,15 +268,13 @@ def occlusion_map(patch_size, x, y, net, lung_mask=None, occlusion_dir=None, sav
     x_np = (x_np - x_min) / (x_max - x_min) * 255
     cv2.imwrite(occlusion_dir + "/ori_img.jpg", x_np)
     # print(f"ori image saved at {occlusion_dir}")
-    y_ls = list(y.numpy())
-    pred_ls = list(out_np.reshape(-1,))
     # print(y_ls,  '----')
 
     # for nb, mp_1, mp_2, mp_3 in zip(range(nb_img), map_1, map_2, map_3):  # per CT
     save_higher = True
     save_lower = True
     save_diff = True
-    for map, lb, score, pred in zip([map_1, map_2, map_3], ['disext', 'gg', 'rept'], y_ls, pred_ls):  # per label
+    for map, lb, score, pred in zip(maps, ['disext', 'gg', 'rept'], y_ls, pred_ls):  # per label
 
         # map_mae = copy.deepcopy(map)
         map_ = copy.deepcopy(map)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/19/26 9:10 AM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+"""Write the resampled copies of all 3D scans which are read from `PathPos.dataset_dir(resample_z)` by `run_pos.py`.
+
+Each scan of `dataset_dir(0)` is truncated to [-1500, 1500], linearly resampled to the shape of `resample_z` (see
+:data:`ssc_scoring.mymodules.path.RESAMPLE_SHAPES`, the physical extent and the origin are kept), and written as a
+compressed `.mha` file to the same relative path in `dataset_dir(resample_z)`, as int16 by default. Origin, spacing
+and shape of every written scan are recorded in one index file `resample_index.json` in the output directory.
+
+Scans are resampled by a pool of processes. The index is updated after each finished scan and a scan is only
+resampled again if it is not in the index or its source has changed, so an interrupted run can be continued and a
+second run only resamples new or modified scans.
+
+Usage:
+
+    python resample_dataset.py --resample_z 256 512 --workers 8 --threads 2
+
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+import functools
+import glob
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from filelock import FileLock
+from tqdm import tqdm
+
+from ssc_scoring.mymodules.tool import ordered_map
+
+INDEX_FNAME = 'resample_index.json'
+INDEX_VERSION = 1
+
+
+def src_scans(src_dir: str) -> List[str]:
+    """The 3D scans in `src_dir`, found in the same way as :meth:`ssc_scoring.mymodules.mydata.LoadPos.split_dir_pats`.
+    """
+    fpaths = sorted(glob.glob(os.path.join(src_dir, "Pat_*", "CTimage.mha")))
+    if len(fpaths) == 0:  # does not find patients in this directory
+        fpaths = sorted(glob.glob(os.path.join(src_dir, "Pat_*CTimage*.mha")))
+    return fpaths
+
+
+def load_index(dst_dir: str) -> Dict:
+    """The index of the resampled scans in `dst_dir`, an empty index if it does not exist or can not be read."""
+    try:
+        with open(os.path.join(dst_dir, INDEX_FNAME)) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {'version': INDEX_VERSION, 'scans': {}}
+    if index.get('version') != INDEX_VERSION:
+        return {'version': INDEX_VERSION, 'scans': {}}
+    return index
+
+
+def save_index(dst_dir: str, index: Dict) -> None:
+    fpath = os.path.join(dst_dir, INDEX_FNAME)
+    tmp_fpath = fpath + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_fpath, 'w') as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp_fpath, fpath)
+
+
+def is_up_to_date(entry: Optional[Dict], src_fpath: str, dst_fpath: str, shape: Sequence[int], dtype: str) -> bool:
+    """If the index `entry` of `dst_fpath` was written from the current `src_fpath` with `shape` and `dtype`."""
+    if entry is None or not os.path.isfile(dst_fpath):
+        return False
+    return (entry.get('src_mtime_ns') == os.stat(src_fpath).st_mtime_ns and
+            entry.get('mtime_ns') == os.stat(dst_fpath).st_mtime_ns and
+            entry.get('shape') == list(shape) and entry.get('dtype') == dtype)
+
+
+def resample_scan(fpaths: Tuple[str, str], shape: Sequence[int], dtype: str = 'int16', threads: int = 1) -> Dict:
+    """Truncate, resample and write one scan.
+
+    The output is written to a hidden temporary file and renamed, so a half-written scan is never read.
+
+    Args:
+        fpaths: (source scan, output scan).
+        shape: Output shape (z, y, x).
+        dtype: 'int16' (rounded) or 'float32'.
+        threads: Number of threads of SimpleITK in this process.
+
+    Returns:
+        Index entry of the output scan: origin and spacing (shape order: z, y, x), shape, dtype and the modification
+        times of the source and the output.
+
+    """
+    import SimpleITK as sitk
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(threads)
+    src_fpath, dst_fpath = fpaths
+    src_mtime_ns = os.stat(src_fpath).st_mtime_ns
+
+    img = sitk.Clamp(sitk.ReadImage(src_fpath), sitk.sitkFloat32, -1500, 1500)
+    size = list(reversed(shape))  # SimpleITK uses x, y, z
+    space = [sp * old_sz / new_sz for sp, old_sz, new_sz in zip(img.GetSpacing(), img.GetSize(), size)]
+    out = sitk.Resample(img, size, sitk.Transform(), sitk.sitkLinear, img.GetOrigin(), space, img.GetDirection(),
+                        -1500.0, sitk.sitkFloat32)
+    if dtype == 'int16':
+        out = sitk.Cast(sitk.Round(out), sitk.sitkInt16)
+
+    os.makedirs(os.path.dirname(dst_fpath), exist_ok=True)
+    tmp_fpath = os.path.join(os.path.dirname(dst_fpath), '.' + str(os.getpid()) + '_' + os.path.basename(dst_fpath))
+    sitk.WriteImage(out, tmp_fpath, True)  # compressed
+    os.replace(tmp_fpath, dst_fpath)
+    return {'origin': list(reversed(out.GetOrigin())), 'space': list(reversed(out.GetSpacing())),
+            'shape': list(shape), 'dtype': dtype, 'src_mtime_ns': src_mtime_ns,
+            'mtime_ns': os.stat(dst_fpath).st_mtime_ns}
+
+
+def resample_dataset(src_dir: str, dst_dir: str, shape: Sequence[int], dtype: str = 'int16', workers: int = 0,
+                     threads: int = 1) -> int:
+    """Resample all scans of `src_dir` to `dst_dir` which are not up to date in the index of `dst_dir`.
+
+    Entries of scans which are not in `src_dir` any more are removed from the index. Runs on the same `dst_dir` are
+    serialized by a file lock.
+
+    Returns:
+        Number of resampled scans.
+
+    """
+    os.makedirs(dst_dir, exist_ok=True)
+    with FileLock(os.path.join(dst_dir, INDEX_FNAME + '.lock')):
+        index = load_index(dst_dir)
+        index.update({'src_dir': os.path.abspath(src_dir), 'shape': list(shape), 'dtype': dtype})
+        rel_paths = [os.path.relpath(fpath, src_dir) for fpath in src_scans(src_dir)]
+        index['scans'] = {rel: entry for rel, entry in index['scans'].items() if rel in rel_paths}
+
+        todo = [rel for rel in rel_paths if not is_up_to_date(index['scans'].get(rel), os.path.join(src_dir, rel),
+                                                               os.path.join(dst_dir, rel), shape, dtype)]
+        print(f"resample {len(todo)} of {len(rel_paths)} scans to {shape} in {dst_dir}")
+        func = functools.partial(resample_scan, shape=tuple(shape), dtype=dtype, threads=threads)
+        items = [(os.path.join(src_dir, rel), os.path.join(dst_dir, rel)) for rel in todo]
+        for rel, entry in zip(todo, tqdm(ordered_map(func, items, workers, mode='process'), total=len(todo))):
+            index['scans'][rel] = entry
+            save_index(dst_dir, index)  # finished scans are kept if the run is interrupted
+        save_index(dst_dir, index)
+    return len(todo)
+
+
+def main():
+    from ssc_scoring.mymodules.path import PathPos, RESAMPLE_SHAPES
+    from ssc_scoring.run_folds import available_cores
+
+    parser = argparse.ArgumentParser(description="Resample the 3D scans for position prediction.")
+    parser.add_argument('--resample_z', help='resampled datasets to write', choices=tuple(RESAMPLE_SHAPES),
+                        type=int, nargs='+', default=[256])
+    parser.add_argument('--dtype', choices=('int16', 'float32'), help='pixel type of the resampled scans', type=str,
+                        default='int16')
+    parser.add_argument('--workers', help='number of processes, 0 means all available cores divided by threads',
+                        type=int, default=0)
+    parser.add_argument('--threads', help='number of threads per process', type=int, default=1)
+    args = parser.parse_args()
+
+    mypath = PathPos()
+    workers = args.workers if args.workers > 0 else max(1, available_cores() // args.threads)
+    for resample_z in args.resample_z:
+        nb = resample_dataset(mypath.dataset_dir(0), mypath.dataset_dir(resample_z), RESAMPLE_SHAPES[resample_z],
+                              args.dtype, workers, args.threads)
+        print(f"resample_z {resample_z}: {nb} scans resampled")
+
+
+if __name__ == "__main__":
+    main()
@@ -29,6 +29,7 @@ from ssc_scoring.mymodules.path import PathScore as Path
 from ssc_scoring.mymodules.myloss import get_loss
 from ssc_scoring.mymodules.networks.cnn_fc2d import get_net, ReconNet
 from ssc_scoring.mymodules.mydata import LoadScore
+from ssc_scoring.mymodules.composed_trans import batch_xformd_score
 from ssc_scoring.mymodules.inference import record_best_preds, round_to_5
 from ssc_scoring.mymodules.path import PathPos, PathScoreInit
 from argparse import Namespace
@@ -104,6 +105,7 @@ def start_run(args, mode, net, dataloader, loss_fun, loss_fun_mae, opt, mypath,
     total_loss_mae = 0
     total_loss_mae_end5 = 0  # Goh score is ended by 5
 
+    batch_xform = batch_xformd_score(mode, args)  # None if augmentation is done per sample in workers
     t0 = time.time()
     t_load_data, t_to_device, t_train_per_step = [], [], []  # time of loading data, to_device and train a step
     for ite, data in enumerate(dataloader):
@@ -120,6 +122,8 @@ def start_run(args, mode, net, dataloader, loss_fun, loss_fun_mae, opt, mypath,
 
         batch_x = batch_x.to(device)
         batch_y = batch_y.to(device)
+        if batch_xform is not None:
+            batch_x = batch_xform(batch_x)
 
         global FLOPs_done
         if not FLOPs_done:
@@ -339,9 +343,10 @@ def train(args: Namespace, id_: int, log_dict: Dict[str, LogType]) -> Dict[str,
                     'validaug': validaug_dataloader,
                     'test': test_dataloader}
     # Load the best model, get the corresponding prediction and metrics
-    record_best_preds(net, data_loaders, mypath, args)
+    cpu_infer_dt = record_best_preds(net, data_loaders, mypath, args)
     tmp_dict = {}
     tmp_dict = compute_metrics(mypath, Path(args.eval_id), tmp_dict)
+    tmp_dict.update(cpu_infer_dt)
     log_params(tmp_dict)
     print('Finish all training/validation/testing + metrics!')
     log_dict.update(tmp_dict)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 8:52 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+"""Train the folds of a cross-validation concurrently on one multi-core machine, then merge their results.
+
+Each fold is trained by :func:`ssc_scoring.run.train` or :func:`ssc_scoring.run_pos.train` in its own process. The
+cores are split between the concurrent folds: every fold gets `--loader_workers` DataLoader workers and the remaining
+cores of its share as torch intra-op threads, so the folds do not oversubscribe the machine. The score folds share
+one on-disk slice cache and one memory-mapped packed slice store (see :mod:`ssc_scoring.mymodules.slice_cache`), which
+is built by the first fold and mapped by the others. The experiment IDs of all folds are merged by
+:func:`ssc_scoring.merge_4_fold_results.merge`.
+
+All unknown arguments are passed to `set_args.py` (`--project score`) or `set_args_pos.py` (`--project pos`).
+
+Usage:
+
+    python run_folds.py --project pos --folds 1 2 3 4 --cpus 32 --epochs=300 --remark="4 folds at once"
+
+"""
+import sys
+sys.path.append("..")
+
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Sequence, Tuple
+
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS']
+TRACKING_URI = "http://nodelogin02:5000"
+EXPERIMENT = {'score': 'ssc_scoring', 'pos': 'ssc_scoring_pos'}
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS/Windows
+        return os.cpu_count() or 1
+
+
+def fold_budget(cores: int, fold_workers: int, loader_workers: int = 0) -> Tuple[int, int]:
+    """Torch threads and DataLoader workers of each fold when `fold_workers` folds share `cores` cores.
+
+    Args:
+        cores: Number of cores of all folds.
+        fold_workers: Number of folds running at the same time.
+        loader_workers: DataLoader workers per fold. 0 means half of the cores of one fold.
+
+    Returns:
+        (threads, loader_workers). Both are at least 1.
+
+    """
+    per_fold = max(1, cores // max(1, fold_workers))
+    loader_workers = loader_workers if loader_workers > 0 else max(1, per_fold // 2)
+    threads = max(1, per_fold - loader_workers)
+    return threads, loader_workers
+
+
+def _project(project: str):
+    """`get_args`, `train` and the record file of `project`."""
+    if project == 'score':
+        from ssc_scoring.mymodules.set_args import get_args
+        from ssc_scoring.mymodules.path import PathScoreInit as PathInit
+        from ssc_scoring.run import train
+    else:
+        from ssc_scoring.mymodules.set_args_pos import get_args
+        from ssc_scoring.mymodules.path import PathPosInit as PathInit
+        from ssc_scoring.run_pos import train
+    return get_args, train, PathInit().record_file
+
+
+def run_fold(project: str, fold: int, argv: Sequence[str], threads: int, loader_workers: int,
+             parent_run_id: Optional[str] = None) -> int:
+    """Train one fold in the current (freshly spawned) process and return its experiment ID."""
+    for var in THREAD_ENV_VARS:  # before torch and numpy start their thread pools in this process
+        os.environ[var] = str(threads)
+    import torch
+    import mlflow
+    from ssc_scoring.mymodules.tool import record_1st
+    torch.set_num_threads(threads)
+
+    get_args, train, record_file = _project(project)
+    args = get_args(argv)
+    args.fold = fold
+    args.workers = loader_workers
+    if project == 'score':
+        args.slice_cache = 1  # all folds share the decoded slices
+    id_ = record_1st(record_file)  # the record file is locked, safe for concurrent folds
+    args.id = id_
+
+    mlflow.set_tracking_uri(TRACKING_URI)
+    mlflow.set_experiment(EXPERIMENT[project])
+    tags = {"mlflow.note.content": f"fold: {fold}"}
+    if parent_run_id:
+        tags["mlflow.parentRunId"] = parent_run_id  # nested run started from another process
+    with mlflow.start_run(run_name=str(id_) + '_fold_' + str(fold), tags=tags):
+        mlflow.log_params(vars(args))
+        print(f"fold {fold}: ID {id_}, {threads} torch threads, {loader_workers} dataloader workers")
+        if project == 'score':
+            train(args, id_, {})
+        else:
+            train(args)
+    return id_
+
+
+def run_folds(project: str, folds: Sequence[int], argv: Sequence[str], fold_workers: int = 0, cpus: int = 0,
+              loader_workers: int = 0, parent_run_id: Optional[str] = None) -> list:
+    """Train `folds` concurrently and return their experiment IDs in the order of `folds`.
+
+    Folds are run in spawned processes, so CUDA, torch thread pools and open files of this process are not inherited.
+
+    """
+    fold_workers = fold_workers if fold_workers > 0 else len(folds)
+    threads, loader_workers = fold_budget(cpus if cpus > 0 else available_cores(), fold_workers, loader_workers)
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=fold_workers, mp_context=ctx) as executor:
+        futures = [executor.submit(run_fold, project, fold, list(argv), threads, loader_workers, parent_run_id)
+                   for fold in folds]
+        return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the folds of a cross-validation concurrently.")
+    parser.add_argument('--project', choices=('score', 'pos'), help='score prediction (run.py) or position '
+                                                                     'prediction (run_pos.py)', type=str, default='pos')
+    parser.add_argument('--folds', help='folds to train', type=int, nargs='+', default=[1, 2, 3, 4])
+    parser.add_argument('--fold_workers', help='number of folds trained at the same time, 0 means all folds',
+                        type=int, default=0)
+    parser.add_argument('--cpus', help='number of cores used by all folds, 0 means all available cores', type=int,
+                        default=0)
+    parser.add_argument('--loader_workers', help='dataloader workers per fold, 0 means half of the cores of one fold',
+                        type=int, default=0)
+    parser.add_argument('--merge', choices=(1, 0), help='merge the results of all folds', type=int, default=1)
+    driver_args, argv = parser.parse_known_args()
+
+    import mlflow
+    from mlflow import log_params
+    from ssc_scoring.merge_4_fold_results import merge
+    from ssc_scoring.mymodules.tool import record_1st
+
+    get_args, _, record_file = _project(driver_args.project)
+    args = get_args(argv)  # check the arguments before any fold is started
+    mlflow.set_tracking_uri(TRACKING_URI)
+    mlflow.set_experiment(EXPERIMENT[driver_args.project])
+    id_ = record_1st(record_file)
+    with mlflow.start_run(run_name=str(id_), tags={"mlflow.note.content": args.remark}) as run:
+        tmp_args_dt = vars(args)
+        tmp_args_dt['fold'] = 'all'
+        log_params({**tmp_args_dt, **vars(driver_args)})
+
+        ids = run_folds(driver_args.project, driver_args.folds, argv, driver_args.fold_workers, driver_args.cpus,
+                        driver_args.loader_workers, run.info.run_id)
+        print(f"IDs of folds {driver_args.folds}: {ids}")
+        if driver_args.merge:
+            merge(driver_args.project == 'pos', ids)
+
+
+if __name__ == "__main__":
+    main()
@@ -263,7 +263,8 @@ def train(args):
 
     all_loader = LoadPos(args.resample_z, mypath, label_file, seed, args.fold, args.total_folds, args.ts_level_nb,
                          args.level_node,
-                         args.train_on_level, args.z_size, args.y_size, args.x_size, args.batch_size, args.workers)
+                         args.train_on_level, args.z_size, args.y_size, args.x_size, args.batch_size, args.workers,
+                         volume_cache=args.volume_cache, raw_volume=args.raw_volume)
     # train_dataloader, validaug_dataloader, valid_dataloader, test_dataloader = all_loader.load()
     data_dt = all_loader.load(nb=2)
 
@@ -296,9 +297,10 @@ def train(args):
     #                    'validaug': validaug_dataloader,
     #                    'test': test_dataloader}
     if args.kd != 'dist':
-        record_best_preds(net, data_dt, mypath, args)
+        cpu_infer_dt = record_best_preds(net, data_dt, mypath, args)
         log_dict = compute_metrics(mypath, PathPos(args.eval_id), {},
                                    modes=['train', 'valid', 'test', 'validaug'])
+        log_dict.update(cpu_infer_dt)
         log_params(log_dict)
 
     # data_dt['train']['ds'].shutdown()
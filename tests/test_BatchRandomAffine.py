@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 4:40 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+from ssc_scoring.mymodules.mytrans import BatchRandomAffine, BatchRandGaussianNoise
+
+import unittest
+
+from parameterized import parameterized
+import torch
+
+TEST_CASE_1 = [
+    {'degrees': 0, 'translate': (0, 0), 'scale': (1, 1)},  # identity
+    torch.arange(2 * 1 * 4 * 6, dtype=torch.float32).reshape(2, 1, 4, 6),
+]
+
+
+class TestBatchRandomAffine(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_1])
+    def test_BatchRandomAffine_identity(self, kwargs, batch):
+        result = BatchRandomAffine(**kwargs)(batch)
+        self.assertEqual(result.shape, batch.shape)
+        torch.testing.assert_close(result, batch)
+
+    def test_BatchRandomAffine_theta(self):
+        theta = BatchRandomAffine(degrees=0, translate=(0, 0), scale=(2, 2)).theta(3, 4, 6)
+        expected = torch.tensor([[0.5, 0, 0], [0, 0.5, 0]]).expand(3, 2, 3)  # zoom in 2 times
+        torch.testing.assert_close(theta, expected)
+
+    def test_BatchRandGaussianNoise(self):
+        batch = torch.zeros((3, 1, 8, 8))
+        torch.testing.assert_close(BatchRandGaussianNoise(prob=0.0)(batch), batch)
+        out = BatchRandGaussianNoise(prob=1.0, std=0.1)(batch)
+        self.assertEqual(out.shape, batch.shape)
+        self.assertTrue(bool((out != 0).any()))
+
+
+if __name__ == "__main__":
+    unittest.main()
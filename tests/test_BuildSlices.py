@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/20/26 3:05 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import pickle
+import os
+
+import numpy as np
+import pandas as pd
+import medutils.medutils as futil
+from ssc_scoring.build_slices import build, load_index, slice_indices
+
+
+def make_dataset(tempdir):
+    data_dir = os.path.join(tempdir, 'SSc_DeepLearning')
+    data = {'PatID': [1, 2]}
+    for level in [1, 2, 3, 4, 5]:
+        data[f'L{level}_pos'] = [3 * level, 3 * level + 1]
+    label_file = os.path.join(tempdir, 'GohScores.xlsx')
+    open(label_file, 'w').close()
+    with open(label_file + '.pkl', 'wb') as f:  # up-to-date cache, the excel file is not parsed
+        pickle.dump({'mtime_ns': os.stat(label_file).st_mtime_ns, 'df': pd.DataFrame(data).set_index('PatID')}, f)
+
+    for pat in ['Pat_001', 'Pat_002']:
+        ct = np.random.randint(-1500, 1500, (20, 16, 16)).astype(np.int16)
+        lung = np.zeros((20, 16, 16), dtype=np.uint8)
+        lung[2:18, 4:12, 3:13] = 1
+        futil.save_itk(os.path.join(data_dir, pat, 'CTimage.mha'), ct, (0, 0, 0), (1, 1, 1))
+        futil.save_itk(os.path.join(data_dir, pat, 'CTimage_lung.mha'), lung, (0, 0, 0), (1, 1, 1))
+    return data_dir, label_file
+
+
+class TestBuildSlices(unittest.TestCase):
+    def test_slice_indices(self):
+        indices = slice_indices([10.5, 20.75], ori_z=-2, sp_z=2.5)
+        self.assertEqual(indices, {'up': [4, 8], 'middle': [5, 9], 'down': [6, 10]})
+        self.assertEqual(slice_indices([10.5], -2, 2.5, up=1)['up'], [6])
+
+    def test_build(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            data_dir, label_file = make_dataset(tempdir)
+            products = ['slices', 'masked', 'lung_mask', 'weight_map']
+            self.assertEqual(build(data_dir, products, label_file, workers=2), 2)
+            self.assertEqual(build(data_dir, products, label_file), 0)  # up to date
+
+            pat_dir = os.path.join(data_dir, 'Pat_002')
+            ct = futil.load_itk(os.path.join(pat_dir, 'CTimage.mha'))
+            lung = futil.load_itk(os.path.join(pat_dir, 'CTimage_lung.mha')).astype(np.int16)
+            np.testing.assert_array_equal(futil.load_itk(os.path.join(pat_dir, 'Level2_middle.mha')), ct[7])
+            np.testing.assert_array_equal(futil.load_itk(os.path.join(pat_dir, 'Level2_up.mha')), ct[6])
+            np.testing.assert_array_equal(futil.load_itk(os.path.join(pat_dir, 'Level5_down_lung_mask.mha')),
+                                          lung[17])
+            np.testing.assert_array_equal(futil.load_itk(os.path.join(pat_dir, 'Level1_down_MaskedByLung.mha')),
+                                          lung[5] * ct[5] - (1 - lung[5]) * 2048)
+            weight_map = np.load(os.path.join(pat_dir, 'weight_map.npy'))
+            self.assertEqual(weight_map.shape, (16, 16))
+            self.assertTrue(np.all(weight_map[lung.max(0) == 0] == 0))
+
+            lung_fpath = os.path.join(data_dir, 'Pat_001', 'CTimage_lung.mha')
+            st = os.stat(lung_fpath)
+            os.utime(lung_fpath, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+            os.remove(os.path.join(pat_dir, 'Level3_up.mha'))
+            self.assertEqual(build(data_dir, products, label_file), 2)  # modified lung mask and missing slice
+            index = load_index(data_dir)
+            self.assertEqual(sorted(index['pats']), ['Pat_001', 'Pat_002'])
+            self.assertEqual(index['pats']['Pat_001']['weight_map']['lung'], os.stat(lung_fpath).st_mtime_ns)
+
+    def test_build_without_positions(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            data_dir, label_file = make_dataset(tempdir)
+            df = pd.DataFrame({'PatID': [1, 2], 'L1_disext': [0, 5]}).set_index('PatID')
+            with open(label_file + '.pkl', 'wb') as f:
+                pickle.dump({'mtime_ns': os.stat(label_file).st_mtime_ns, 'df': df}, f)
+            with self.assertRaisesRegex(KeyError, 'L1_pos'):
+                build(data_dir, ['masked'], label_file)
+            self.assertEqual(build(data_dir, ['weight_map'], label_file), 2)  # does not need positions
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 7:41 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import csv
+import os
+
+from parameterized import parameterized
+import numpy as np
+import medutils.medutils as futil
+from ssc_scoring.mymodules.mytrans import CorsePosTable, CoresPosd, get_corse_table, _corse_tables
+
+TEST_CASE_NO_HEADER = [False]
+TEST_CASE_HEADER = [True]
+
+
+class TestCorsePosTable(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_NO_HEADER, TEST_CASE_HEADER])
+    def test_CorsePosTable(self, data_header):
+        pred_world = np.array([[1, 2, 3, 4, 5], [11, 12, 13, 14, 15]])
+        with tempfile.TemporaryDirectory() as tempdir:
+            data_fpath = os.path.join(tempdir, 'valid_data.csv')
+            pred_world_fpath = os.path.join(tempdir, 'valid_pred_world.csv')
+            with open(data_fpath, 'w') as f:
+                writer = csv.writer(f)
+                if data_header:
+                    writer.writerow(['img_fpath', 'world_pos'])
+                writer.writerow(['/data/Pat_012_CTimage.mha', [0, 0, 0, 0, 0]])
+                writer.writerow(['/data/Pat_045_CTimage.mha', [0, 0, 0, 0, 0]])
+            futil.appendrows_to(pred_world_fpath, pred_world, head=['L1', 'L2', 'L3', 'L4', 'L5'])
+
+            table = CorsePosTable(data_fpath, pred_world_fpath)
+            self.assertEqual(len(table), 2)
+            self.assertEqual(table.row('/other/dir/Pat_045_CTimage.mha'), 1)
+            np.testing.assert_array_equal(table.pred('/data/Pat_012_CTimage.mha'), pred_world[0])
+            with self.assertRaises(Exception):
+                table.row('/data/Pat_099_CTimage.mha')
+
+            self.assertIs(get_corse_table(data_fpath, pred_world_fpath),
+                          get_corse_table(data_fpath, pred_world_fpath))  # built once
+            cores_posd = CoresPosd(corse_fpath=pred_world_fpath, data_fpath=data_fpath)
+            self.assertIs(cores_posd.corse_table, get_corse_table(data_fpath, pred_world_fpath))
+            out = cores_posd({'fpath_key': 'Pat_045.mha'})
+            np.testing.assert_array_equal(out['coarse_pred_world_key'], pred_world[1])
+
+            nb_tables = len(_corse_tables)
+            os.utime(pred_world_fpath, ns=(0, 0))  # modified
+            self.assertIsNot(get_corse_table(data_fpath, pred_world_fpath), cores_posd.corse_table)
+            self.assertEqual(len(_corse_tables), nb_tables)  # the old table is replaced
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/19/26 11:40 AM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+
+from parameterized import parameterized
+import torch
+import torch.nn as nn
+from ssc_scoring.mymodules.cpu_infer import CpuInfer, infer_threads
+
+NET_2D = nn.Sequential(nn.Conv2d(1, 8, 3), nn.ReLU(), nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(8, 3))
+NET_3D = nn.Sequential(nn.Conv3d(1, 8, 3), nn.ReLU(), nn.AdaptiveAvgPool3d(1), nn.Flatten(), nn.Linear(8, 5))
+
+TEST_CASE_2D = [NET_2D, (4, 1, 32, 32), torch.channels_last]
+TEST_CASE_3D = [NET_3D, (2, 1, 16, 24, 24), torch.channels_last_3d]
+
+
+class TestCpuInfer(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_2D, TEST_CASE_3D])
+    def test_CpuInfer(self, net, input_shape, memory_format):
+        x = torch.randn(input_shape)
+        with torch.no_grad():
+            expected = net.eval()(x)
+
+        net.train()
+        threads = torch.get_num_threads()
+        fp32 = CpuInfer(net, bf16=False, channels_last=True, threads=threads + 1)
+        self.assertEqual(fp32.memory_format, memory_format)
+        self.assertTrue(fp32.net[0].weight.is_contiguous(memory_format=memory_format))
+        pred = fp32(x)
+        self.assertFalse(pred.requires_grad)
+        # the network and the threads of the caller (e.g. the training) are not changed
+        self.assertTrue(net.training)
+        self.assertTrue(net[0].weight.is_contiguous())
+        self.assertEqual(torch.get_num_threads(), threads)
+        torch.testing.assert_close(pred, expected, rtol=1e-4, atol=1e-5)
+
+        pred_bf16 = CpuInfer(net, bf16=True, channels_last=True, threads=2)(x)
+        self.assertEqual(pred_bf16.dtype, torch.float32)
+        torch.testing.assert_close(pred_bf16, expected, rtol=5e-2, atol=5e-2)
+
+    def test_infer_threads(self):
+        self.assertEqual(infer_threads('cnn3fc1'), 4)
+        self.assertEqual(infer_threads('cnn3fc1', 2), 2)
+        self.assertGreaterEqual(infer_threads('vgg16_3d'), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
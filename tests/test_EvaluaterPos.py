@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 9:40 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import os
+from argparse import Namespace
+
+from parameterized import parameterized
+import numpy as np
+import pandas as pd
+import torch
+import medutils.medutils as futil
+from ssc_scoring.mymodules.inference import Evaluater_pos, sliding_windows
+
+
+class ZeroNet(torch.nn.Module):
+    """Predict 0 for each level of each patch, so the prediction of an image is the median start of its windows."""
+
+    def __init__(self):
+        super().__init__()
+        self.weight = torch.nn.Parameter(torch.zeros(1))
+
+    def forward(self, x):
+        return torch.zeros((len(x), 5)) * self.weight
+
+
+class TmpPath:
+    def __init__(self, tempdir):
+        self.tempdir = tempdir
+
+    def __getattr__(self, name):  # label, pred, pred_int, pred_world and world
+        return lambda mode: os.path.join(self.tempdir, mode + '_' + name + '.csv')
+
+
+TEST_CASE_1 = [4, 2]  # several images per batch, several batches per image
+TEST_CASE_2 = [1, 3]
+
+
+class TestEvaluaterPos(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_1, TEST_CASE_2])
+    def test_run(self, infer_batch_size, loader_batch_size):
+        args = Namespace(train_on_level=0, level_node=0, infer_2nd=0, z_size=10, infer_stride=8,
+                         infer_batch_size=infer_batch_size, batch_size=1, cpu_infer=0)
+        world_pos = np.array([2, 12, 16, 20, 24])  # origin 0, spacing 1
+        with tempfile.TemporaryDirectory() as tempdir:
+            scans = []
+            for i, z in enumerate([30, 26, 34, 27, 41]):  # 3, 3, 4, 3 and 5 windows
+                fpath = os.path.join(tempdir, 'Pat_00' + str(i) + '_CTimage.mha')
+                futil.save_itk(fpath, np.random.randint(-1500, 1500, (z, 4, 5)).astype(np.int16), (0, 0, 0),
+                               (1, 1, 1))
+                scans.append(fpath)
+
+            dataloader = []
+            for i in range(0, len(scans), loader_batch_size):
+                fpaths = scans[i: i + loader_batch_size]
+                n = len(fpaths)
+                dataloader.append({'image_key': torch.zeros((n, 1, 1, 1)), 'fpath_key': fpaths,
+                                   'ori_world_key': torch.tensor(np.tile(world_pos, (n, 1))),
+                                   'world_key': torch.tensor(np.tile(world_pos, (n, 1))),
+                                   'label_in_img_key': torch.tensor(np.tile(world_pos, (n, 1))),
+                                   'space_key': torch.ones((n, 3)), 'origin_key': torch.zeros((n, 3))})
+
+            Evaluater_pos(ZeroNet(), dataloader, 'valid', TmpPath(tempdir), args).run()
+            preds = pd.read_csv(os.path.join(tempdir, 'valid_pred.csv')).values
+            labels = pd.read_csv(os.path.join(tempdir, 'valid_label.csv')).values
+
+            expected = [np.median(sliding_windows(fpath, world_pos, z_size=10, stride=8, args=args)[2])
+                        for fpath in scans]
+        np.testing.assert_allclose(preds, np.tile(np.array(expected).reshape(-1, 1), (1, 5)))
+        np.testing.assert_array_equal(labels, np.tile(world_pos, (len(scans), 1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/20/26 11:30 AM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import os
+
+from parameterized import parameterized
+import numpy as np
+from scipy.ndimage import morphology
+import medutils.medutils as futil
+from ssc_scoring.extract_lung import dilate, erode, extract, largest_connected_parts, lung_fpath
+
+TEST_CASE_1 = [3]
+TEST_CASE_2 = [6]
+
+
+def synthetic_ct():
+    """A body of soft tissue with 2 lungs of air, surrounded by air."""
+    ct = np.full((40, 32, 32), -1000, dtype=np.int16)
+    ct[:, 4:28, 2:30] = 40
+    ct[12:30, 10:22, 8:13] = -850
+    ct[12:30, 10:22, 19:24] = -850
+    return ct
+
+
+class TestExtractLung(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_1, TEST_CASE_2])
+    def test_morphology(self, size):
+        mask = (np.random.rand(20, 18, 16) > 0.7).astype(np.uint8)
+        structure = np.ones((size, size, size))
+        expected_dia = morphology.binary_dilation(mask, structure)
+        np.testing.assert_array_equal(dilate(mask, size), expected_dia)
+        np.testing.assert_array_equal(erode(expected_dia, size), morphology.binary_erosion(expected_dia, structure))
+        self.assertEqual(dilate(mask, size).dtype, np.uint8)
+
+    def test_largest_connected_parts(self):
+        bw_img = np.zeros((30, 20, 20), dtype=np.uint8)
+        bw_img[:, :, :3] = 1  # touches the outside
+        bw_img[12:20, 5:15, 5:9] = 1
+        bw_img[12:20, 5:15, 11:16] = 1
+        bw_img[14, 2, 10] = 1  # too small
+        out = largest_connected_parts(bw_img.copy(), 2)
+        expected = np.zeros_like(bw_img)
+        expected[12:20, 5:15, 5:9] = 1
+        expected[12:20, 5:15, 11:16] = 1
+        np.testing.assert_array_equal(out, expected)
+
+    def test_extract(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            scans = [os.path.join(tempdir, pat, 'CTimage.mha') for pat in ['Pat_001', 'Pat_002']]
+            for scan in scans:
+                futil.save_itk(scan, synthetic_ct(), (0, 0, 0), (1, 1, 1))
+
+            self.assertEqual(extract(scans, workers=2), [lung_fpath(scan) for scan in scans])
+            self.assertEqual(extract(scans), [])  # up to date
+            lung = futil.load_itk(lung_fpath(scans[0]))
+            self.assertEqual(lung.shape, (40, 32, 32))
+            self.assertTrue(lung[20, 16, 10] > 0 and lung[20, 16, 21] > 0)
+            self.assertEqual(lung[20, 2, 2], 0)
+            self.assertEqual(lung[20, 16, 16], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 9:14 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+
+from parameterized import parameterized
+from ssc_scoring.run_folds import fold_budget
+
+TEST_CASE_1 = [32, 4, 0, (4, 4)]
+TEST_CASE_2 = [32, 4, 2, (6, 2)]
+TEST_CASE_3 = [2, 4, 0, (1, 1)]  # fewer cores than folds
+TEST_CASE_4 = [24, 1, 6, (18, 6)]
+
+
+class TestFoldBudget(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_1, TEST_CASE_2, TEST_CASE_3, TEST_CASE_4])
+    def test_fold_budget(self, cores, fold_workers, loader_workers, expected):
+        threads, workers = fold_budget(cores, fold_workers, loader_workers)
+        self.assertEqual((threads, workers), expected)
+        if cores >= fold_workers * 2:
+            self.assertLessEqual((threads + workers) * fold_workers, cores)  # no oversubscription
+
+
+if __name__ == "__main__":
+    unittest.main()
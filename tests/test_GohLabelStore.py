@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 3:58 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import pickle
+import os
+
+import numpy as np
+import pandas as pd
+from ssc_scoring.mymodules.label_store import GohLabelStore
+
+
+class TestGohLabelStore(unittest.TestCase):
+    def test_GohLabelStore(self):
+        data = {'PatID': [3, 7]}
+        for level in [1, 2, 3, 4, 5]:
+            data[f'L{level}_disext'] = [level, 10 * level]
+            data[f'L{level}_gg'] = [level + 1, 10 * level + 1]
+            data[f'L{level}_retp'] = [level + 2, 10 * level + 2]
+            data[f'L{level}_pos'] = [100 * level, 200 * level]
+        df = pd.DataFrame(data).set_index('PatID')
+        with tempfile.TemporaryDirectory() as tempdir:
+            label_file = os.path.join(tempdir, 'GohScores.xlsx')
+            open(label_file, 'w').close()
+            with open(label_file + '.pkl', 'wb') as f:  # up-to-date cache, the excel file is not parsed
+                pickle.dump({'mtime_ns': os.stat(label_file).st_mtime_ns, 'df': df}, f)
+
+            store = GohLabelStore(label_file)
+            np.testing.assert_array_equal(store.pat_ids, [3, 7])
+            scores = store.scores([7, 3])
+            self.assertEqual(scores.shape, (2, 5, 3))
+            np.testing.assert_array_equal(scores[0, 1], [20, 21, 22])
+            np.testing.assert_array_equal(scores[1, 4], [5, 6, 7])
+            np.testing.assert_array_equal(store.positions([3]), [[100, 200, 300, 400, 500]])
+            with self.assertRaises(Exception):
+                store.scores([8])
+
+    def test_missing_columns(self):
+        df = pd.DataFrame({'PatID': [3, 7], 'L1_pos': [100, 200]}).set_index('PatID')
+        with tempfile.TemporaryDirectory() as tempdir:
+            label_file = os.path.join(tempdir, 'GohScores.xlsx')
+            open(label_file, 'w').close()
+            with open(label_file + '.pkl', 'wb') as f:
+                pickle.dump({'mtime_ns': os.stat(label_file).st_mtime_ns, 'df': df}, f)
+
+            store = GohLabelStore(label_file)
+            with self.assertRaisesRegex(KeyError, 'L2_pos'):
+                store.positions([3])
+            with self.assertRaisesRegex(KeyError, 'L1_disext'):
+                store.scores([3])
+
+
+if __name__ == "__main__":
+    unittest.main()
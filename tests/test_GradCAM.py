@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/20/26 10:15 AM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+
+from parameterized import parameterized
+import torch
+import torch.nn as nn
+from ssc_scoring.mymodules.cam import grad_cams
+
+TEST_CASE_1 = [True]
+TEST_CASE_2 = [False]
+
+
+def tiny_net():
+    torch.manual_seed(0)
+    features = nn.Sequential(nn.Conv3d(1, 4, 3, padding=1), nn.ReLU(), nn.Conv3d(4, 6, 3, stride=2, padding=1))
+    head = nn.Sequential(nn.ReLU(), nn.AdaptiveAvgPool3d(2), nn.Flatten(), nn.Linear(48, 5))
+    return features.eval(), head.eval()
+
+
+def loop_grad_cams(features, head, images):
+    """One scan and one backward pass per target, as GradCAM.run did before the batched mode."""
+    cams = []
+    for img in images:
+        fmap = features(img[None])
+        fmap.retain_grad()
+        output = head(fmap)
+        cams_one = []
+        for target in range(output.shape[1]):
+            fmap.grad = None
+            output[0, target].backward(retain_graph=True)
+            cam = (fmap.grad.mean(1) * fmap.mean(1))[0].detach()
+            cams_one.append((cam - cam.min()) / (cam.max() - cam.min()) * 256)
+        cams.append(torch.stack(cams_one))
+    return torch.stack(cams)
+
+
+class TestGradCAM(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_1, TEST_CASE_2])
+    def test_grad_cams(self, batched):
+        features, head = tiny_net()
+        images = torch.rand((3, 1, 8, 10, 12))
+        fmap = features(images)
+        cams = grad_cams(head(fmap), fmap, batched=batched)
+        self.assertEqual(cams.shape, (3, 5, 4, 5, 6))
+        torch.testing.assert_close(cams, loop_grad_cams(features, head, images), rtol=1e-4, atol=1e-3)
+
+    def test_grad_cams_resize(self):
+        features, head = tiny_net()
+        images = torch.rand((2, 1, 8, 10, 12))
+        fmap = features(images)
+        cams = grad_cams(head(fmap), fmap, size=images.shape[2:])
+        self.assertEqual(cams.shape, (2, 5, 8, 10, 12))
+        self.assertAlmostEqual(float(cams.min()), 0, places=4)
+        self.assertAlmostEqual(float(cams.max()), 256, places=3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 11:55 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+
+from parameterized import parameterized
+import numpy as np
+import torch
+from monai.transforms import ScaleIntensityRange
+from ssc_scoring.mymodules.intensity import clip_cast, clip_scale, standardize
+from ssc_scoring.mymodules.mytrans import NormImgPosd
+
+TEST_CASE_INT = [np.random.randint(-3000, 3000, (20, 30, 40)).astype(np.int16)]
+TEST_CASE_FLOAT = [np.random.uniform(-3000, 3000, (20, 30, 40)).astype(np.float64)]
+
+
+class TestIntensity(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_INT, TEST_CASE_FLOAT])
+    def test_clip_cast_scale(self, x):
+        out = clip_cast(x, -1500, 1500)
+        self.assertEqual(out.dtype, np.float32)
+        np.testing.assert_array_equal(out, np.clip(x, -1500, 1500).astype(np.float32))
+
+        expected = np.asarray(ScaleIntensityRange(a_min=-1500.0, a_max=1500.0, b_min=0.0, b_max=1.0, clip=True)(x))
+        np.testing.assert_allclose(clip_scale(x, -1500, 1500, 0, 1), expected, rtol=1e-6, atol=1e-6)
+
+    @parameterized.expand([TEST_CASE_INT, TEST_CASE_FLOAT])
+    def test_standardize(self, x):
+        x = x.astype(np.float32)
+        expected = (x.astype(np.float64) - x.mean(dtype=np.float64)) / x.std(dtype=np.float64)
+        np.testing.assert_allclose(standardize(x), expected, rtol=1e-4, atol=1e-4)
+        x_t = torch.from_numpy(x.copy())
+        np.testing.assert_allclose(standardize(x_t, unbiased=True).numpy(), ((x_t - x_t.mean()) / x_t.std()).numpy(),
+                                   rtol=1e-4, atol=1e-4)
+
+        view = x[2:10]  # a view, e.g. a patch of a cached image, is not modified
+        before = view.copy()
+        out = NormImgPosd()({'image_key': view})['image_key']
+        np.testing.assert_array_equal(view, before)
+        self.assertAlmostEqual(float(out.mean()), 0, places=4)
+
+        patch = x[2:10].copy()  # a patch owning its memory is normalized in place
+        out = NormImgPosd()({'image_key': patch})['image_key']
+        self.assertIs(out, patch)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/19/26 2:10 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+
+import cv2
+from parameterized import parameterized
+import numpy as np
+import torch
+import torch.nn as nn
+from ssc_scoring.mymodules.occlusion import occlusion_maps, occlusion_positions
+
+TEST_CASE_1 = [8, 4, 7]
+TEST_CASE_2 = [6, 3, 0]
+
+
+def loop_occlusion_maps(net, x, occ_patch, lung_mask, patch_size, stride):
+    """One cv2.blur and one forward pass per position, as in occlusion_sensitivity.py before the batched engine."""
+    w, h = x.shape
+    with torch.no_grad():
+        out_ori = net(torch.tensor(x).float()[None, None]).numpy()[0]
+        maps, weight = np.zeros((len(out_ori), w, h)), np.zeros((w, h))
+        for i in range(0, w, stride):
+            for j in range(0, h, stride):
+                mask_ori = np.zeros((w, h))
+                mask_ori[i: i + patch_size, j: j + patch_size] = 1
+                mask_ori = mask_ori * lung_mask
+                mask = cv2.blur(mask_ori, (5, 5))
+                tmp = x * (1 - mask) + occ_patch * mask
+                out = net(torch.tensor(tmp).float()[None, None]).numpy()[0]
+                maps[:, mask_ori > 0] += (out - out_ori)[:, None]
+                weight[mask_ori > 0] += 1
+    weight[weight == 0] = 1
+    return maps / weight, out_ori
+
+
+class TestOcclusion(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_1, TEST_CASE_2])
+    def test_occlusion_maps(self, patch_size, stride, batch_size):
+        torch.manual_seed(0)
+        net = nn.Sequential(nn.Conv2d(1, 4, 3), nn.ReLU(), nn.AdaptiveAvgPool2d(2), nn.Flatten(), nn.Linear(16, 3))
+        net.eval()
+        x = np.random.rand(32, 32)
+        occ_patch = np.random.rand(32, 32)
+        yy, xx = np.mgrid[:32, :32]
+        lung_mask = ((yy - 14) ** 2 + (xx - 18) ** 2 < 64).astype(float)
+
+        maps, out_ori, positions, outs = occlusion_maps(net, x[None], occ_patch, lung_mask, patch_size, stride,
+                                                        batch_size=batch_size, device=torch.device('cpu'))
+        expected_maps, expected_out = loop_occlusion_maps(net, x, occ_patch, lung_mask, patch_size, stride)
+        np.testing.assert_allclose(out_ori, expected_out, rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(maps, expected_maps, rtol=1e-4, atol=1e-5)
+        self.assertEqual(outs.shape, (len(positions), 3))
+        self.assertTrue(np.all(maps[:, lung_mask == 0] == 0))
+
+    def test_occlusion_positions(self):
+        lung_mask = torch.zeros((16, 16))
+        lung_mask[9, 9] = 1
+        positions = occlusion_positions(lung_mask, patch_size=4, stride=2)
+        np.testing.assert_array_equal(positions.numpy(), [[6, 6], [6, 8], [8, 6], [8, 8]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/19/26 4:40 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import os
+
+from parameterized import parameterized
+import numpy as np
+from ssc_scoring.mymodules.occlusion_store import OcclusionStore, INDEX_FNAME
+
+PARAMS = {'net_id': 1903, 'model_mtime_ns': 1, 'patch_size': 64, 'stride': 16, 'occ_status': 'healthy'}
+TEST_CASE_1 = [5, 2]
+TEST_CASE_2 = [3, 16]
+
+
+class TestOcclusionStore(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_1, TEST_CASE_2])
+    def test_OcclusionStore(self, nb_slices, chunk_size):
+        with tempfile.TemporaryDirectory() as tempdir:
+            store_dir = os.path.join(tempdir, 'store')
+            store = OcclusionStore(store_dir, PARAMS, chunk_size)
+            expected = {}
+            for i in range(nb_slices):
+                key = f"Pat_00{i}/Level1"
+                maps, image = np.random.rand(3, 8, 10), np.random.rand(1, 8, 10)
+                lung = (np.random.rand(8, 10) > 0.5).astype(float)
+                store.add(key, maps, image, lung, {'label': [i, 0, 0], 'pred': [i + 0.5, 0, 0]})
+                expected[key] = (maps, image, lung)
+                self.assertIn(key, store)
+            store.flush()
+            self.assertEqual(len(os.listdir(store_dir)), 1 + 3 * int(np.ceil(nb_slices / chunk_size)))
+
+            store = OcclusionStore(store_dir, PARAMS)  # reopened, nothing to compute again
+            self.assertEqual(store.keys(), sorted(expected))
+            for key, (maps, image, lung) in expected.items():
+                maps_, image_, lung_, meta = store.get(key)
+                np.testing.assert_allclose(maps_, maps, rtol=1e-6)
+                np.testing.assert_allclose(image_, image[0], rtol=1e-6)
+                np.testing.assert_array_equal(lung_, lung)
+                self.assertEqual(meta['pred'][0], meta['label'][0] + 0.5)
+
+            store = OcclusionStore(store_dir, {**PARAMS, 'stride': 8})  # other setting, start anew
+            self.assertEqual(len(store), 0)
+            self.assertEqual(len(OcclusionStore(store_dir)), 0)  # readers do not see the old maps
+            self.assertTrue(os.path.isfile(os.path.join(store_dir, INDEX_FNAME)))
+
+
+if __name__ == "__main__":
+    unittest.main()
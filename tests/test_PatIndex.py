@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 2:58 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import os
+
+from ssc_scoring.mymodules.pat_index import load_pat_index, is_stale
+
+
+def touch(fpath):
+    open(fpath, 'w').close()
+
+
+class TestPatIndex(unittest.TestCase):
+    def test_load_pat_index(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            pat_dir = os.path.join(tempdir, 'Pat_001')
+            os.makedirs(pat_dir)
+            for pos in ['up', 'middle', 'down']:
+                touch(os.path.join(pat_dir, 'Level1_' + pos + '.mha'))
+                touch(os.path.join(pat_dir, 'Level1_' + pos + '_MaskedByLung.mha'))
+            touch(os.path.join(pat_dir, 'weight_map.npy'))
+
+            index = load_pat_index(tempdir)
+            self.assertTrue(os.path.isfile(os.path.join(tempdir, 'pat_index.json')))
+            level = index['pats']['Pat_001']['levels']['1']
+            self.assertEqual(level['up'], os.path.join(pat_dir, 'Level1_up.mha'))
+            self.assertEqual(level['down_MaskedByLung'], os.path.join(pat_dir, 'Level1_down_MaskedByLung.mha'))
+            self.assertEqual(index['pats']['Pat_001']['weight_map'], os.path.join(pat_dir, 'weight_map.npy'))
+            self.assertFalse(is_stale(load_pat_index(tempdir), tempdir))
+
+            os.makedirs(os.path.join(tempdir, 'Pat_002'))  # new patient
+            self.assertTrue(is_stale(index, tempdir))
+            self.assertIn('Pat_002', load_pat_index(tempdir)['pats'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 8:31 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import os
+
+from parameterized import parameterized
+import numpy as np
+import pandas as pd
+from ssc_scoring.mymodules.pred_writer import PredWriter, npz_fpath_of, npz_is_fresh
+from ssc_scoring.mymodules.confusion_test import read_check
+
+TEST_CASE_SCORE = [['disext', 'gg', 'retp'], [np.array([[5, 10, 0], [20, 5, 15]]), np.array([[0, 0, 0]])]]
+TEST_CASE_POS = [['L1', 'L2', 'L3', 'L4', 'L5'], [np.array([1.5, 2., 3., 4., 5.]), np.array([6., 7., 8., 9., 10.5])]]
+
+
+class TestPredWriter(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_SCORE, TEST_CASE_POS])
+    def test_PredWriter(self, head, batches):
+        expected = np.concatenate([batch.reshape(-1, len(head)) for batch in batches])
+        with tempfile.TemporaryDirectory() as tempdir:
+            fpath = os.path.join(tempdir, 'valid_pred.csv')
+            writer = PredWriter()
+            for batch in batches:
+                writer.append(fpath, batch, head=head)
+            self.assertFalse(os.path.isfile(fpath))  # nothing is written before flush
+            writer.flush()
+
+            df_csv = pd.read_csv(fpath)
+            self.assertEqual(list(df_csv.columns), head)
+            np.testing.assert_allclose(df_csv.to_numpy(), expected)
+
+            writer.append(fpath, batches[0], head=head)  # append to existing files
+            writer.flush()
+            expected = np.concatenate([expected, batches[0].reshape(-1, len(head))])
+            np.testing.assert_allclose(pd.read_csv(fpath).to_numpy(), expected)
+            self.assertTrue(os.path.isfile(npz_fpath_of(fpath)))
+            df = read_check(fpath)  # read from the npz file
+            self.assertEqual(list(df.columns), head)
+            np.testing.assert_allclose(df.to_numpy(), expected)
+
+            with open(fpath, 'a') as f:  # csv file appended by others, the npz file is out of date
+                f.write(','.join(['1'] * len(head)) + '\n')
+            npz_mtime_ns = os.stat(npz_fpath_of(fpath)).st_mtime_ns
+            os.utime(fpath, ns=(npz_mtime_ns, npz_mtime_ns + 10 ** 9))
+            self.assertEqual(len(read_check(fpath)), len(expected) + 1)
+
+            fpath = os.path.join(tempdir, 'test_pred.csv')
+            writer.append(fpath, batches[0], head=head)
+            writer.flush()
+            self.assertTrue(npz_is_fresh(fpath))
+            os.remove(fpath)  # the npz file of a deleted csv file is not up to date
+            self.assertFalse(npz_is_fresh(fpath))
+
+
+if __name__ == "__main__":
+    unittest.main()
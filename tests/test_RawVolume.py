@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 10:46 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import os
+
+from parameterized import parameterized
+import numpy as np
+import medutils.medutils as futil
+from ssc_scoring.mymodules.raw_volume import convert_all_to_raw, is_converted, load_raw_volume, raw_fpath
+from ssc_scoring.mymodules.mytrans import LoadDatad
+from ssc_scoring.mymodules.composed_trans import xformd_pos
+
+TEST_CASE_INT = [np.int16, np.int16]
+TEST_CASE_FLOAT = [np.float32, np.float32]
+
+
+class TestRawVolume(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_INT, TEST_CASE_FLOAT])
+    def test_RawVolume(self, img_dtype, raw_dtype):
+        with tempfile.TemporaryDirectory() as tempdir:
+            img = np.random.randint(-3000, 3000, (30, 40, 50)).astype(img_dtype)
+            fpath = os.path.join(tempdir, 'Pat_001_CTimage.mha')
+            futil.save_itk(fpath, img, (-100, 2, 3), (1, 0.5, 0.5), dtype=img_dtype)
+            self.assertFalse(is_converted(fpath))
+            self.assertEqual(convert_all_to_raw([fpath, fpath]), 1)
+            self.assertEqual(convert_all_to_raw([fpath]), 0)  # up to date, not converted again
+            self.assertTrue(os.path.isfile(raw_fpath(fpath)))
+
+            x, ori, sp = load_raw_volume(fpath)
+            self.assertIsInstance(x, np.memmap)
+            self.assertEqual(x.dtype, raw_dtype)
+            data = {'fpath_key': fpath, 'world_key': np.array([-90, -85, -80, -75, -70])}
+            expected = LoadDatad()(dict(data))
+            np.testing.assert_array_equal(x, expected['image_key'])
+            np.testing.assert_allclose(ori, expected['origin_key'])
+            np.testing.assert_allclose(sp, expected['space_key'])
+
+            out_raw = xformd_pos('valid', z_size=20, y_size=30, x_size=30, raw_volume=True)(dict(data))
+            out = xformd_pos('valid', z_size=20, y_size=30, x_size=30)(dict(data))
+            self.assertEqual(out_raw['image_key'].dtype, np.float32)
+            np.testing.assert_allclose(out_raw['image_key'], out['image_key'], rtol=1e-5, atol=1e-5)
+            out_level = xformd_pos('train', train_on_level=2, z_size=20, raw_volume=True)(dict(data))
+            self.assertEqual(out_level['image_key'].shape, (1, 20, 40, 50))
+
+            st = os.stat(fpath)
+            os.utime(fpath, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))  # the scan is changed
+            self.assertFalse(is_converted(fpath))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/19/26 9:40 AM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import os
+
+from parameterized import parameterized
+import numpy as np
+import medutils.medutils as futil
+from ssc_scoring.resample_dataset import resample_dataset, load_index, INDEX_FNAME
+
+TEST_CASE_INT = ['int16', (16, 12, 10), np.int16]
+TEST_CASE_FLOAT = ['float32', (20, 8, 8), np.float32]
+
+
+class TestResampleDataset(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_INT, TEST_CASE_FLOAT])
+    def test_ResampleDataset(self, dtype, shape, np_dtype):
+        with tempfile.TemporaryDirectory() as tempdir:
+            src_dir, dst_dir = os.path.join(tempdir, 'src'), os.path.join(tempdir, 'dst')
+            for pat in ['Pat_001', 'Pat_002']:
+                img = np.random.randint(-3000, 3000, (30, 24, 20)).astype(np.int16)
+                futil.save_itk(os.path.join(src_dir, pat, 'CTimage.mha'), img, (-100, 2, 3), (1, 0.5, 0.5))
+
+            self.assertEqual(resample_dataset(src_dir, dst_dir, shape, dtype, workers=2), 2)
+            self.assertEqual(resample_dataset(src_dir, dst_dir, shape, dtype), 0)  # up to date
+
+            index = load_index(dst_dir)
+            self.assertEqual(sorted(index['scans']), [os.path.join('Pat_001', 'CTimage.mha'),
+                                                      os.path.join('Pat_002', 'CTimage.mha')])
+            x, ori, sp = futil.load_itk(os.path.join(dst_dir, 'Pat_001', 'CTimage.mha'), require_ori_sp=True)
+            self.assertEqual(x.shape, shape)
+            self.assertEqual(x.dtype, np_dtype)
+            self.assertTrue(x.min() >= -1500 and x.max() <= 1500)
+            entry = index['scans'][os.path.join('Pat_001', 'CTimage.mha')]
+            np.testing.assert_allclose(entry['origin'], ori, rtol=1e-5)
+            np.testing.assert_allclose(entry['space'], sp, rtol=1e-5)
+            np.testing.assert_allclose(np.array(entry['space']) * shape, np.array([1, 0.5, 0.5]) * (30, 24, 20),
+                                       rtol=1e-5)  # same physical extent
+
+            src_fpath = os.path.join(src_dir, 'Pat_002', 'CTimage.mha')
+            st = os.stat(src_fpath)
+            os.utime(src_fpath, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+            self.assertEqual(resample_dataset(src_dir, dst_dir, shape, dtype), 1)  # only the modified scan
+            self.assertTrue(os.path.isfile(os.path.join(dst_dir, INDEX_FNAME)))
+
+
+if __name__ == "__main__":
+    unittest.main()
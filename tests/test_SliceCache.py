@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 10:31 AM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import os
+
+import numpy as np
+import medutils.medutils as futil
+from ssc_scoring.mymodules.slice_cache import SliceCache, pack_slice_records
+
+
+class TestSliceCache(unittest.TestCase):
+    def test_SliceCache(self):
+        img = np.array([[-3000, -1500], [0, 3000]]).astype(np.int16)
+        expected_img = np.array([[0, 0], [0.5, 1]]).astype(np.float32)
+        with tempfile.TemporaryDirectory() as tempdir:
+            fpath = os.path.join(tempdir, 'Pat_001', 'Level1_up.mha')
+            os.makedirs(os.path.dirname(fpath))
+            futil.save_itk(fpath, img, (2, 3), (0.3, 0.3))
+            futil.save_itk(fpath.split('.mha')[0] + '_lung_mask.mha', np.ones((2, 2)), (2, 3), (0.3, 0.3))
+            np.save(os.path.join(tempdir, 'Pat_001', 'weight_map.npy'), np.ones((2, 2)))
+
+            cache = SliceCache(os.path.join(tempdir, 'cache'))
+            cold = cache.get(fpath, require_lung_mask=True)
+            warm = cache.get(fpath, require_lung_mask=True)
+            self.assertEqual((cache.misses, cache.hits), (1, 1))
+            self.assertEqual(set(warm.keys()), {'image', 'origin', 'space', 'weight_map', 'lung_mask'})
+            for k in cold.keys():
+                np.testing.assert_allclose(cold[k], warm[k])
+            np.testing.assert_allclose(warm['image'], expected_img)
+            self.assertEqual(warm['image'].dtype, np.float32)
+
+            os.utime(fpath, ns=(0, 0))  # source changed, the entry is rebuilt
+            cache.get(fpath, require_lung_mask=True)
+            self.assertEqual(cache.misses, 2)
+
+    def test_pack_slice_records(self):
+        fpaths = ['Pat_001/Level1_up.mha', 'Pat_001/Level1_down.mha', 'Pat_002/Level1_up.mha']
+        records = [{'image': np.ones((2, 2), dtype=np.float32) * i,
+                    'origin': np.array([i, 0]),
+                    'space': np.array([1, 1]),
+                    'weight_map': np.ones((2, 2)) * int(fpath.startswith('Pat_002'))} for i, fpath in enumerate(fpaths)]
+        packed = pack_slice_records(fpaths, records)
+        self.assertEqual(packed['image'].shape, (3, 2, 2))
+        self.assertEqual(packed['weight_map'].shape, (2, 2, 2))  # one weight map per patient
+        np.testing.assert_array_equal(packed['weight_map_idx'], [0, 0, 1])
+        np.testing.assert_array_equal(packed['origin'][:, 0], [0, 1, 2])
+        self.assertEqual(packed['lung_mask'].shape, (0,))
+
+    def test_pack_empty_records(self):
+        packed = pack_slice_records([], [])
+        self.assertEqual(sorted(packed), ['image', 'lung_mask', 'origin', 'space', 'weight_map', 'weight_map_idx'])
+        self.assertEqual(len(packed['lung_mask']), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 6:58 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import os
+from argparse import Namespace
+
+from parameterized import parameterized
+import numpy as np
+import medutils.medutils as futil
+from ssc_scoring.mymodules.inference import SlidingLoader, PooledSlidingLoader
+
+TEST_CASE_1 = [Namespace(train_on_level=0, level_node=0, infer_2nd=0), 3, [0, 3, 6, 9, 12, 15, 18], 5]
+TEST_CASE_2 = [Namespace(train_on_level=2, level_node=0, infer_2nd=0), 2, [2, 4, 6, 8, 10], 1]
+
+
+class TestSlidingLoader(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_1, TEST_CASE_2])
+    def test_SlidingLoader(self, args, batch_size, expected_starts, nb_levels):
+        img = np.random.randint(-1500, 1500, (30, 4, 5)).astype(np.int16)
+        world_pos = np.array([2, 12, 16, 20, 24])  # origin 0, spacing 1
+        with tempfile.TemporaryDirectory() as tempdir:
+            fpath = os.path.join(tempdir, 'Pat_001_CTimage.mha')
+            futil.save_itk(fpath, img, (0, 0, 0), (1, 1, 1))
+            patches, labels, starts = [], [], []
+            for patch, new_label, start in SlidingLoader(fpath, world_pos, z_size=10, stride=args.train_on_level or 3,
+                                                         batch_size=batch_size, args=args):
+                self.assertLessEqual(len(patch), batch_size)
+                patches.append(patch.clone().numpy())
+                labels.append(new_label.numpy())
+                starts.append(start.numpy())
+
+        starts = np.concatenate(starts)
+        np.testing.assert_array_equal(starts, expected_starts)
+        norm_img = (img - img.mean()) / img.std()
+        for patch, start in zip(np.concatenate(patches), starts):
+            self.assertEqual(patch.shape, (1, 10, 4, 5))
+            np.testing.assert_allclose(patch[0], norm_img[start: start + 10], rtol=1e-4, atol=1e-4)
+        labels = np.concatenate(labels)
+        self.assertEqual(labels.shape, (len(starts), nb_levels))
+        np.testing.assert_allclose(labels + starts.reshape(-1, 1), np.tile(world_pos[:nb_levels] if nb_levels == 5
+                                                                           else world_pos[1:2], (len(starts), 1)))
+
+    @parameterized.expand([TEST_CASE_1, TEST_CASE_2])
+    def test_PooledSlidingLoader(self, args, batch_size, expected_starts, nb_levels):
+        world_pos = np.array([2, 12, 16, 20, 24])  # origin 0, spacing 1
+        stride = args.train_on_level or 3
+        with tempfile.TemporaryDirectory() as tempdir:
+            scans = []
+            for i, shape in enumerate([(30, 4, 5), (26, 4, 5), (30, 6, 5)]):  # the last one can not be pooled
+                fpath = os.path.join(tempdir, 'Pat_00' + str(i) + '_CTimage.mha')
+                futil.save_itk(fpath, np.random.randint(-1500, 1500, shape).astype(np.int16), (0, 0, 0), (1, 1, 1))
+                scans.append((fpath, world_pos))
+
+            expected = []  # windows of each image alone
+            for owner, (fpath, world) in enumerate(scans):
+                for patch, new_label, start in SlidingLoader(fpath, world, z_size=10, stride=stride,
+                                                             batch_size=batch_size, args=args):
+                    expected.extend(zip(patch.clone().numpy(), new_label.numpy(), start.numpy(),
+                                        [owner] * len(start)))
+
+            pooled, batch_lens = [], []
+            for patch, new_label, start, owner in PooledSlidingLoader(scans, z_size=10, stride=stride,
+                                                                      batch_size=batch_size, args=args):
+                batch_lens.append(len(patch))
+                pooled.extend(zip(patch.clone().numpy(), new_label.numpy(), start.numpy(), owner.numpy()))
+
+        self.assertEqual(len(pooled), len(expected))
+        for (patch, new_label, start, owner), (exp_patch, exp_label, exp_start, exp_owner) in zip(pooled, expected):
+            np.testing.assert_allclose(patch, exp_patch)
+            np.testing.assert_allclose(new_label, exp_label)
+            self.assertEqual((start, owner), (exp_start, exp_owner))
+        nb_pooled = sum(1 for window in expected if window[3] < 2)  # windows of the first 2 images share batches
+        self.assertEqual(batch_lens[:nb_pooled // batch_size], [batch_size] * (nb_pooled // batch_size))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 6:20 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import os
+
+import numpy as np
+import torch
+import medutils.medutils as futil
+from ssc_scoring.mymodules.data_synthesis import SysthesisNewSampled
+
+
+class TestSysthesisLabelNumbers(unittest.TestCase):
+    def test_label_numbers(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            for pattern in ['retp', 'gg']:
+                egg = np.random.randint(-1500, 1500, (16, 16)).astype(np.int16)
+                futil.save_itk(os.path.join(tempdir, pattern + '.mha'), egg, (0, 0), (1, 1))
+            synthesis = SysthesisNewSampled(key='image_key', retp_fpath=os.path.join(tempdir, 'retp.mha'),
+                                            gg_fpath=os.path.join(tempdir, 'gg.mha'), mode='train', sys_pro_in_0=0,
+                                            retp_blur=20, gg_blur=20, sampler=1, gen_gg_as_retp=1, gg_increase=0.1,
+                                            tr_x=[], weighted_syn_region=0, nb_workers=2, merge_every=1)
+
+            for label in [0, 0, 37]:  # sys_pro_in_0=0, no synthesis
+                synthesis({'image_key': torch.zeros((2, 2)), 'label_key': torch.tensor([label, 0, 0])})
+
+            expected = np.zeros((21,), dtype=np.int64)
+            expected[0], expected[7] = 2, 1
+            np.testing.assert_array_equal(synthesis.merged_label_numbers, expected)
+            self.assertEqual(synthesis.image_numbers.sum(0).tolist(), [3, 0])
+            self.assertFalse(synthesis._balanced(0))  # 2 images > 1.5 * 0 images of the rarest category
+            self.assertTrue(synthesis._balanced(12))
+            self.assertEqual(len(synthesis._balanced_categories()), 19)
+
+
+if __name__ == "__main__":
+    unittest.main()
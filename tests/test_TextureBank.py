@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 5:52 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import pickle
+import os
+
+import numpy as np
+import medutils.medutils as futil
+from ssc_scoring.mymodules.data_synthesis import TextureBank
+
+
+class TestTextureBank(unittest.TestCase):
+    def test_TextureBank(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            eggs_fpath = {}
+            for pattern in ['retp', 'gg']:
+                fpath = os.path.join(tempdir, pattern + '.mha')
+                futil.save_itk(fpath, np.random.randint(-1500, 1500, (16, 16)).astype(np.int16), (0, 0), (1, 1))
+                eggs_fpath[pattern] = [fpath]
+
+            bank = TextureBank(eggs_fpath, nb=3, image_size=32)
+            self.assertEqual(tuple(bank.candidates['retp'].shape), (3, 32, 32))
+            self.assertTrue(bank.candidates['gg'].is_shared())
+
+            candidate = bank.sample('retp')
+            self.assertEqual(candidate.shape, (32, 32))
+            self.assertEqual(candidate.dtype, np.float32)
+            self.assertTrue(0 <= candidate.min() and candidate.max() <= 1)
+
+            bank.refresh('gg', 0)
+            state = pickle.loads(pickle.dumps(bank)).__dict__
+            self.assertEqual(state['_temps'], {})  # tiled eggs are not sent to workers
+
+
+if __name__ == "__main__":
+    unittest.main()
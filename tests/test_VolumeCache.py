@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 9:58 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import tempfile
+import os
+
+from parameterized import parameterized
+import numpy as np
+import medutils.medutils as futil
+from ssc_scoring.mymodules.volume_cache import VolumeCache
+from ssc_scoring.mymodules.composed_trans import xformd_pos
+
+TEST_CASE_INT = [np.int16, np.int16]
+TEST_CASE_FLOAT = [np.float32, np.float32]
+
+
+class TestVolumeCache(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_INT, TEST_CASE_FLOAT])
+    def test_VolumeCache(self, img_dtype, cache_dtype):
+        with tempfile.TemporaryDirectory() as tempdir:
+            fpaths = []
+            for i in range(2):
+                img = np.random.randint(-3000, 3000, (30, 40, 50)).astype(img_dtype)
+                fpath = os.path.join(tempdir, 'Pat_00' + str(i) + '_CTimage.mha')
+                futil.save_itk(fpath, img, (-100, 2, 3), (1, 0.5, 0.5), dtype=img_dtype)
+                fpaths.append(fpath)
+
+            cache = VolumeCache([*fpaths, fpaths[0]])  # duplicated scans are stored once
+            self.assertEqual(len(cache), 2)
+            self.assertTrue(cache.volumes[fpaths[0]].is_shared())
+            self.assertEqual(cache.get(fpaths[1])[0].dtype, cache_dtype)
+            self.assertLessEqual(cache.get(fpaths[1])[0].max(), 1500)
+            with self.assertRaises(Exception):
+                cache.get(os.path.join(tempdir, 'Pat_099_CTimage.mha'))
+
+            for mode in ['valid', 'train']:
+                data = {'fpath_key': fpaths[0], 'world_key': np.array([-90, -85, -80, -75, -70])}
+                out_cached = xformd_pos(mode, z_size=20, y_size=30, x_size=30, volume_cache=cache)(dict(data))
+                self.assertEqual(out_cached['image_key'].shape, (1, 20, 30, 30))
+                self.assertEqual(np.asarray(out_cached['image_key']).dtype, np.float32)  # a tensor after monai noise
+                if mode == 'valid':  # deterministic, same as loading from disk
+                    out = xformd_pos(mode, z_size=20, y_size=30, x_size=30)(dict(data))
+                    np.testing.assert_allclose(out_cached['image_key'], out['image_key'], rtol=1e-5, atol=1e-5)
+                    np.testing.assert_array_equal(out_cached['label_in_patch_key'], out['label_in_patch_key'])
+            self.assertLessEqual(cache.get(fpaths[0])[0].max(), 1500)  # the cached scan is not modified
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# @Time    : 10/18/26 1:47 PM
+# @Author  : Jingnan
+# @Email   : jiajingnan2222@gmail.com
+
+import unittest
+import time
+import random
+
+from parameterized import parameterized
+from ssc_scoring.mymodules.tool import ordered_map
+
+
+def slow_square(x):
+    time.sleep(random.random() / 100)  # finish in random order
+    return x * x
+
+
+TEST_CASE_1 = [0, 'thread']
+TEST_CASE_2 = [4, 'thread']
+TEST_CASE_3 = [2, 'process']
+
+
+class TestOrderedMap(unittest.TestCase):
+    @parameterized.expand([TEST_CASE_1, TEST_CASE_2, TEST_CASE_3])
+    def test_ordered_map(self, workers, mode):
+        result = list(ordered_map(slow_square, range(20), workers, mode))
+        self.assertEqual(result, [i * i for i in range(20)])
+
+    def test_ordered_map_wrong_mode(self):
+        with self.assertRaises(Exception):
+            list(ordered_map(slow_square, range(2), 2, 'gpu'))
+
+
+if __name__ == "__main__":
+    unittest.main()